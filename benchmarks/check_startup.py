@@ -0,0 +1,131 @@
+import argparse
+import re
+import subprocess
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+# Command lines which must not import the modules for GitLab API access and logging
+FAST_COMMANDS = (
+    ("--version",),
+    ("--print-example-config",),
+    ("--print-example-repo-config",),
+    ("--help",),
+    ("--jobs", "not-a-number"),
+)
+HEAVY_MODULES = ("cerberus", "gitlab", "pygments", "requests", "urllib3", "yacl")
+# Modules which the fast command lines need anyway, their import time is the baseline of the time budget
+BASELINE_MODULES = ("argparse", "logging", "yaml")
+# The import time budget is the baseline plus this fraction of the baseline
+DEFAULT_MARGIN = 1.5
+DEFAULT_REPEAT = 5
+
+# Like the console script entry point, but with a fixed program name
+ENTRY_POINT = (
+    "import sys; sys.argv[0] = 'gitlab-multi-group-runner'; from gitlab_multi_group_runner.cli import main; main()"
+)
+IMPORT_TIME_REGEX = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure_import_time(arguments: List[str], first_modules: Tuple[str, ...]) -> Tuple[float, Set[str]]:
+    """Run the Python interpreter with `-X importtime` and the given arguments and return the import time of all
+    modules (including everything they import) from the first of `first_modules` on in milliseconds and the names of
+    all top level packages which were imported."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime"] + arguments,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    import_time = 0
+    first_module_imported = False
+    imported_packages = set()
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME_REGEX.match(line)
+        if match is None:
+            continue
+        cumulative_time, indentation, module_name = int(match.group(2)), match.group(3), match.group(4)
+        imported_packages.add(module_name.split(".")[0])
+        first_module_imported = first_module_imported or module_name.startswith(first_modules)
+        # Only count top level imports, nested imports are part of their cumulative time. Modules which are imported
+        # before the first of the given modules belong to the interpreter startup (e.g. `site`).
+        if first_module_imported and len(indentation) == 1:
+            import_time += cumulative_time
+    return import_time / 1000, imported_packages
+
+
+def measure_startup(command: Tuple[str, ...]) -> Tuple[float, Set[str]]:
+    """Run the command line interface and return the import time of this package in milliseconds and the names of all
+    top level packages which were imported."""
+    return measure_import_time(["-c", ENTRY_POINT] + list(command), ("gitlab_multi_group_runner",))
+
+
+def measure_baseline() -> float:
+    """Return the import time of the modules which the fast command lines need anyway in milliseconds."""
+    import_time, _ = measure_import_time(["-c", "import " + ", ".join(BASELINE_MODULES)], BASELINE_MODULES)
+    return import_time
+
+
+def get_argumentparser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Check that fast command line paths (e.g. `--version`) do not import heavy dependencies and stay "
+        "within an import time budget."
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        help="maximum import time of every fast command line in milliseconds (default: the import time of {} plus "
+        "the margin)".format(", ".join(BASELINE_MODULES)),
+    )
+    parser.add_argument(
+        "--margin",
+        type=float,
+        default=DEFAULT_MARGIN,
+        help="fraction of the baseline import time which is added to get the default budget (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help="number of measurements of every command line, the fastest one is used (default: %(default)s)",
+    )
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = get_argumentparser().parse_args(argv)
+    repeat = max(args.repeat, 1)
+    if args.budget is not None:
+        budget = args.budget
+    else:
+        baseline = min(measure_baseline() for _ in range(repeat))
+        budget = baseline * (1 + args.margin)
+        print("Import time budget: {:.1f} ms (baseline: {:.1f} ms)\n".format(budget, baseline))
+    failures = []
+    results: Dict[str, Tuple[float, List[str]]] = {}
+    for command in FAST_COMMANDS:
+        command_line = " ".join(command)
+        measurements = [measure_startup(command) for _ in range(repeat)]
+        import_time = min(measured_import_time for measured_import_time, _ in measurements)
+        # The imported modules do not depend on timing, so the first measurement is sufficient
+        heavy_modules = sorted(set(HEAVY_MODULES).intersection(measurements[0][1]))
+        results[command_line] = (import_time, heavy_modules)
+        if heavy_modules:
+            failures.append('"{}" imports {}'.format(command_line, ", ".join(heavy_modules)))
+        if import_time > budget:
+            failures.append(
+                '"{}" needs {:.1f} ms for imports (budget: {:.1f} ms)'.format(command_line, import_time, budget)
+            )
+    command_width = max(len(command_line) for command_line in results)
+    for command_line, (import_time, heavy_modules) in results.items():
+        print(
+            "{}  {:>8.1f} ms  {}".format(
+                command_line.ljust(command_width), import_time, ", ".join(heavy_modules) or "-"
+            )
+        )
+    if failures:
+        print("\nFailures:\n" + "\n".join("- " + failure for failure in failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
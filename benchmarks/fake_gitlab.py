@@ -0,0 +1,485 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import yaml
+
+from gitlab_multi_group_runner.profiling import get_endpoint
+from gitlab_multi_group_runner.repo_config import MULTI_GROUP_RUNNER_CONFIG_FILENAME
+
+API_PATH = "/api/v4"
+FAKE_GITLAB_VERSION = "14.0.0"
+GRAPHQL_PATH = "/api/graphql"
+# Requests to this path are not counted and not delayed, they control the fake server from the benchmark harness
+CONTROL_PATH = "/_benchmark"
+CONFIG_REPO_PATH = "admin/runner-config"
+CONFIG_REPO_BRANCH = "master"
+MAINTAINERS_GROUP_PATH = "maintainers"
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+MAINTAINER_ACCESS = 40
+OWNER_ACCESS = 50
+
+
+class FakeGitlabData:
+    """Synthetic GitLab instance with `groups` groups, `projects` projects spread evenly over these groups and
+    `runners` specific runners.
+
+    All runners are assigned to all groups by the config file of the config repository `admin/runner-config`. The
+    `maintainers` maintainers of the `maintainers` group are maintainers of every group, so all projects are allowed
+    by the rule `one_member_of: [maintainers]`. Shared runners are enabled in all projects and no runner is enabled yet.
+    """
+
+    def __init__(self, runners: int, projects: int, groups: int, maintainers: int = 3):
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self.groups: Dict[int, Dict[str, Any]] = {}
+        self.projects: Dict[int, Dict[str, Any]] = {}
+        self.runners: Dict[int, Dict[str, Any]] = {}
+        self.project_ids_by_group_id: Dict[int, List[int]] = {}
+        self.shared_project_ids_by_group_id: Dict[int, List[int]] = {}
+        # Maps group ids to the ids and access levels of their members
+        self.members_by_group_id: Dict[int, List[Tuple[int, int]]] = {}
+        self.runner_ids_by_project_id: Dict[int, Set[int]] = {}
+        self.lock = threading.Lock()
+
+        admin_user_id = self._add_user("admin")
+        maintainer_ids = [self._add_user("maintainer-{}".format(i + 1)) for i in range(maintainers)]
+        self._add_group(MAINTAINERS_GROUP_PATH, [(user_id, OWNER_ACCESS) for user_id in maintainer_ids])
+        group_paths = ["group-{:03d}".format(i + 1) for i in range(groups)]
+        group_ids = [
+            self._add_group(group_path, [(user_id, MAINTAINER_ACCESS) for user_id in maintainer_ids])
+            for group_path in group_paths
+        ]
+        self._add_project("runner-config", self.get_user_namespace(admin_user_id))
+        for i in range(projects):
+            group_id = group_ids[i % groups]
+            self._add_project("project-{:06d}".format(i + 1), self.get_group_namespace(group_id))
+        for runner_id in range(1, runners + 1):
+            self.runners[runner_id] = {
+                "id": runner_id,
+                "description": "runner-{}".format(runner_id),
+                "runner_type": "project_type",
+                "active": True,
+                "is_shared": False,
+                "tag_list": ["benchmark"],
+            }
+        self.config_file = yaml.dump(
+            {"runners": [{"ids": list(self.runners), "groups_and_projects": group_paths}]}, default_flow_style=False
+        ).encode("utf-8")
+        self.group_ids_by_path = {group["full_path"]: group_id for group_id, group in self.groups.items()}
+        self.project_ids_by_path = {
+            project["path_with_namespace"]: project_id for project_id, project in self.projects.items()
+        }
+        self.user_ids_by_name = {user["username"]: user_id for user_id, user in self.users.items()}
+
+    def _add_user(self, username: str) -> int:
+        user_id = len(self.users) + 1
+        self.users[user_id] = {"id": user_id, "username": username, "name": username, "state": "active"}
+        return user_id
+
+    def _add_group(self, path: str, members: List[Tuple[int, int]]) -> int:
+        group_id = len(self.groups) + 1
+        self.groups[group_id] = {"id": group_id, "name": path, "path": path, "full_path": path}
+        self.project_ids_by_group_id[group_id] = []
+        self.shared_project_ids_by_group_id[group_id] = []
+        self.members_by_group_id[group_id] = members
+        return group_id
+
+    def get_group_namespace(self, group_id: int) -> Dict[str, Any]:
+        group = self.groups[group_id]
+        return {
+            "id": group_id,
+            "name": group["name"],
+            "path": group["path"],
+            "kind": "group",
+            "full_path": group["full_path"],
+        }
+
+    def get_user_namespace(self, user_id: int) -> Dict[str, Any]:
+        username = self.users[user_id]["username"]
+        # User namespaces have their own ids, offset them to keep them apart from group ids
+        return {"id": 100000 + user_id, "name": username, "path": username, "kind": "user", "full_path": username}
+
+    def _add_project(self, path: str, namespace: Dict[str, Any]) -> int:
+        project_id = len(self.projects) + 1
+        self.projects[project_id] = {
+            "id": project_id,
+            "name": path,
+            "path": path,
+            "path_with_namespace": "{}/{}".format(namespace["full_path"], path),
+            "namespace": namespace,
+            "shared_runners_enabled": True,
+            "shared_with_groups": [],
+        }
+        if namespace["kind"] == "group":
+            self.project_ids_by_group_id[namespace["id"]].append(project_id)
+        self.runner_ids_by_project_id[project_id] = set()
+        return project_id
+
+    def find_group_id(self, group_id_or_path: str) -> Optional[int]:
+        if group_id_or_path.isdigit():
+            return int(group_id_or_path) if int(group_id_or_path) in self.groups else None
+        return self.group_ids_by_path.get(group_id_or_path)
+
+    def find_project_id(self, project_id_or_path: str) -> Optional[int]:
+        if project_id_or_path.isdigit():
+            return int(project_id_or_path) if int(project_id_or_path) in self.projects else None
+        return self.project_ids_by_path.get(project_id_or_path)
+
+    def get_members(self, group_id: int) -> List[Dict[str, Any]]:
+        return [
+            dict(self.users[user_id], access_level=access_level)
+            for user_id, access_level in self.members_by_group_id[group_id]
+        ]
+
+    def share_project(self, project_id: int, group_id: int, group_access: int) -> None:
+        """Share a project with a group, so the group members become project members with at most `group_access`."""
+        self.projects[project_id]["shared_with_groups"].append(
+            {
+                "group_id": group_id,
+                "group_name": self.groups[group_id]["name"],
+                "group_full_path": self.groups[group_id]["full_path"],
+                "group_access_level": group_access,
+            }
+        )
+        self.shared_project_ids_by_group_id[group_id].append(project_id)
+
+    def get_project_members(self, project_id: int) -> List[Dict[str, Any]]:
+        """Return the project members like `members/all`, every user once with the highest access level."""
+        project = self.projects[project_id]
+        access_levels: Dict[int, int] = {}
+        if project["namespace"]["kind"] == "group":
+            access_levels.update(self.members_by_group_id[project["namespace"]["id"]])
+        for shared_with_group in project["shared_with_groups"]:
+            for user_id, access_level in self.members_by_group_id[shared_with_group["group_id"]]:
+                access_level = min(access_level, shared_with_group["group_access_level"])
+                access_levels[user_id] = max(access_levels.get(user_id, 0), access_level)
+        return [dict(self.users[user_id], access_level=access_level) for user_id, access_level in access_levels.items()]
+
+    def get_runner_details(self, runner_id: int) -> Dict[str, Any]:
+        with self.lock:
+            project_ids = [
+                project_id
+                for project_id, runner_ids in self.runner_ids_by_project_id.items()
+                if runner_id in runner_ids
+            ]
+        return dict(
+            self.runners[runner_id],
+            projects=[
+                {"id": project_id, "path_with_namespace": self.projects[project_id]["path_with_namespace"]}
+                for project_id in project_ids
+            ],
+        )
+
+
+class FakeGitlabError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class FakeGitlabRequestHandler(BaseHTTPRequestHandler):
+    # Keep connections alive like GitLab does, otherwise connection setup would dominate the measured time
+    protocol_version = "HTTP/1.1"
+    # Headers and body are sent separately, without this delayed acknowledgements would add 40 ms to every response
+    disable_nagle_algorithm = True
+    server: "FakeGitlabServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, status: int, body: Any = None, headers: Optional[Dict[str, str]] = None) -> None:
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8") if body is not None else b""
+        headers = dict(headers or {})
+        if self.command == "GET" and status == 200:
+            # Support conditional requests, so the response cache of `cache_dir` can be benchmarked as well
+            etag = 'W/"{}"'.format(hashlib.md5(data).hexdigest())
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                status, data = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain" if isinstance(body, bytes) else "application/json")
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def _send_page(self, items: List[Dict[str, Any]], query: Dict[str, str]) -> None:
+        page = max(int(query.get("page", 1)), 1)
+        per_page = min(max(int(query.get("per_page", DEFAULT_PER_PAGE)), 1), MAX_PER_PAGE)
+        total_pages = max((len(items) + per_page - 1) // per_page, 1)
+        headers = {
+            "X-Page": str(page),
+            "X-Per-Page": str(per_page),
+            "X-Total": str(len(items)),
+            "X-Total-Pages": str(total_pages),
+        }
+        if page < total_pages:
+            next_query = dict(query, page=str(page + 1), per_page=str(per_page))
+            next_url = "http://{}{}?{}".format(
+                self.headers["Host"],
+                urlsplit(self.path).path,
+                "&".join("{}={}".format(key, value) for key, value in next_query.items()),
+            )
+            headers["X-Next-Page"] = str(page + 1)
+            headers["Link"] = '<{}>; rel="next"'.format(next_url)
+        self._send(200, items[(page - 1) * per_page : page * per_page], headers)
+
+    def _read_body(self) -> Dict[str, Any]:
+        content = self._body
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return dict(json.loads(content or b"{}"))
+        return {key: values[0] for key, values in parse_qs(content.decode("utf-8")).items()}
+
+    def _handle(self) -> None:
+        url = urlsplit(self.path)
+        # Always consume the body, otherwise it would be read as the next request of the kept alive connection
+        content_length = int(self.headers.get("Content-Length", 0))
+        self._body = self.rfile.read(content_length) if content_length > 0 else b""
+        if url.path.startswith(CONTROL_PATH):
+            self._handle_control(url.path[len(CONTROL_PATH) :])
+            return
+        self.server.count_request(self.command, url.path)
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = url.path[len(API_PATH) :] if url.path.startswith(API_PATH) else url.path
+        try:
+            for method, path_regex, handler in self.server.routes:
+                match = path_regex.fullmatch(path)
+                if method == self.command and match is not None:
+                    handler(self, query, *(unquote(group) for group in match.groups()))
+                    return
+            raise FakeGitlabError(404, "404 Not Found")
+        except FakeGitlabError as e:
+            self._send(e.status, {"message": str(e)})
+
+    def _handle_control(self, path: str) -> None:
+        if path == "/stats" and self.command == "GET":
+            self._send(200, self.server.get_request_counts())
+        elif path == "/reset" and self.command == "POST":
+            self.server.reset_request_counts()
+            self._send(204)
+        else:
+            self._send(404, {"message": "404 Not Found"})
+
+    do_GET = do_HEAD = do_POST = do_PUT = _handle
+
+    @property
+    def data(self) -> FakeGitlabData:
+        return self.server.data
+
+    def _get_project_id(self, project_id_or_path: str) -> int:
+        project_id = self.data.find_project_id(project_id_or_path)
+        if project_id is None:
+            raise FakeGitlabError(404, "404 Project Not Found")
+        return project_id
+
+    def _get_group_id(self, group_id_or_path: str) -> int:
+        group_id = self.data.find_group_id(group_id_or_path)
+        if group_id is None:
+            raise FakeGitlabError(404, "404 Group Not Found")
+        return group_id
+
+    def list_projects(self, query: Dict[str, str]) -> None:
+        projects = list(self.data.projects.values())
+        if query.get("sort", "desc") == "desc":
+            projects.reverse()
+        self._send_page(projects, query)
+
+    def get_project(self, query: Dict[str, str], project_id_or_path: str) -> None:
+        self._send(200, self.data.projects[self._get_project_id(project_id_or_path)])
+
+    def update_project(self, query: Dict[str, str], project_id_or_path: str) -> None:
+        project = self.data.projects[self._get_project_id(project_id_or_path)]
+        project.update(self._read_body())
+        self._send(200, project)
+
+    def get_group(self, query: Dict[str, str], group_id_or_path: str) -> None:
+        self._send(200, self.data.groups[self._get_group_id(group_id_or_path)])
+
+    def list_group_projects(self, query: Dict[str, str], group_id_or_path: str) -> None:
+        # The synthetic groups have no subgroups, so `include_subgroups` does not change the listing
+        group_id = self._get_group_id(group_id_or_path)
+        project_ids = list(self.data.project_ids_by_group_id[group_id])
+        if query.get("with_shared", "true") == "true":
+            project_ids.extend(self.data.shared_project_ids_by_group_id[group_id])
+        self._send_page([self.data.projects[project_id] for project_id in project_ids], query)
+
+    def list_shared_group_projects(self, query: Dict[str, str], group_id_or_path: str) -> None:
+        project_ids = self.data.shared_project_ids_by_group_id[self._get_group_id(group_id_or_path)]
+        self._send_page([self.data.projects[project_id] for project_id in project_ids], query)
+
+    def list_subgroups(self, query: Dict[str, str], group_id_or_path: str) -> None:
+        self._get_group_id(group_id_or_path)
+        self._send_page([], query)
+
+    def list_group_members(self, query: Dict[str, str], group_id_or_path: str) -> None:
+        self._send_page(self.data.get_members(self._get_group_id(group_id_or_path)), query)
+
+    def list_project_members(self, query: Dict[str, str], project_id_or_path: str) -> None:
+        self._send_page(self.data.get_project_members(self._get_project_id(project_id_or_path)), query)
+
+    def get_namespace(self, query: Dict[str, str], namespace_id_or_path: str) -> None:
+        group_id = self.data.find_group_id(namespace_id_or_path)
+        if group_id is not None:
+            self._send(200, self.data.get_group_namespace(group_id))
+            return
+        user_id = self.data.user_ids_by_name.get(namespace_id_or_path)
+        if user_id is None:
+            raise FakeGitlabError(404, "404 Namespace Not Found")
+        self._send(200, self.data.get_user_namespace(user_id))
+
+    def list_users(self, query: Dict[str, str]) -> None:
+        user_id = self.data.user_ids_by_name.get(query.get("username", ""))
+        self._send_page([self.data.users[user_id]] if user_id is not None else [], query)
+
+    def get_version(self, query: Dict[str, str]) -> None:
+        self._send(200, {"version": FAKE_GITLAB_VERSION, "revision": "0000000"})
+
+    def get_user(self, query: Dict[str, str], user_id: str) -> None:
+        if int(user_id) not in self.data.users:
+            raise FakeGitlabError(404, "404 User Not Found")
+        self._send(200, self.data.users[int(user_id)])
+
+    def list_user_memberships(self, query: Dict[str, str], user_id: str) -> None:
+        memberships = [
+            {"source_id": group_id, "source_name": group["name"], "source_type": "Namespace", "access_level": access}
+            for group_id, group in self.data.groups.items()
+            for member_id, access in self.data.members_by_group_id[group_id]
+            if member_id == int(user_id)
+        ]
+        self._send_page(memberships, query)
+
+    def get_runner(self, query: Dict[str, str], runner_id: str) -> None:
+        if int(runner_id) not in self.data.runners:
+            raise FakeGitlabError(404, "404 Runner Not Found")
+        self._send(200, self.data.get_runner_details(int(runner_id)))
+
+    def list_project_runners(self, query: Dict[str, str], project_id_or_path: str) -> None:
+        project_id = self._get_project_id(project_id_or_path)
+        with self.data.lock:
+            runner_ids = sorted(self.data.runner_ids_by_project_id[project_id])
+        self._send_page([self.data.runners[runner_id] for runner_id in runner_ids], query)
+
+    def enable_project_runner(self, query: Dict[str, str], project_id_or_path: str) -> None:
+        project_id = self._get_project_id(project_id_or_path)
+        runner_id = int(self._read_body()["runner_id"])
+        if runner_id not in self.data.runners:
+            raise FakeGitlabError(404, "404 Runner Not Found")
+        with self.data.lock:
+            if runner_id in self.data.runner_ids_by_project_id[project_id]:
+                raise FakeGitlabError(409, "Runner has already been taken")
+            self.data.runner_ids_by_project_id[project_id].add(runner_id)
+        self._send(201, self.data.runners[runner_id])
+
+    def get_raw_file(self, query: Dict[str, str], project_id_or_path: str, file_path: str) -> None:
+        project_id = self._get_project_id(project_id_or_path)
+        if self.data.projects[project_id]["path_with_namespace"] != CONFIG_REPO_PATH:
+            raise FakeGitlabError(404, "404 File Not Found")
+        if file_path != MULTI_GROUP_RUNNER_CONFIG_FILENAME or query.get("ref") != CONFIG_REPO_BRANCH:
+            raise FakeGitlabError(404, "404 File Not Found")
+        commit_id = hashlib.sha1(self.data.config_file).hexdigest()
+        self._send(
+            200, self.data.config_file, {"X-Gitlab-Last-Commit-Id": commit_id, "X-Gitlab-Ref": CONFIG_REPO_BRANCH}
+        )
+
+    def graphql(self, query: Dict[str, str]) -> None:
+        # The query is not parsed, only the group projects query of `GraphQLGitlab` is supported. Like on GitLab, the
+        # projects shared with the group are not listed.
+        variables = self._read_body().get("variables") or {}
+        group_id = self.data.find_group_id(str(variables.get("fullPath", "")))
+        if group_id is None:
+            self._send(200, {"data": {"group": None}})
+            return
+        project_ids = self.data.project_ids_by_group_id[group_id]
+        start = int(variables.get("after") or 0)
+        end = start + int(variables["projectsPerPage"])
+        project_nodes = []
+        for project_id in project_ids[start:end]:
+            project = self.data.projects[project_id]
+            members = [
+                {
+                    "accessLevel": {"integerValue": member["access_level"]},
+                    "user": {"id": "gid://gitlab/User/{}".format(member["id"]), "username": member["username"]},
+                }
+                for member in self.data.get_project_members(project_id)
+            ]
+            project_nodes.append(
+                {
+                    "id": "gid://gitlab/Project/{}".format(project_id),
+                    "fullPath": project["path_with_namespace"],
+                    "sharedRunnersEnabled": project["shared_runners_enabled"],
+                    "namespace": {"fullPath": project["namespace"]["full_path"]},
+                    "projectMembers": {
+                        "pageInfo": {"hasNextPage": len(members) > int(variables["membersPerProject"])},
+                        "nodes": members[: int(variables["membersPerProject"])],
+                    },
+                }
+            )
+        page_info = {"hasNextPage": end < len(project_ids), "endCursor": str(end)}
+        self._send(200, {"data": {"group": {"projects": {"pageInfo": page_info, "nodes": project_nodes}}}})
+
+
+ROUTES: List[Tuple[str, str, Callable[..., None]]] = [
+    ("GET", r"/version", FakeGitlabRequestHandler.get_version),
+    ("GET", r"/projects", FakeGitlabRequestHandler.list_projects),
+    ("GET", r"/projects/([^/]+)", FakeGitlabRequestHandler.get_project),
+    ("PUT", r"/projects/([^/]+)", FakeGitlabRequestHandler.update_project),
+    ("GET", r"/projects/([^/]+)/members/all", FakeGitlabRequestHandler.list_project_members),
+    ("GET", r"/projects/([^/]+)/runners", FakeGitlabRequestHandler.list_project_runners),
+    ("POST", r"/projects/([^/]+)/runners", FakeGitlabRequestHandler.enable_project_runner),
+    ("GET", r"/projects/([^/]+)/repository/files/([^/]+)/raw", FakeGitlabRequestHandler.get_raw_file),
+    ("HEAD", r"/projects/([^/]+)/repository/files/([^/]+)", FakeGitlabRequestHandler.get_raw_file),
+    ("GET", r"/groups/([^/]+)", FakeGitlabRequestHandler.get_group),
+    ("GET", r"/groups/([^/]+)/projects", FakeGitlabRequestHandler.list_group_projects),
+    ("GET", r"/groups/([^/]+)/projects/shared", FakeGitlabRequestHandler.list_shared_group_projects),
+    ("GET", r"/groups/([^/]+)/subgroups", FakeGitlabRequestHandler.list_subgroups),
+    ("GET", r"/groups/([^/]+)/members/all", FakeGitlabRequestHandler.list_group_members),
+    ("GET", r"/namespaces/([^/]+)", FakeGitlabRequestHandler.get_namespace),
+    ("GET", r"/users", FakeGitlabRequestHandler.list_users),
+    ("GET", r"/users/(\d+)", FakeGitlabRequestHandler.get_user),
+    ("GET", r"/users/(\d+)/memberships", FakeGitlabRequestHandler.list_user_memberships),
+    ("GET", r"/runners/(\d+)", FakeGitlabRequestHandler.get_runner),
+    ("POST", GRAPHQL_PATH, FakeGitlabRequestHandler.graphql),
+]
+
+
+class FakeGitlabServer(ThreadingMixIn, HTTPServer):
+    """HTTP server which answers the GitLab API requests of this tool from a `FakeGitlabData` instance.
+
+    Every API request is delayed by `latency` seconds (concurrent requests are delayed concurrently) and counted by
+    endpoint type. The counts can be read from `/_benchmark/stats` and reset with a `POST` to `/_benchmark/reset`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], data: FakeGitlabData, latency: float = 0.0):
+        super().__init__(address, FakeGitlabRequestHandler)
+        self.data = data
+        self.latency = latency
+        self.routes = [(method, re.compile(path_regex), handler) for method, path_regex, handler in ROUTES]
+        self._request_counts: Dict[str, int] = {}
+        self._request_counts_lock = threading.Lock()
+
+    def count_request(self, method: str, path: str) -> None:
+        endpoint = get_endpoint(method, path, API_PATH)
+        with self._request_counts_lock:
+            self._request_counts[endpoint] = self._request_counts.get(endpoint, 0) + 1
+
+    def get_request_counts(self) -> Dict[str, int]:
+        with self._request_counts_lock:
+            return dict(sorted(self._request_counts.items()))
+
+    def reset_request_counts(self) -> None:
+        with self._request_counts_lock:
+            self._request_counts.clear()
@@ -0,0 +1,259 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.request import Request, urlopen
+
+from gitlab_multi_group_runner.gitlab import assign_multi_group_runner
+
+from .fake_gitlab import CONFIG_REPO_BRANCH, CONFIG_REPO_PATH, MAINTAINERS_GROUP_PATH, FakeGitlabData, FakeGitlabServer
+
+# Runs of every scenario: the first run enables all runners, the second run finds nothing to change
+RUNS = ("initial", "repeated")
+
+
+class Scenario:
+    def __init__(self, name: str, runners: int, projects: int, groups: int):
+        self.name = name
+        self.runners = runners
+        self.projects = projects
+        self.groups = groups
+
+    def __str__(self) -> str:
+        return "{} runners x {} projects x {} groups".format(self.runners, self.projects, self.groups)
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (
+        Scenario("small", runners=2, projects=200, groups=5),
+        Scenario("medium", runners=10, projects=5000, groups=20),
+        Scenario("large", runners=10, projects=20000, groups=50),
+        Scenario("huge", runners=10, projects=100000, groups=100),
+    )
+}
+DEFAULT_SCENARIOS = ("small", "medium")
+
+
+def get_peak_rss() -> int:
+    """Return the peak resident set size of this process in bytes.
+
+    The fake GitLab server runs in a separate process, so this only covers the measured code (and the harness).
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def serve_fake_gitlab(
+    scenario: Scenario, latency: float, address_queue: "multiprocessing.Queue[Tuple[str, int]]"
+) -> None:
+    server = FakeGitlabServer(
+        ("127.0.0.1", 0), FakeGitlabData(scenario.runners, scenario.projects, scenario.groups), latency
+    )
+    host, port = server.server_address[:2]
+    address_queue.put((str(host), int(port)))
+    server.serve_forever()
+
+
+class FakeGitlabProcess:
+    """Runs a `FakeGitlabServer` in a separate process, so the server does not compete with the measured code for
+    the global interpreter lock."""
+
+    def __init__(self, scenario: Scenario, latency: float):
+        address_queue: "multiprocessing.Queue[Tuple[str, int]]" = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=serve_fake_gitlab, args=(scenario, latency, address_queue), daemon=True
+        )
+        self._process.start()
+        host, port = address_queue.get()
+        self.url = "http://{}:{}".format(host, port)
+
+    def __enter__(self) -> "FakeGitlabProcess":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self._process.terminate()
+        self._process.join()
+
+    def get_request_counts(self) -> Dict[str, int]:
+        with urlopen(self.url + "/_benchmark/stats") as response:
+            return dict(json.load(response))
+
+    def reset_request_counts(self) -> None:
+        urlopen(Request(self.url + "/_benchmark/reset", method="POST")).close()
+
+
+def run_scenario(scenario: Scenario, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results = []
+    with FakeGitlabProcess(scenario, args.latency / 1000) as fake_gitlab, tempfile.TemporaryDirectory() as cache_dir:
+        for run in RUNS:
+            fake_gitlab.reset_request_counts()
+            start_time = time.monotonic()
+            run_without_warnings = assign_multi_group_runner(
+                fake_gitlab.url,
+                "benchmark-token",
+                list(range(1, scenario.runners + 1)),
+                CONFIG_REPO_PATH,
+                CONFIG_REPO_BRANCH,
+                {"one_member_of": [MAINTAINERS_GROUP_PATH]},
+                disable_shared_runners=True,
+                dry_run=args.dry_run,
+                max_workers=args.max_workers,
+                backend=args.backend,
+                precompute_allowed_projects=args.precompute_allowed_projects,
+                cache_dir=cache_dir if args.cache else None,
+                stream_changes=args.stream_changes,
+            )
+            wall_time = time.monotonic() - start_time
+            peak_rss = get_peak_rss()
+            request_counts = fake_gitlab.get_request_counts()
+            results.append(
+                {
+                    "scenario": scenario.name,
+                    "run": run,
+                    "wall_time": wall_time,
+                    "requests": sum(request_counts.values()),
+                    "requests_by_endpoint": request_counts,
+                    "peak_rss": peak_rss,
+                    "run_without_warnings": run_without_warnings,
+                }
+            )
+    return results
+
+
+def print_results(results: List[Dict[str, Any]], show_endpoints: bool) -> None:
+    rows = [("Scenario", "Run", "Wall time", "Requests", "Peak RSS", "Warnings")]
+    for result in results:
+        rows.append(
+            (
+                str(SCENARIOS[result["scenario"]]),
+                result["run"],
+                "{:.2f} s".format(result["wall_time"]),
+                str(result["requests"]),
+                "{:.0f} MiB".format(result["peak_rss"] / 2 ** 20),
+                "no" if result["run_without_warnings"] else "yes",
+            )
+        )
+    column_widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for i, row in enumerate(rows):
+        print(
+            "  ".join([row[0].ljust(column_widths[0])] + [cell.rjust(w) for cell, w in zip(row[1:], column_widths[1:])])
+        )
+        if i == 0:
+            print("  ".join("-" * width for width in column_widths))
+    if show_endpoints:
+        for result in results:
+            print("\n{} ({} run):".format(SCENARIOS[result["scenario"]], result["run"]))
+            for endpoint, count in result["requests_by_endpoint"].items():
+                print("  {:>8}  {}".format(count, endpoint))
+
+
+def find_regressions(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Compare `results` with the results of a previous `--json` output.
+
+    Request counts are deterministic, so every additional request is a regression. Wall times and peak memory usage vary
+    between runs and are only reported if they exceed the baseline by more than `tolerance` (a fraction).
+    """
+    baseline_results = {(result["scenario"], result["run"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get((result["scenario"], result["run"]))
+        if baseline_result is None:
+            continue
+        name = "{} ({} run)".format(result["scenario"], result["run"])
+        if result["requests"] > baseline_result["requests"]:
+            regressions.append(
+                "{}: {} requests instead of {}".format(name, result["requests"], baseline_result["requests"])
+            )
+        if result["wall_time"] > baseline_result["wall_time"] * (1 + tolerance):
+            regressions.append(
+                "{}: {:.2f} s instead of {:.2f} s".format(name, result["wall_time"], baseline_result["wall_time"])
+            )
+        if "peak_rss" in baseline_result and result["peak_rss"] > baseline_result["peak_rss"] * (1 + tolerance):
+            regressions.append(
+                "{}: {:.0f} MiB peak RSS instead of {:.0f} MiB".format(
+                    name, result["peak_rss"] / 2 ** 20, baseline_result["peak_rss"] / 2 ** 20
+                )
+            )
+    return regressions
+
+
+def get_argumentparser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Benchmark `assign_multi_group_runner` against a local fake GitLab API with synthetic data."
+    )
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        metavar="SCENARIO",
+        help="scenarios to run, one of {} (default: {})".format(
+            ", ".join('"{}" ({})'.format(name, scenario) for name, scenario in SCENARIOS.items()),
+            ", ".join(DEFAULT_SCENARIOS),
+        ),
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=10.0,
+        help="latency of every API request in milliseconds (default: %(default)s)",
+    )
+    parser.add_argument("-j", "--jobs", type=int, dest="max_workers", default=8, help="value of `max_workers`")
+    parser.add_argument("--backend", choices=("sync", "async", "graphql"), default="sync", help="value of `backend`")
+    parser.add_argument(
+        "--precompute-allowed-projects", action="store_true", help="enable `precompute_allowed_projects`"
+    )
+    parser.add_argument("--stream-changes", action="store_true", help="enable `stream_changes`")
+    parser.add_argument("--cache", action="store_true", help="use a (new) `cache_dir` for every scenario")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="do not enable any runners")
+    parser.add_argument("--endpoints", action="store_true", help="print the request counts by endpoint")
+    parser.add_argument("--json", dest="json_filepath", metavar="FILE", help="write the results as JSON to FILE")
+    parser.add_argument(
+        "--compare",
+        dest="baseline_filepath",
+        metavar="FILE",
+        help="compare with the JSON results of a previous run and exit with code 1 on regressions",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed relative increase of the wall time in comparisons (default: %(default)s)",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the log messages of every run")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = get_argumentparser()
+    args = parser.parse_args(argv)
+    unknown_scenarios = [scenario_name for scenario_name in args.scenarios if scenario_name not in SCENARIOS]
+    if unknown_scenarios:
+        parser.error("unknown scenarios: {}".format(", ".join(unknown_scenarios)))
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR, format="%(levelname)s: %(message)s")
+    results = []
+    for scenario_name in args.scenarios or DEFAULT_SCENARIOS:
+        results.extend(run_scenario(SCENARIOS[scenario_name], args))
+    print_results(results, args.endpoints)
+    if args.json_filepath is not None:
+        options = {
+            key: getattr(args, key)
+            for key in ("latency", "max_workers", "backend", "precompute_allowed_projects", "cache", "dry_run")
+        }
+        with open(args.json_filepath, "w", encoding="utf-8") as json_file:
+            json.dump({"options": options, "results": results}, json_file, indent=2)
+    if args.baseline_filepath is not None:
+        with open(args.baseline_filepath, "r", encoding="utf-8") as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("\nRegressions:\n" + "\n".join("- " + regression for regression in regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
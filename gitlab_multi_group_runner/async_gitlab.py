@@ -0,0 +1,138 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, TypeVar, cast
+
+from gitlab.v4.objects import Group as GitlabGroup
+from requests import Response
+
+from .gitlab import PROJECT_MEMBERS_PATH, PROJECT_RUNNERS_PATH, Gitlab
+from .log_buffer import get_logger
+from .plan import RunnerActivationPlan
+from .records import MemberRecord, ProjectRecord
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+PER_PAGE = 100
+
+
+class AsyncGitlab(Gitlab):
+    """GitLab wrapper which runs all listings and runner assignments on one asyncio event loop.
+
+    The HTTP transport is still the pooled keep-alive session of python-gitlab. Blocking requests are dispatched from
+    the event loop to a thread pool of `max_workers` threads, which bounds the number of concurrent API calls. Paginated
+    listings fetch the first page, read the total page count from the response headers and request all remaining pages
+    at once.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._http_executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="gitlab-http")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+
+    def close(self) -> None:
+        """Stop the event loop and the HTTP thread pool and close the HTTP session."""
+        with self._loop_lock:
+            if self._loop is not None and self._loop_thread is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop_thread.join()
+                self._loop.close()
+                self._loop = self._loop_thread = None
+        self._http_executor.shutdown()
+        super().close()
+
+    def _run(self, coroutine: Awaitable[T]) -> T:
+        # The event loop runs in a background thread, so coroutines can be submitted from any thread (including the
+        # worker threads of `map_concurrently`) without nesting event loops.
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever, name="gitlab-event-loop", daemon=True
+                )
+                self._loop_thread.start()
+        return cast(T, asyncio.run_coroutine_threadsafe(cast(Any, coroutine), self._loop).result())
+
+    async def _http(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        # `asyncio.get_running_loop` needs Python 3.7, inside of a coroutine this returns the running loop as well
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._http_executor, partial(function, *args, **kwargs))
+
+    async def _list_all(self, path: str, query_data: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        async def get_page(page: int) -> Response:
+            page_query_data = dict(query_data or {}, page=page, per_page=PER_PAGE)
+            return cast(Response, await self._http(self._gitlab.http_get, path, query_data=page_query_data, raw=True))
+
+        response = await get_page(1)
+        items = cast(List[Dict[str, Any]], response.json())
+        total_pages = response.headers.get("X-Total-Pages")
+        if total_pages:
+            for page_response in await asyncio.gather(*(get_page(page) for page in range(2, int(total_pages) + 1))):
+                items.extend(page_response.json())
+        else:
+            # GitLab omits the total count for very large collections, so the pages must be followed one by one
+            next_page = response.headers.get("X-Next-Page")
+            while next_page:
+                response = await get_page(int(next_page))
+                items.extend(response.json())
+                next_page = response.headers.get("X-Next-Page")
+        return items
+
+    def _list_group_projects(self, group: GitlabGroup, include_subgroups: bool = False) -> List[ProjectRecord]:
+        query_data = {"include_subgroups": "true"} if include_subgroups else None
+        project_dicts = self._run(self._list_all(group.projects.path, query_data))
+        return [self._project_from_listing(project_dict) for project_dict in project_dicts]
+
+    def _list_subgroups(self, group: GitlabGroup) -> List[GitlabGroup]:
+        subgroup_dicts = self._run(self._list_all(group.subgroups.path))
+        return [GitlabGroup(self._gitlab.groups, subgroup_dict) for subgroup_dict in subgroup_dicts]
+
+    def _list_group_member_ids(self, group: GitlabGroup, minimum_role: int) -> FrozenSet[int]:
+        member_dicts = self._run(self._list_all(group.members_all.path))
+        return frozenset(
+            member_dict["id"] for member_dict in member_dicts if member_dict["access_level"] >= minimum_role
+        )
+
+    def _list_project_members(self, project: ProjectRecord, minimum_role: int) -> List[MemberRecord]:
+        member_dicts = self._run(self._list_all(PROJECT_MEMBERS_PATH.format(project.id)))
+        return [
+            MemberRecord.from_attributes(member_dict)
+            for member_dict in member_dicts
+            if member_dict["access_level"] >= minimum_role
+        ]
+
+    def get_enabled_runner_ids(self, projects: Iterable[ProjectRecord]) -> Dict[int, FrozenSet[int]]:
+        async def list_project_runner_ids(project: ProjectRecord) -> FrozenSet[int]:
+            return frozenset(
+                runner_dict["id"] for runner_dict in await self._list_all(PROJECT_RUNNERS_PATH.format(project.id))
+            )
+
+        async def list_all_project_runner_ids() -> List[FrozenSet[int]]:
+            return list(await asyncio.gather(*(list_project_runner_ids(project) for project in projects)))
+
+        projects = list(projects)
+        return {
+            project.id: runner_ids for project, runner_ids in zip(projects, self._run(list_all_project_runner_ids()))
+        }
+
+    def _apply_runner_activation_changes(self, plan: RunnerActivationPlan) -> List[str]:
+        # The blocking write methods of the base class are dispatched to the HTTP thread pool, so the changes of all
+        # projects are pipelined with at most `max_workers` requests in flight
+        async def apply_project_changes(
+            project_id: int, disable_shared_runners: bool, runner_ids: List[int]
+        ) -> List[str]:
+            return await self._http(self._apply_project_changes, plan, project_id, disable_shared_runners, runner_ids)
+
+        async def apply_all_changes() -> List[List[str]]:
+            return list(
+                await asyncio.gather(
+                    *(apply_project_changes(*project_changes) for project_changes in plan.iter_changes_by_project())
+                )
+            )
+
+        return [failure for failures in self._run(apply_all_changes()) for failure in failures]
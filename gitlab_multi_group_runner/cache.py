@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from requests import PreparedRequest, Response
+from requests.structures import CaseInsensitiveDict
+
+from .ratelimit import RateLimitingHTTPAdapter
+
+# These headers describe the transferred bytes and not the (already decoded) cached body
+_UNCACHED_HEADERS = ("Content-Encoding", "Content-Length", "Transfer-Encoding", "Connection")
+MODIFYING_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+# Requests to this endpoint are POSTs, but the GraphQL backend only sends read-only queries
+GRAPHQL_PATH = "/api/graphql"
+# Marks responses which replace a `304 Not Modified` answer, whose body was not transferred
+FROM_CACHE_ATTRIBUTE = "from_cache"
+
+
+def is_cached_response(response: Response) -> bool:
+    """Return `True` if `response` was built from the cache because the server answered `304 Not Modified`."""
+    return bool(getattr(response, FROM_CACHE_ATTRIBUTE, False))
+
+
+class ResponseCache:
+    """On-disk cache of GET responses and their ETags, keyed by URL.
+
+    Every URL path gets its own directory, so all cached queries of a resource can be invalidated at once.
+    """
+
+    def __init__(self, cache_dir: str):
+        self._cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        os.makedirs(self._cache_dir, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def _path_dir(self, url: str) -> str:
+        url_parts = urlsplit(url)
+        path_key = "{}://{}{}".format(url_parts.scheme, url_parts.netloc, url_parts.path.rstrip("/"))
+        return os.path.join(self._cache_dir, hashlib.sha256(path_key.encode("utf-8")).hexdigest())
+
+    def _entry_filepath(self, url: str) -> str:
+        return os.path.join(self._path_dir(url), hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._entry_filepath(url) + ".json", "r", encoding="utf-8") as metadata_file:
+                metadata: Dict[str, Any] = json.load(metadata_file)
+            with open(self._entry_filepath(url) + ".body", "rb") as body_file:
+                metadata["body"] = body_file.read()
+        except (OSError, ValueError):
+            return None
+        return metadata
+
+    def put(self, url: str, response: Response) -> None:
+        metadata = {
+            "url": url,
+            "etag": response.headers["ETag"],
+            "encoding": response.encoding,
+            "headers": {key: value for key, value in response.headers.items() if key not in _UNCACHED_HEADERS},
+        }
+        entry_filepath = self._entry_filepath(url)
+        os.makedirs(os.path.dirname(entry_filepath), mode=0o700, exist_ok=True)
+        # Write to temporary files first, so concurrent readers never see partially written entries
+        for suffix, content in ((".body", response.content), (".json", json.dumps(metadata).encode("utf-8"))):
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(entry_filepath), delete=False) as temp_file:
+                temp_file.write(content)
+            os.replace(temp_file.name, entry_filepath + suffix)
+
+    def invalidate(self, url: str) -> None:
+        """Remove all cached responses of the resource `url` (including all of its query variants)."""
+        shutil.rmtree(self._path_dir(url), ignore_errors=True)
+
+    def count_hit(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+
+class CachingHTTPAdapter(RateLimitingHTTPAdapter):
+    """Transport adapter which revalidates cached GET responses with `If-None-Match` requests.
+
+    A `304 Not Modified` answer is replaced by the cached response, so callers always see a complete `200` response.
+    Successful modifying requests (`POST`, `PUT`, `PATCH` and `DELETE`, but not GraphQL queries) invalidate the cached
+    responses of their URL. Revalidation requests are rate limited like all other requests.
+    """
+
+    def __init__(self, cache: ResponseCache, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._cache = cache
+
+    def send(self, request: PreparedRequest, *args: Any, **kwargs: Any) -> Response:
+        assert request.url is not None
+        if request.method != "GET":
+            response = super().send(request, *args, **kwargs)
+            if response.ok and self._is_modifying(request):
+                self._cache.invalidate(request.url)
+            return response
+        if kwargs.get("stream", False):
+            return super().send(request, *args, **kwargs)
+        cached_entry = self._cache.get(request.url)
+        if cached_entry is not None:
+            request.headers["If-None-Match"] = cached_entry["etag"]
+        response = super().send(request, *args, **kwargs)
+        if response.status_code == 304 and cached_entry is not None:
+            self._cache.count_hit(True)
+            return self._build_cached_response(request, cached_entry, response)
+        self._cache.count_hit(False)
+        if response.status_code == 200 and "ETag" in response.headers:
+            self._cache.put(request.url, response)
+        return response
+
+    @staticmethod
+    def _is_modifying(request: PreparedRequest) -> bool:
+        assert request.url is not None
+        return request.method in MODIFYING_METHODS and not urlsplit(request.url).path.rstrip("/").endswith(GRAPHQL_PATH)
+
+    @staticmethod
+    def _build_cached_response(
+        request: PreparedRequest, cached_entry: Dict[str, Any], not_modified_response: Response
+    ) -> Response:
+        response = Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(cached_entry["headers"])
+        # Pagination headers may change even if the page itself did not (for example the total count)
+        for key, value in not_modified_response.headers.items():
+            if key.lower().startswith("x-") and key not in _UNCACHED_HEADERS:
+                response.headers[key] = value
+        response._content = cached_entry["body"]
+        response.encoding = cached_entry["encoding"]
+        response.url = cached_entry["url"]
+        response.request = request
+        response.connection = not_modified_response.connection
+        response.elapsed = not_modified_response.elapsed
+        setattr(response, FROM_CACHE_ATTRIBUTE, True)
+        return response
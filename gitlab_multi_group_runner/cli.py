@@ -2,28 +2,50 @@ import argparse
 import logging
 import os
 import sys
-from typing import Any, Dict, List, Optional
-
-from yacl import TerminalColorCodes, setup_colored_exceptions, setup_colored_stderr_logging
+from typing import TYPE_CHECKING, Any, Collection, Dict, List, Optional, Set, Tuple, Type, cast
 
 from ._version import __version__
 from .config import DEFAULT_CONFIG_FILEPATH, Config, ConfigValidationFailedError, config
-from .gitlab import (
-    NoConfigFileFoundError,
-    NoMatchingGroupError,
-    NoMatchingProjectError,
-    NoMatchingRunnerError,
-    assign_multi_group_runner,
-    write_example_multi_group_runner_config,
-)
+from .log_buffer import get_logger
+from .repo_config import write_example_multi_group_runner_config
+
+if TYPE_CHECKING:
+    from .gitlab import Gitlab
+    from .profiling import Profiler
+    from .shard import Shard
 
-logger = logging.getLogger(__name__)
+# Modules which need python-gitlab, requests or yacl are imported by the functions which use them. Thus, `--version`,
+# `--print-example-config`, `--print-example-repo-config` and argument errors do not pay for their import time.
+
+logger = get_logger(__name__)
 
 
 class NoMatchingRunnerConfigError(Exception):
     pass
 
 
+def get_run_exceptions() -> Tuple[Type[Exception], ...]:
+    """Return the expected errors of a run, which are reported with the exit codes 5, 6, ... in this order."""
+    from .gitlab import NoConfigFileFoundError, NoMatchingGroupError, NoMatchingProjectError, NoMatchingRunnerError
+
+    return (
+        NoMatchingRunnerConfigError,
+        NoConfigFileFoundError,
+        NoMatchingProjectError,
+        NoMatchingGroupError,
+        NoMatchingRunnerError,
+    )
+
+
+def parse_shard(shard_str: str) -> "Shard":
+    from .shard import Shard
+
+    try:
+        return Shard.parse(shard_str)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+
+
 def get_argumentparser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -47,19 +69,74 @@ def get_argumentparser() -> argparse.ArgumentParser:
         default=DEFAULT_CONFIG_FILEPATH,
         help='custom configuration file path (default: "%(default)s")',
     )
-    parser.add_argument("-n", "--dry-run", action="store_true", dest="dry_run", help="only show what would be executed")
     parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        dest="max_workers",
+        type=int,
+        help="number of concurrent GitLab API requests (default: `max_workers` of the config file)",
+    )
+    parser.add_argument(
+        "--listen-for-system-hooks",
+        action="store",
+        dest="system_hooks_address",
+        metavar="[HOST:]PORT",
+        help="run an HTTP server which receives GitLab system hook events and configures new and changed projects of "
+        "all config repositories",
+    )
+    parser.add_argument("-n", "--dry-run", action="store_true", dest="dry_run", help="only show what would be executed")
+    print_example_group = parser.add_mutually_exclusive_group()
+    print_example_group.add_argument(
         "--print-example-config",
         action="store_true",
         dest="print_example_config",
         help="print an example configuration to stdout and exit",
     )
-    parser.add_argument(
+    print_example_group.add_argument(
         "--print-example-repo-config",
         action="store_true",
         dest="print_example_repo_config",
         help="print an example configuration for a multi group runner config repository to stdout and exit",
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        dest="profile",
+        help="print the number, latency and size of GitLab API requests and the time of each phase to stderr",
+    )
+    parser.add_argument(
+        "--profile-json",
+        action="store",
+        dest="profile_json_filepath",
+        metavar="FILE",
+        help="write the profile as JSON to the given file (implies `--profile`)",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store",
+        dest="serve_address",
+        metavar="[HOST:]PORT",
+        help="keep running and reconcile the runner assignments on `POST` requests to `http://[HOST:]PORT/reconcile` "
+        "(host defaults to 127.0.0.1), reusing the GitLab session and caches of previous runs",
+    )
+    parser.add_argument(
+        "--interval",
+        action="store",
+        dest="serve_interval",
+        type=float,
+        metavar="SECONDS",
+        help="reconcile all config repositories at startup and then every SECONDS (only with `--serve`)",
+    )
+    parser.add_argument(
+        "--shard",
+        action="store",
+        dest="shard",
+        type=parse_shard,
+        metavar="INDEX/COUNT",
+        help="only configure the projects of one of COUNT disjoint slices (numbered from 1, e.g. `--shard 2/4`), so "
+        "multiple hosts can configure a large instance in parallel",
+    )
     parser.add_argument(
         "-V", "--version", action="store_true", dest="print_version", help="print the version number and exit"
     )
@@ -79,12 +156,23 @@ def parse_arguments() -> argparse.Namespace:
 
 
 def check_arguments(args: argparse.Namespace) -> None:
-    if args.print_example_config and args.print_example_repo_config:
-        logger.error('"--print-example-config" and "--print-example-repo-config" cannot be passed together.')
+    if args.system_hooks_address is not None and not args.system_hooks_address.rpartition(":")[2].isdigit():
+        logger.error('"--listen-for-system-hooks" needs a port number, optionally prefixed by a host and a colon.')
+        sys.exit(1)
+    if args.serve_address is not None and not args.serve_address.rpartition(":")[2].isdigit():
+        logger.error('"--serve" needs a port number, optionally prefixed by a host and a colon.')
+        sys.exit(1)
+    if args.serve_interval is not None and (args.serve_address is None or args.serve_interval <= 0):
+        logger.error('"--interval" must be a positive number and can only be used with "--serve".')
+        sys.exit(1)
+    if args.max_workers is not None and args.max_workers < 1:
+        logger.error('"--jobs" must be a positive number.')
         sys.exit(1)
 
 
 def setup_logging(debug: bool = False) -> None:
+    from yacl import TerminalColorCodes, setup_colored_exceptions, setup_colored_stderr_logging
+
     if debug:
         logging.basicConfig(level=logging.DEBUG)
         setup_colored_stderr_logging(keyword_colors={r"`([^`]+)`": TerminalColorCodes.cyan})
@@ -107,10 +195,176 @@ def find_matching_runner_config(all_runner_configs: List[Dict[str, Any]], repo_p
     return None
 
 
+def get_runner_configs(config_repository_path: Optional[str]) -> List[Dict[str, Any]]:
+    """Return the runner config of `config_repository_path` or all runner configs if `None` is given."""
+    if config_repository_path is None:
+        return cast(List[Dict[str, Any]], config()["runners"])
+    matching_runner_config = find_matching_runner_config(config()["runners"], config_repository_path)
+    if matching_runner_config is None:
+        raise NoMatchingRunnerConfigError(
+            'Could not find a matching configuration entry for the configuration repository "{}".'.format(
+                config_repository_path
+            )
+        )
+    return [matching_runner_config]
+
+
+def create_gitlab_from_config(args: argparse.Namespace, profiler: Optional["Profiler"] = None) -> "Gitlab":
+    from .gitlab import create_gitlab
+
+    config_general = config()["general"]
+    config_gitlab = config()["gitlab"]
+    gitlab = create_gitlab(
+        config_gitlab["url"],
+        config_gitlab["auth_token"],
+        args.dry_run,
+        args.max_workers if args.max_workers is not None else config_general["max_workers"],
+        config_gitlab["backend"],
+        config_general.get("membership_cache_ttl"),
+        config_general.get("cache_dir"),
+        config_gitlab.get("max_requests_per_second"),
+    )
+    if profiler is not None:
+        gitlab.set_profiler(profiler)
+    return gitlab
+
+
+def assign_runners(
+    args: argparse.Namespace,
+    runner_configs: List[Dict[str, Any]],
+    project_ids: Optional[Collection[int]] = None,
+    profiler: Optional["Profiler"] = None,
+    gitlab: Optional["Gitlab"] = None,
+    shard: Optional["Shard"] = None,
+    group_ids: Optional[Collection[int]] = None,
+) -> bool:
+    from .gitlab import assign_multi_group_runners
+
+    config_general = config()["general"]
+    # A GitLab object which is created for this run only is closed at its end, passed ones are reused by the caller
+    close_gitlab = gitlab is None
+    if gitlab is None:
+        gitlab = create_gitlab_from_config(args, profiler)
+    else:
+        gitlab.start_run()
+        gitlab.set_profiler(profiler)
+    try:
+        # One GitLab session is shared by all config repositories, so common groups and projects are only fetched once
+        return assign_multi_group_runners(
+            gitlab,
+            runner_configs,
+            config_general["disable_shared_runners"],
+            config_general["precompute_allowed_projects"],
+            project_ids,
+            config_general["skip_unchanged_runs"],
+            shard,
+            config_general["stream_changes"],
+            group_ids,
+        )
+    finally:
+        if close_gitlab:
+            gitlab.close()
+
+
+def listen_for_system_hooks(args: argparse.Namespace) -> None:
+    from .hooks import SystemHookListener
+
+    def reconfigure_projects(gitlab: "Gitlab", project_ids: Set[int], group_ids: Set[int]) -> None:
+        if project_ids:
+            logger.info("Configure the projects with ids %s", ", ".join("`{}`".format(i) for i in sorted(project_ids)))
+        if group_ids:
+            logger.info("Configure the groups with ids %s", ", ".join("`{}`".format(i) for i in sorted(group_ids)))
+        try:
+            assign_runners(args, config()["runners"], project_ids, gitlab=gitlab, shard=args.shard, group_ids=group_ids)
+        except get_run_exceptions() as e:
+            logger.error(str(e))
+
+    host, _, port = args.system_hooks_address.rpartition(":")
+    listener = SystemHookListener(
+        (host or "127.0.0.1", int(port)),
+        lambda: create_gitlab_from_config(args),
+        reconfigure_projects,
+        config()["gitlab"].get("system_hook_token"),
+    )
+    try:
+        listener.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def run(
+    args: argparse.Namespace,
+    config_repository_path: Optional[str],
+    gitlab: Optional["Gitlab"] = None,
+    shard: Optional["Shard"] = None,
+) -> int:
+    """Assign the runners of the given config repository (or of all if `None`) and return the exit code of the run.
+
+    If `gitlab` is given, its session and caches of previous runs are reused. `shard` overrides the `--shard` option.
+    """
+    from .metrics import write_openmetrics_textfile
+    from .profiling import Profiler
+
+    if shard is None:
+        shard = args.shard
+    profile = args.profile or args.profile_json_filepath is not None
+    metrics_filepath = config()["general"].get("metrics_file")
+    # The metrics are derived from the profile data as well
+    profiler = Profiler() if profile or metrics_filepath is not None else None
+    # Unexpected exceptions are passed on and reported as exit code 1
+    exit_code = 1
+    run_exceptions = get_run_exceptions()
+    try:
+        runner_configs = get_runner_configs(config_repository_path)
+        assigned_runners_without_problems = assign_runners(
+            args, runner_configs, profiler=profiler, gitlab=gitlab, shard=shard
+        )
+        exit_code = 0 if assigned_runners_without_problems else 4
+    except run_exceptions as e:
+        logger.error(str(e))
+        for i, exception_class in enumerate(run_exceptions, start=5):
+            if isinstance(e, exception_class):
+                exit_code = i
+                break
+    finally:
+        if profiler is not None:
+            if profile:
+                profiler.write_report(sys.stderr)
+            if args.profile_json_filepath is not None:
+                profiler.write_json(args.profile_json_filepath)
+            if metrics_filepath is not None:
+                write_openmetrics_textfile(metrics_filepath, profiler, exit_code, shard)
+    return exit_code
+
+
+def serve(args: argparse.Namespace) -> None:
+    from .daemon import ReconciliationDaemon
+
+    # The GitLab objects are created once, so every run reuses their connections and caches. Dry runs which are
+    # requested from a daemon without `--dry-run` get their own object, since it decides whether changes are applied.
+    gitlab_by_dry_run = {args.dry_run: create_gitlab_from_config(args)}
+
+    def reconcile(config_repository_path: Optional[str], shard: Optional["Shard"], dry_run: bool) -> int:
+        dry_run = args.dry_run or dry_run
+        if dry_run not in gitlab_by_dry_run:
+            gitlab_by_dry_run[dry_run] = create_gitlab_from_config(argparse.Namespace(**dict(vars(args), dry_run=True)))
+        return run(args, config_repository_path, gitlab_by_dry_run[dry_run], shard)
+
+    def close() -> None:
+        for gitlab in gitlab_by_dry_run.values():
+            gitlab.close()
+
+    host, _, port = args.serve_address.rpartition(":")
+    daemon = ReconciliationDaemon((host or "127.0.0.1", int(port)), reconcile, args.serve_interval, close)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
 def main() -> None:
     args = parse_arguments()
-    setup_logging(args.debug)
-    check_arguments(args)
+    # These options are handled before the logging is set up, since they do not log and should return immediately
     if args.print_version:
         print("{}, version {}".format(os.path.basename(sys.argv[0]), __version__))
         sys.exit(0)
@@ -120,61 +374,26 @@ def main() -> None:
     elif args.print_example_repo_config:
         write_example_multi_group_runner_config(sys.stdout)
         sys.exit(0)
+    setup_logging(args.debug)
+    check_arguments(args)
     try:
         load_config(args)
     except ConfigValidationFailedError as e:
         logger.error(str(e))
         sys.exit(3)
+    if args.system_hooks_address is not None:
+        listen_for_system_hooks(args)
+        sys.exit(0)
+    if args.serve_address is not None:
+        serve(args)
+        sys.exit(0)
     if args.config_repository_path is None and not args.all_config_repositories:
         logger.error(
             "Please pass a config repository as first positional parameter or use the `--all` option. "
             "Run with `--help` for more details."
         )
         sys.exit(1)
-    exceptions = (
-        NoMatchingRunnerConfigError,
-        NoConfigFileFoundError,
-        NoMatchingProjectError,
-        NoMatchingGroupError,
-        NoMatchingRunnerError,
-    )
-    try:
-        config_general = config()["general"]
-        config_gitlab = config()["gitlab"]
-        if args.all_config_repositories:
-            runner_configs = config()["runners"]
-        else:
-            matching_runner_config = find_matching_runner_config(config()["runners"], args.config_repository_path)
-            if matching_runner_config is None:
-                raise NoMatchingRunnerConfigError(
-                    'Could not find a matching configuration entry for the configuration repository "{}".'.format(
-                        args.config_repository_path
-                    )
-                )
-            runner_configs = [matching_runner_config]
-        assigned_runners_without_problems = True
-        for runner_config in runner_configs:
-            no_warnings = assign_multi_group_runner(
-                config_gitlab["url"],
-                config_gitlab["auth_token"],
-                runner_config["ids"],
-                runner_config["config_repo"]["path"],
-                runner_config["config_repo"]["branch"],
-                runner_config["allowed_projects_rules"],
-                config_general["disable_shared_runners"],
-                args.dry_run,
-            )
-            assigned_runners_without_problems = assigned_runners_without_problems and no_warnings
-    except exceptions as e:
-        logger.error(str(e))
-        for i, exception_class in enumerate(exceptions, start=5):
-            if isinstance(e, exception_class):
-                sys.exit(i)
-        sys.exit(1)
-    if assigned_runners_without_problems:
-        sys.exit(0)
-    else:
-        sys.exit(4)
+    sys.exit(run(args, None if args.all_config_repositories else args.config_repository_path))
 
 
 if __name__ == "__main__":
@@ -1,14 +1,14 @@
 import os
 from copy import deepcopy
 from pprint import pformat
-from typing import Any, Dict, Optional, TextIO, Union, cast
-
-import yaml
-from cerberus import Validator
-from cerberus.errors import ErrorList as CerberusErrorList
+from typing import TYPE_CHECKING, Any, Dict, Optional, TextIO, Union, cast
 
 from .utils import dump_config_as_yaml, recursive_update
 
+if TYPE_CHECKING:
+    # `yaml` and `cerberus` are imported when a config is read, so commands like `--version` start faster
+    from cerberus.errors import ErrorList as CerberusErrorList
+
 DEFAULT_CONFIG_FILEPATH = "/etc/gitlab_multi_group_runnerrc.yml"
 
 CONFIG_SCHEMA = {
@@ -17,6 +17,20 @@ CONFIG_SCHEMA = {
         "type": "dict",
         "schema": {
             "disable_shared_runners": {"required": False, "type": "boolean"},
+            "max_workers": {"required": False, "type": "integer", "min": 1},
+            "membership_cache_ttl": {"required": False, "type": "number", "min": 0},
+            "precompute_allowed_projects": {"required": False, "type": "boolean"},
+            "cache_dir": {"required": False, "type": "string"},
+            "skip_unchanged_runs": {
+                "required": False,
+                "type": "boolean",
+                "meta": {
+                    "description": "Skip runs without changed configs, projects or runners. Changed group or project "
+                    "memberships are not detected, so keep regular runs without this option."
+                },
+            },
+            "stream_changes": {"required": False, "type": "boolean"},
+            "metrics_file": {"required": False, "type": "string"},
         },
     },
     "gitlab": {
@@ -25,6 +39,9 @@ CONFIG_SCHEMA = {
         "schema": {
             "url": {"required": True, "type": "string"},
             "auth_token": {"required": True, "type": "string"},
+            "backend": {"required": False, "type": "string", "allowed": ["sync", "async", "graphql"]},
+            "system_hook_token": {"required": False, "type": "string"},
+            "max_requests_per_second": {"required": False, "type": "number", "min": 0.1},
         },
     },
     "runners": {
@@ -57,16 +74,26 @@ CONFIG_SCHEMA = {
 DEFAULT_CONFIG: Dict[str, Any] = {
     "general": {
         "disable_shared_runners": True,
+        "max_workers": 1,
+        "precompute_allowed_projects": False,
+        "skip_unchanged_runs": False,
+        "stream_changes": False,
+    },
+    "gitlab": {
+        "backend": "sync",
     },
 }
 
 EXAMPLE_CONFIG = {
     "general": {
         "disable_shared_runners": True,
+        "max_workers": 1,
+        "precompute_allowed_projects": False,
     },
     "gitlab": {
         "url": "https://mygitlab.com",
         "auth_token": "xxxxxxxxxxxxxxxxxxxx",
+        "backend": "sync",
     },
     "runners": [
         {
@@ -84,7 +111,7 @@ EXAMPLE_CONFIG = {
 
 
 class ConfigValidationFailedError(Exception):
-    def __init__(self, config_filepath: Optional[str], errors: CerberusErrorList):
+    def __init__(self, config_filepath: Optional[str], errors: "CerberusErrorList"):
         self._config_filepath = config_filepath
         self._errors = errors
         if self._config_filepath is not None:
@@ -98,7 +125,7 @@ class ConfigValidationFailedError(Exception):
         return self._config_filepath
 
     @property
-    def errors(self) -> CerberusErrorList:
+    def errors(self) -> "CerberusErrorList":
         return self._errors
 
 
@@ -125,6 +152,9 @@ class Config:
             dump_config_as_yaml(self._config_dict, config_file)
 
     def read_config(self, config_filepath: Optional[str] = None) -> None:
+        import yaml
+        from cerberus import Validator
+
         self._config_dict = deepcopy(DEFAULT_CONFIG)
         validator = Validator(CONFIG_SCHEMA)
         if config_filepath is not None:
@@ -137,6 +167,8 @@ class Config:
 
     @staticmethod
     def _validate(config_dict: Dict[str, Any], config_filepath: Optional[str] = None) -> Dict[str, Any]:
+        from cerberus import Validator
+
         validator = Validator(CONFIG_SCHEMA)
         if not validator.validate(config_dict):
             raise ConfigValidationFailedError(config_filepath, validator.errors)
@@ -0,0 +1,132 @@
+import io
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Callable, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .log_buffer import get_logger
+from .shard import Shard
+
+logger = get_logger(__name__)
+
+RECONCILE_PATH = "/reconcile"
+EXIT_CODE_HEADER = "X-Exit-Code"
+TRUE_VALUES = ("1", "true", "yes")
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ReconciliationDaemon:
+    """HTTP server which reconciles the runner assignments on demand and optionally in intervals of `interval` seconds.
+
+    `reconcile` is called with the path of a config repository (or `None` for all config repositories), a shard (or
+    `None` for the default shard) and whether to only show the changes, and returns an exit code. A `POST` to
+    `/reconcile` (with optional `config_repo`, `shard` and `dry_run` parameters) starts a reconciliation and responds
+    when it is finished, with its log messages as body and its exit code in the `X-Exit-Code` header. Reconciliations
+    never overlap, requests which arrive during a reconciliation wait until it is finished.
+
+    `close` is called when the server stops, after a running reconciliation finished (e.g. to release the sessions
+    which are reused by `reconcile`).
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        reconcile: Callable[[Optional[str], Optional[Shard], bool], int],
+        interval: Optional[float] = None,
+        close: Optional[Callable[[], None]] = None,
+    ):
+        self._reconcile = reconcile
+        self._interval = interval
+        self._close = close
+        self._reconcile_lock = threading.Lock()
+        self._http_server = _ThreadingHTTPServer(address, self._create_request_handler_class())
+
+    @property
+    def server_address(self) -> Tuple[str, int]:
+        host, port = self._http_server.server_address[:2]
+        return str(host), int(port)
+
+    def reconcile(
+        self,
+        config_repository_path: Optional[str] = None,
+        shard: Optional[Shard] = None,
+        dry_run: bool = False,
+        log_file: Optional[io.StringIO] = None,
+    ) -> int:
+        """Run one reconciliation and return its exit code. Its log messages are additionally written to `log_file`."""
+        log_handler = None
+        with self._reconcile_lock:
+            if log_file is not None:
+                log_handler = logging.StreamHandler(log_file)
+                log_handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+                logging.getLogger().addHandler(log_handler)
+            try:
+                return self._reconcile(config_repository_path, shard, dry_run)
+            except Exception:
+                # Keep serving, the next reconciliation can succeed (e.g. after a GitLab outage)
+                logger.exception("The reconciliation failed")
+                return 1
+            finally:
+                if log_handler is not None:
+                    logging.getLogger().removeHandler(log_handler)
+
+    def _create_request_handler_class(self) -> type:
+        daemon = self
+
+        class ReconciliationRequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                url = urlsplit(self.path)
+                if url.path != RECONCILE_PATH:
+                    self.send_error(404)
+                    return
+                content_length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(content_length).decode("utf-8") if content_length > 0 else ""
+                parameters = parse_qs(url.query)
+                parameters.update(parse_qs(body))
+                config_repository_path = parameters["config_repo"][0] if "config_repo" in parameters else None
+                try:
+                    shard = Shard.parse(parameters["shard"][0]) if "shard" in parameters else None
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+                dry_run = parameters.get("dry_run", ["false"])[0].lower() in TRUE_VALUES
+                log_file = io.StringIO()
+                exit_code = daemon.reconcile(config_repository_path, shard, dry_run, log_file)
+                response = log_file.getvalue().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header(EXIT_CODE_HEADER, str(exit_code))
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug("%s - %s", self.address_string(), format % args)
+
+        return ReconciliationRequestHandler
+
+    def _reconcile_periodically(self, interval: float) -> None:
+        while True:
+            exit_code = self.reconcile()
+            logger.info("Reconciliation finished with exit code `%d`, the next one starts in %g s", exit_code, interval)
+            time.sleep(interval)
+
+    def serve_forever(self) -> None:
+        if self._interval is not None:
+            threading.Thread(
+                target=self._reconcile_periodically, args=(self._interval,), name="reconciliation", daemon=True
+            ).start()
+        logger.info("Listening for reconciliation requests on `%s:%d`", *self.server_address)
+        try:
+            self._http_server.serve_forever()
+        finally:
+            self._http_server.server_close()
+            if self._close is not None:
+                with self._reconcile_lock:
+                    self._close()
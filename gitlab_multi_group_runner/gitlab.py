@@ -1,53 +1,70 @@
+import hashlib
+import json
 import logging
 import os
-from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple, Union, cast
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
+from urllib.parse import quote, urlsplit
 
-import yaml
-from cerberus import Validator
 from gitlab import MAINTAINER_ACCESS
 from gitlab import Gitlab as _Gitlab
-from gitlab.exceptions import GitlabGetError
+from gitlab.base import RESTObject
+from gitlab.exceptions import GitlabError, GitlabGetError, GitlabHttpError
 from gitlab.v4.objects import Group as GitlabGroup
 from gitlab.v4.objects import Project as GitlabProject
-from gitlab.v4.objects import Runner as GitlabRunner
 from gitlab.v4.objects import User as GitlabUser
+from requests import RequestException, Response
+from requests.adapters import HTTPAdapter
 
+from .cache import CachingHTTPAdapter, ResponseCache
 from .config import ConfigValidationFailedError
-from .utils import dump_config_as_yaml
-
-logger = logging.getLogger(__name__)
-
-
-MULTI_GROUP_RUNNER_CONFIG_FILENAME = "multi-group-runner-config.yml"
-
-MULTI_GROUP_RUNNER_CONFIG_SCHEMA = {
-    "runners": {
-        "required": True,
-        "type": "list",
-        "schema": {
-            "type": "dict",
-            "schema": {
-                "ids": {"required": True, "type": "list", "schema": {"type": "integer"}},
-                "groups_and_projects": {
-                    "required": True,
-                    "type": "list",
-                    "schema": {
-                        "type": "string",
-                    },
-                },
-            },
-        },
-    },
-}
-
-MULTI_GROUP_RUNNER_EXAMPLE_CONFIG = {
-    "runners": [
-        {
-            "ids": [5, 9],
-            "groups_and_projects": ["mygroup", "myusername/myproject"],
-        }
-    ]
-}
+from .log_buffer import get_logger, handle_buffered_records, log_record_buffer
+from .patterns import PathPattern, ProjectPathIndex, is_path_pattern
+from .plan import RunnerActivationPlan
+from .profiling import Profiler
+from .ratelimit import RateLimiter, RateLimitingHTTPAdapter
+from .records import MemberRecord, ProjectRecord, RunnerRecord
+from .repo_config import MULTI_GROUP_RUNNER_CONFIG_FILENAME, MultiGroupRunnerConfig
+from .shard import Shard
+from .state import RunState, get_last_run_key, load_json_file, write_json_file
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+NAMESPACE_KINDS_FILENAME = "namespace-kinds.json"
+RUN_STATE_FILENAME = "run-state.json"
+
+# Project attributes which are read by this tool. If a project listing lacks one of these, the project is refetched.
+REQUIRED_PROJECT_ATTRIBUTES = ("id", "path_with_namespace", "namespace", "shared_runners_enabled")
+
+PROJECT_MEMBERS_PATH = "/projects/{}/members/all"
+PROJECT_RUNNERS_PATH = "/projects/{}/runners"
+# Group project listings support `include_subgroups` since this GitLab version, older versions ignore the parameter
+INCLUDE_SUBGROUPS_MINIMUM_VERSION = (11, 6)
+# Number of projects which are listed, checked and configured at once if changes are streamed
+STREAM_PAGE_SIZE = 100
 
 
 class NoConfigFileFoundError(Exception):
@@ -74,13 +91,233 @@ class NoMatchingUserError(Exception):
     pass
 
 
+class NoMatchingNamespaceError(Exception):
+    pass
+
+
+# Kinds of lookups which are kept between runs of one `Gitlab` object for `membership_cache_ttl` seconds, see
+# `Gitlab.start_run`. Groups and namespaces are looked up again in every run, since they can be deleted, renamed or
+# transferred.
+PERSISTENT_LOOKUP_KINDS = ("user",)
+
+# Errors of a single write request which do not abort a run
+WRITE_ERRORS = (GitlabError, RequestException)
+
+LOOKUP_ERRORS = (
+    NoMatchingProjectError,
+    NoMatchingGroupError,
+    NoMatchingRunnerError,
+    NoMatchingUserError,
+    NoMatchingNamespaceError,
+)
+
+# Errors of a single config repository (e.g. a missing repository, branch or config file) which do not stop the others
+CONFIG_REPOSITORY_ERRORS = LOOKUP_ERRORS + (NoConfigFileFoundError, ConfigValidationFailedError)
+
+
+class _AdapterRetryingGitlab(_Gitlab):
+    """python-gitlab client which leaves all retries to the transport adapter (see `RateLimitingHTTPAdapter`).
+
+    python-gitlab sends a request again after a `429` response by default, even after the adapter gave up. Its sleeps
+    would neither pause the other workers nor be counted as throttle time.
+    """
+
+    def http_request(self, *args: Any, **kwargs: Any) -> Response:
+        kwargs["obey_rate_limit"] = False
+        kwargs["retry_transient_errors"] = False
+        return super().http_request(*args, **kwargs)
+
+
 class Gitlab:
-    def __init__(self, gitlab_url: str, private_token: str, dry_run: bool = False):
-        self._gitlab = _Gitlab(gitlab_url, private_token=private_token)
+    def __init__(
+        self,
+        gitlab_url: str,
+        private_token: str,
+        dry_run: bool = False,
+        max_workers: int = 1,
+        membership_cache_ttl: Optional[float] = None,
+        cache_dir: Optional[str] = None,
+        max_requests_per_second: Optional[float] = None,
+    ):
+        self._gitlab = _AdapterRetryingGitlab(gitlab_url, private_token=private_token)
         self._dry_run = dry_run
+        self._max_workers = max_workers
+        self._membership_cache_ttl = membership_cache_ttl
+        self._cache_dir = cache_dir
+        self._run_state = RunState(os.path.join(cache_dir, RUN_STATE_FILENAME)) if cache_dir is not None else None
         self._projects_with_already_disabled_shared_runners: Set[int] = set()
+        # Runner activations of earlier plans of the current run, which are not contained in the cached runner details
+        self._planned_runner_activations: Set[Tuple[int, int]] = set()
+        # Maps `(group id, minimum role)` to the time of the lookup and the ids of all group members with that role
+        self._group_member_ids_cache: Dict[Tuple[int, int], Tuple[float, FrozenSet[int]]] = {}
+        self._group_member_ids_cache_lock = threading.Lock()
+        # One lock per cache key, so only workers which need the same member list wait for each other
+        self._group_member_ids_key_locks: Dict[Tuple[int, int], threading.Lock] = {}
+        # Maps user ids to the ids of all projects in which the user has a given minimum role
+        self._accessible_project_ids_by_user_id: Dict[Tuple[int, int], FrozenSet[int]] = {}
+        # Results of project, group, runner and user lookups, which are shared by all config repositories of a run
+        self._lookup_cache: Dict[Tuple[Any, ...], Any] = {}
+        # Times of the lookups in `PERSISTENT_LOOKUP_KINDS`, which expire after `membership_cache_ttl` seconds
+        self._persistent_lookup_times: Dict[Tuple[Any, ...], float] = {}
+        self._response_cache = ResponseCache(cache_dir) if cache_dir is not None else None
+        self._rate_limiter = RateLimiter(max_requests_per_second)
+        self._profiler: Optional[Profiler] = None
+        self._profiler_hook_installed = False
+        # Keep one pooled connection per worker, otherwise connections are discarded and reopened
+        adapter_kwargs: Dict[str, Any] = {"pool_connections": 1, "pool_maxsize": max(self._max_workers, 1)}
+        if self._response_cache is not None:
+            adapter: HTTPAdapter = CachingHTTPAdapter(self._response_cache, self._rate_limiter, **adapter_kwargs)
+        else:
+            adapter = RateLimitingHTTPAdapter(self._rate_limiter, **adapter_kwargs)
+        self._gitlab.session.mount("http://", adapter)
+        self._gitlab.session.mount("https://", adapter)
+
+    def set_profiler(self, profiler: Optional[Profiler]) -> None:
+        """Record all API responses of this object with `profiler` and use it to measure phases (`None` to stop)."""
+        if self._profiler is None and profiler is not None and not self._profiler_hook_installed:
+            api_path = urlsplit(self._gitlab.api_url).path
+
+            def record_response(response: Response, *args: Any, **kwargs: Any) -> None:
+                if self._profiler is not None:
+                    self._profiler.record_response(response, api_path)
+
+            self._gitlab.session.hooks["response"].append(record_response)
+            self._profiler_hook_installed = True
+        self._profiler = profiler
+
+    @contextmanager
+    def profile_phase(self, name: str) -> Iterator[None]:
+        if self._profiler is None:
+            yield
+        else:
+            with self._profiler.phase(name):
+                yield
+
+    def profile_count(self, name: str, value: int = 1) -> None:
+        if self._profiler is not None:
+            self._profiler.add_count(name, value)
+
+    def start_run(self) -> None:
+        """Forget everything which can change between two runs, so this object can be reused for another run.
+
+        The HTTP session and the response cache are kept. Successful user lookups and group member lists are kept for
+        `membership_cache_ttl` seconds if it is set.
+        """
+        now = time.monotonic()
+        self._persistent_lookup_times = {
+            key: lookup_time
+            for key, lookup_time in self._persistent_lookup_times.items()
+            if self._membership_cache_ttl is not None
+            and now - lookup_time < self._membership_cache_ttl
+            and not isinstance(self._lookup_cache.get(key), LOOKUP_ERRORS)
+        }
+        self._lookup_cache = {
+            key: result for key, result in self._lookup_cache.items() if key in self._persistent_lookup_times
+        }
+        self._projects_with_already_disabled_shared_runners = set()
+        self._planned_runner_activations = set()
+        self._accessible_project_ids_by_user_id = {}
+        if self._membership_cache_ttl is None:
+            with self._group_member_ids_cache_lock:
+                self._group_member_ids_cache = {}
+
+    def close(self) -> None:
+        """Close the connections of the HTTP session. This object must not be used afterwards."""
+        self._gitlab.session.close()
+
+    def _invalidate_cached_responses(self, *paths: str) -> None:
+        if self._response_cache is not None:
+            for path in paths:
+                self._response_cache.invalidate(self._gitlab.api_url + path)
+
+    def _invalidate_cached_runner_activation(self, runner_id: int, project_id: int) -> None:
+        # The runner details list all projects of a runner and the project runner listing all runners of a project
+        self._invalidate_cached_responses("/runners/{}".format(runner_id), PROJECT_RUNNERS_PATH.format(project_id))
+
+    def _invalidate_cached_shared_runner_deactivation(self, project_id: int) -> None:
+        # Group project listings contain the shared runners setting, too, but cannot be addressed from a project. They
+        # are still correct since every cached response is revalidated with its ETag.
+        self._invalidate_cached_responses("/projects/{}".format(project_id))
+
+    def log_request_statistics(self) -> None:
+        log = logger.info if self._rate_limiter.throttle_time > 0 else logger.debug
+        log(
+            "Sent %d API requests (%d retried), waited %.1f s for the rate limit and retries",
+            self._rate_limiter.request_count,
+            self._rate_limiter.retry_count,
+            self._rate_limiter.throttle_time,
+        )
+        if self._response_cache is not None:
+            logger.debug(
+                "%d responses were unchanged and taken from the cache, %d responses were fetched",
+                self._response_cache.hits,
+                self._response_cache.misses,
+            )
+
+    @property
+    def dry_run(self) -> bool:
+        return self._dry_run
+
+    @property
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    @property
+    def cache_dir(self) -> Optional[str]:
+        return self._cache_dir
+
+    @property
+    def run_state(self) -> Optional[RunState]:
+        return self._run_state
+
+    def map_concurrently(self, function: Callable[[T], R], items: Iterable[T]) -> List[R]:
+        """Apply `function` to all `items` with up to `max_workers` threads, results keep the order of `items`.
+
+        The log messages of this package are held back per item and logged in the order of `items` as well, so the
+        output does not depend on the order in which the workers finish.
+        """
+        if self._max_workers <= 1:
+            return [function(item) for item in items]
+
+        def call_with_buffered_log_records(item: T) -> Tuple[List[logging.LogRecord], Optional[R], Optional[Exception]]:
+            with log_record_buffer.buffering() as records:
+                try:
+                    return records, function(item), None
+                except Exception as e:
+                    return records, None, e
+
+        results = []
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for records, result, error in executor.map(call_with_buffered_log_records, items):
+                handle_buffered_records(records)
+                if error is not None:
+                    raise error
+                results.append(cast(R, result))
+        return results
+
+    def _get_cached(self, key: Tuple[Any, ...], fetch: Callable[[], T]) -> T:
+        """Return the result of `fetch` which is cached for `key` during the lifetime of this object.
+
+        Lookup errors are cached as well, so names which are neither groups nor projects are only requested once.
+        """
+        try:
+            result = self._lookup_cache[key]
+        except KeyError:
+            try:
+                result = fetch()
+            except LOOKUP_ERRORS as e:
+                result = e
+            self._lookup_cache[key] = result
+            if key[0] in PERSISTENT_LOOKUP_KINDS:
+                self._persistent_lookup_times[key] = time.monotonic()
+        if isinstance(result, LOOKUP_ERRORS):
+            raise result
+        return cast(T, result)
 
     def get_project(self, project_id_or_path: Union[str, int]) -> GitlabProject:
+        return self._get_cached(("project", project_id_or_path), lambda: self._fetch_project(project_id_or_path))
+
+    def _fetch_project(self, project_id_or_path: Union[str, int]) -> GitlabProject:
         try:
             project = self._gitlab.projects.get(project_id_or_path)
         except GitlabGetError as e:
@@ -93,6 +330,9 @@ class Gitlab:
         return project
 
     def get_group(self, group_id_or_path: Union[str, int]) -> GitlabGroup:
+        return self._get_cached(("group", group_id_or_path), lambda: self._fetch_group(group_id_or_path))
+
+    def _fetch_group(self, group_id_or_path: Union[str, int]) -> GitlabGroup:
         try:
             group = self._gitlab.groups.get(group_id_or_path)
         except GitlabGetError as e:
@@ -102,30 +342,159 @@ class Gitlab:
                 raise NoMatchingGroupError('The group "{}" is not accessible.'.format(group_id_or_path)) from e
         return group
 
-    def get_group_projects(self, group_id_or_path: Union[str, int]) -> List[GitlabProject]:
-        try:
-            group = self._gitlab.groups.get(group_id_or_path)
-        except GitlabGetError as e:
-            if isinstance(group_id_or_path, int):
-                raise NoMatchingGroupError('The group with id "{}" is not accessible.'.format(group_id_or_path)) from e
-            else:
-                raise NoMatchingGroupError('The group "{}" is not accessible.'.format(group_id_or_path)) from e
-        group_projects = group.projects.list(all=True)
-        projects = [self._gitlab.projects.get(group_project.id) for group_project in group_projects]
-        return projects
+    def get_group_from_namespace(self, namespace: RESTObject) -> GitlabGroup:
+        # Group namespaces contain the id and full path of the group, which is all that is needed to list the group
+        # projects and members, so the group does not need to be fetched again
+        return self._get_cached(
+            ("group", namespace.full_path), lambda: GitlabGroup(self._gitlab.groups, namespace.attributes)
+        )
 
-    def get_runner(self, runner_id: int, check_if_project_type: bool = True) -> GitlabRunner:
+    def get_namespace(self, namespace_path: str) -> RESTObject:
+        return self._get_cached(("namespace", namespace_path), lambda: self._fetch_namespace(namespace_path))
+
+    def _fetch_namespace(self, namespace_path: str) -> RESTObject:
         try:
-            runner = self._gitlab.runners.get(runner_id)
+            return self._gitlab.namespaces.get(namespace_path)
         except GitlabGetError as e:
-            raise NoMatchingRunnerError('The runner with id "{}" is not accessible.'.format(runner_id)) from e
+            raise NoMatchingNamespaceError('The namespace "{}" is not accessible.'.format(namespace_path)) from e
+
+    def get_group_projects(
+        self, group_id_or_path: Union[str, int], include_subgroups: bool = False
+    ) -> List[ProjectRecord]:
+        group = self.get_group(group_id_or_path)
+        if include_subgroups:
+            return self._get_cached(
+                ("group_projects_with_subgroups", group.id), lambda: self._list_group_projects_with_subgroups(group)
+            )
+        return self._get_cached(("group_projects", group.id), lambda: self._list_group_projects(group))
+
+    def _list_group_projects(self, group: GitlabGroup, include_subgroups: bool = False) -> List[ProjectRecord]:
+        # The listed projects are converted to records directly, without creating python-gitlab objects
+        query_data = {"include_subgroups": "true"} if include_subgroups else None
+        project_dicts = self._gitlab.http_list(group.projects.path, query_data, all=True)
+        return [self._project_from_listing(project_dict) for project_dict in project_dicts]
+
+    def supports_include_subgroups(self) -> bool:
+        """Return `True` if the GitLab server can list the projects of subgroups together with the group projects.
+
+        Older versions ignore the `include_subgroups` parameter without an error, so the server version is compared. If
+        the version cannot be determined, `False` is returned, so subgroups are never missed.
+        """
+        # python-gitlab requests the version only once and keeps it
+        version_str, _ = self._gitlab.version()
+        version_match = re.match(r"(\d+)\.(\d+)", version_str)
+        if version_match is None:
+            return False
+        return (int(version_match.group(1)), int(version_match.group(2))) >= INCLUDE_SUBGROUPS_MINIMUM_VERSION
+
+    def _list_group_projects_with_subgroups(self, group: GitlabGroup) -> List[ProjectRecord]:
+        if self.supports_include_subgroups():
+            return self._list_group_projects(group, include_subgroups=True)
+        logger.debug('Listing the subgroups of group "%s" level by level', group.full_path)
+        return self._walk_group_projects(group)
+
+    def iter_group_project_pages(
+        self, group_id_or_path: Union[str, int], include_subgroups: bool = False
+    ) -> Iterator[List[ProjectRecord]]:
+        """Yield the projects of a group in pages of `STREAM_PAGE_SIZE` projects while they are listed.
+
+        Unlike `get_group_projects`, the listing is not cached, so only one page of projects is kept in memory. Listings
+        which were already cached in this run are split into pages without requests.
+        """
+        group = self.get_group(group_id_or_path)
+        cache_key = ("group_projects_with_subgroups" if include_subgroups else "group_projects", group.id)
+        cached_projects = self._lookup_cache.get(cache_key)
+        if isinstance(cached_projects, list):
+            yield from _split_into_pages(cached_projects)
+        else:
+            yield from self._iter_group_project_pages(group, include_subgroups)
+
+    def _iter_group_project_pages(self, group: GitlabGroup, include_subgroups: bool) -> Iterator[List[ProjectRecord]]:
+        query_data: Dict[str, Any] = {"per_page": STREAM_PAGE_SIZE}
+        if include_subgroups:
+            if not self.supports_include_subgroups():
+                yield from _split_into_pages(self._walk_group_projects(group))
+                return
+            query_data["include_subgroups"] = "true"
+        # Without `all`, python-gitlab returns a lazy list which requests the next page when the current one is used
+        project_dicts = self._gitlab.http_list(group.projects.path, query_data, as_list=False)
+        yield from _split_into_pages(self._project_from_listing(project_dict) for project_dict in project_dicts)
+
+    def _walk_group_projects(self, group: GitlabGroup) -> List[ProjectRecord]:
+        """Collect the projects of `group` and all descendant groups.
+
+        The hierarchy is walked level by level and all groups of a level are listed concurrently, so the number of
+        sequential requests grows with the depth and not with the number of subgroups. Groups and projects which are
+        reached more than once are skipped.
+        """
+
+        def list_projects_and_subgroups(group: GitlabGroup) -> Tuple[List[ProjectRecord], List[GitlabGroup]]:
+            return self._list_group_projects(group), self._list_subgroups(group)
+
+        projects_by_id: Dict[int, ProjectRecord] = {}
+        seen_group_ids = {group.id}
+        groups = [group]
+        while groups:
+            next_groups = []
+            for projects, subgroups in self.map_concurrently(list_projects_and_subgroups, groups):
+                for project in projects:
+                    projects_by_id.setdefault(project.id, project)
+                for subgroup in subgroups:
+                    if subgroup.id not in seen_group_ids:
+                        seen_group_ids.add(subgroup.id)
+                        next_groups.append(subgroup)
+            groups = next_groups
+        return list(projects_by_id.values())
+
+    def get_project_index(self) -> ProjectPathIndex:
+        """Return an index of the paths of all accessible projects, which is built once per run."""
+        return self._get_cached(("project_index",), self._build_project_index)
+
+    def _build_project_index(self) -> ProjectPathIndex:
+        # Keyset pagination keeps the cost of each page constant, even for the last pages of large instances
+        project_dicts = self._gitlab.http_list(
+            "/projects", {"pagination": "keyset", "order_by": "id", "sort": "asc", "per_page": 100}, all=True
+        )
+        project_index = ProjectPathIndex(self._project_from_listing(project_dict) for project_dict in project_dicts)
+        logger.debug("Indexed the paths of %d projects", len(project_index))
+        return project_index
+
+    def _list_subgroups(self, group: GitlabGroup) -> List[GitlabGroup]:
+        return [GitlabGroup(self._gitlab.groups, subgroup.attributes) for subgroup in group.subgroups.list(all=True)]
+
+    def _project_from_listing(self, listed_attributes: Dict[str, Any]) -> ProjectRecord:
+        # Project listings already contain the full project representation, so a record can be created without another
+        # API request. A full `projects.get` is only needed if the listing lacks an attribute which is read later on.
+        if any(attribute not in listed_attributes for attribute in REQUIRED_PROJECT_ATTRIBUTES):
+            logger.debug('The listing of project "%s" is incomplete, fetching it', listed_attributes["id"])
+            listed_attributes = self._gitlab.projects.get(listed_attributes["id"]).attributes
+        return ProjectRecord.from_attributes(listed_attributes)
+
+    def get_runner(self, runner_id: int, check_if_project_type: bool = True) -> RunnerRecord:
+        runner = self._get_cached(("runner", runner_id), lambda: self._fetch_runner(runner_id))
         if check_if_project_type and runner.runner_type != "project_type":
             raise NotASpecificRunnerError(
                 'The runner with id "{}" is not a specific / project type runner.'.format(runner_id)
             )
         return runner
 
+    def fetch_runner_project_ids(self, runner_id: int) -> FrozenSet[int]:
+        """Return the ids of all projects the runner is enabled in.
+
+        Unlike `get_runner`, the runner is fetched on every call, since its projects change when a plan is applied.
+        """
+        return self._fetch_runner(runner_id).project_ids or frozenset()
+
+    def _fetch_runner(self, runner_id: int) -> RunnerRecord:
+        try:
+            return RunnerRecord.from_attributes(self._gitlab.runners.get(runner_id).attributes)
+        except GitlabGetError as e:
+            raise NoMatchingRunnerError('The runner with id "{}" is not accessible.'.format(runner_id)) from e
+
     def get_user(self, user_id_or_name: Union[str, int]) -> GitlabUser:
+        return self._get_cached(("user", user_id_or_name), lambda: self._fetch_user(user_id_or_name))
+
+    def _fetch_user(self, user_id_or_name: Union[str, int]) -> GitlabUser:
         try:
             if isinstance(user_id_or_name, int):
                 user_id = user_id_or_name
@@ -144,25 +513,171 @@ class Gitlab:
                 raise NoMatchingUserError('The user "{}" is not accessible.'.format(user_id_or_name)) from e
         return user
 
-    def get_project_members(self, project: GitlabProject, minimum_role: int = MAINTAINER_ACCESS) -> List[GitlabUser]:
-        return [p for p in project.members_all.list(all=True) if p.access_level >= minimum_role]
+    def get_project_members(self, project: ProjectRecord, minimum_role: int = MAINTAINER_ACCESS) -> List[MemberRecord]:
+        return self._get_cached(
+            ("project_members", project.id, minimum_role), lambda: self._list_project_members(project, minimum_role)
+        )
+
+    def forget_project_members(self, projects: Iterable[ProjectRecord], minimum_role: int = MAINTAINER_ACCESS) -> None:
+        """Drop the cached members of `projects`, so streamed pages of group projects do not pile up in the cache."""
+        for project in projects:
+            self._lookup_cache.pop(("project_members", project.id, minimum_role), None)
+
+    def _list_project_members(self, project: ProjectRecord, minimum_role: int) -> List[MemberRecord]:
+        member_dicts = self._gitlab.http_list(PROJECT_MEMBERS_PATH.format(project.id), all=True)
+        return [
+            MemberRecord.from_attributes(member_dict)
+            for member_dict in member_dicts
+            if member_dict["access_level"] >= minimum_role
+        ]
+
+    def _list_group_member_ids(self, group: GitlabGroup, minimum_role: int) -> FrozenSet[int]:
+        return frozenset(
+            member.id for member in group.members_all.list(all=True) if member.access_level >= minimum_role
+        )
+
+    def get_member_ids(
+        self, user_or_group: Union[GitlabUser, GitlabGroup], minimum_role: int = MAINTAINER_ACCESS
+    ) -> FrozenSet[int]:
+        """Return the ids of the given user or of all group members with at least `minimum_role`.
+
+        Group members are fetched once and cached until the next run (see `start_run`), or for `membership_cache_ttl`
+        seconds if set.
+        """
+        if isinstance(user_or_group, GitlabUser):
+            return frozenset((user_or_group.id,))
+        group = user_or_group
+        cache_key = (group.id, minimum_role)
+        with self._group_member_ids_cache_lock:
+            key_lock = self._group_member_ids_key_locks.setdefault(cache_key, threading.Lock())
+        # Hold the lock of the key while fetching, so concurrent workers do not request the same member list multiple
+        # times, but can fetch the members of other groups in the meantime
+        with key_lock:
+            with self._group_member_ids_cache_lock:
+                cache_entry = self._group_member_ids_cache.get(cache_key)
+            if cache_entry is not None:
+                lookup_time, member_ids = cache_entry
+                if self._membership_cache_ttl is None or time.monotonic() - lookup_time < self._membership_cache_ttl:
+                    return member_ids
+            member_ids = self._list_group_member_ids(group, minimum_role)
+            with self._group_member_ids_cache_lock:
+                self._group_member_ids_cache[cache_key] = (time.monotonic(), member_ids)
+        return member_ids
+
+    def get_membership_source_ids(
+        self, user_id: int, minimum_role: int = MAINTAINER_ACCESS
+    ) -> Tuple[FrozenSet[int], FrozenSet[int]]:
+        """Return the ids of the projects and of the groups in which the user is a direct member with `minimum_role`."""
+        return self._get_cached(
+            ("membership_source_ids", user_id, minimum_role),
+            lambda: self._list_membership_source_ids(user_id, minimum_role),
+        )
+
+    def _list_membership_source_ids(self, user_id: int, minimum_role: int) -> Tuple[FrozenSet[int], FrozenSet[int]]:
+        project_ids: Set[int] = set()
+        group_ids: Set[int] = set()
+        user = self._gitlab.users.get(user_id, lazy=True)
+        for membership in user.memberships.list(all=True):
+            if membership.access_level < minimum_role:
+                continue
+            if membership.source_type == "Project":
+                project_ids.add(membership.source_id)
+            else:
+                group_ids.add(membership.source_id)
+        return frozenset(project_ids), frozenset(group_ids)
+
+    def get_group_project_ids_with_subgroups(self, group_id: int) -> FrozenSet[int]:
+        return self._get_cached(
+            ("group_project_ids_with_subgroups", group_id),
+            lambda: self._list_group_project_ids_with_subgroups(group_id),
+        )
+
+    def _list_group_project_ids_with_subgroups(self, group_id: int) -> FrozenSet[int]:
+        group = self._gitlab.groups.get(group_id, lazy=True)
+        # Projects shared with the group are omitted, since the access of the group members can be limited by the share
+        return frozenset(
+            project.id
+            for project in group.projects.list(all=True, include_subgroups=True, with_shared=False, simple=True)
+        )
+
+    def get_accessible_project_ids(
+        self, users_or_groups: Iterable[Union[GitlabUser, GitlabGroup]], minimum_role: int = MAINTAINER_ACCESS
+    ) -> FrozenSet[int]:
+        """Return the ids of all projects in which any of the given users or group members has `minimum_role`.
+
+        The projects are collected from the direct memberships of every user, so the number of API calls depends on the
+        number of users and not on the number of projects. Access which is only granted by sharing a project or group
+        with another group is not included.
+        """
+        user_ids: Set[int] = set()
+        for user_or_group in users_or_groups:
+            user_ids.update(self.get_member_ids(user_or_group, minimum_role))
+        uncached_user_ids = sorted(
+            user_id for user_id in user_ids if (user_id, minimum_role) not in self._accessible_project_ids_by_user_id
+        )
+        membership_source_ids = self.map_concurrently(
+            lambda user_id: self.get_membership_source_ids(user_id, minimum_role), uncached_user_ids
+        )
+        # Allowed users are often members of the same groups, so the memberships of all users are collected first and
+        # every group is listed only once
+        group_ids = sorted(frozenset().union(*(group_ids for _, group_ids in membership_source_ids)))
+        project_ids_by_group_id = dict(
+            zip(group_ids, self.map_concurrently(self.get_group_project_ids_with_subgroups, group_ids))
+        )
+        for user_id, (project_ids, user_group_ids) in zip(uncached_user_ids, membership_source_ids):
+            self._accessible_project_ids_by_user_id[(user_id, minimum_role)] = project_ids.union(
+                *(project_ids_by_group_id[group_id] for group_id in user_group_ids)
+            )
+        return frozenset().union(
+            *(self._accessible_project_ids_by_user_id[(user_id, minimum_role)] for user_id in user_ids)
+        )
+
+    def is_group_shared_with_groups(self, namespace_full_path: str) -> bool:
+        """Return whether the group `namespace_full_path` or one of its parent groups is shared with other groups.
+
+        The members of these other groups can access all projects of the shared group without being members of it, so
+        `get_accessible_project_ids` does not find these projects. User namespaces cannot be shared with groups.
+        Inaccessible groups are considered as shared, since their settings are unknown.
+        """
+        path_parts = namespace_full_path.split("/")
+        for part_count in range(len(path_parts), 0, -1):
+            group_path = "/".join(path_parts[:part_count])
+            try:
+                if self._get_cached(
+                    ("group_shared_with_groups", group_path), lambda: self._fetch_group_shared_with_groups(group_path)
+                ):
+                    return True
+            except NoMatchingGroupError:
+                if len(path_parts) > 1:
+                    return True
+                try:
+                    return cast(str, self.get_namespace(namespace_full_path).kind) != "user"
+                except NoMatchingNamespaceError:
+                    return True
+        return False
+
+    def _fetch_group_shared_with_groups(self, group_path: str) -> bool:
+        try:
+            # Omit the projects of the group, which are listed by default
+            group_dict = self._gitlab.http_get(
+                "/groups/{}".format(quote(group_path, safe="")), query_data={"with_projects": "false"}
+            )
+        except GitlabHttpError as e:
+            raise NoMatchingGroupError('The group "{}" is not accessible.'.format(group_path)) from e
+        return bool(cast(Dict[str, Any], group_dict).get("shared_with_groups"))
 
     def is_any_user_in_project(
         self,
         users_or_groups: Iterable[Union[GitlabUser, GitlabGroup]],
-        project: GitlabProject,
+        project: ProjectRecord,
         minimum_role: int = MAINTAINER_ACCESS,
     ) -> bool:
-        users = set()
+        users_or_groups = list(users_or_groups)
+        user_ids: Set[int] = set()
         for user_or_group in users_or_groups:
-            if isinstance(user_or_group, GitlabUser):
-                users.add(user_or_group)
-            else:
-                users.update(
-                    user for user in user_or_group.members_all.list(all=True) if user.access_level >= minimum_role
-                )
-        project_members = set(self.get_project_members(project, minimum_role))
-        project_members_and_users = project_members & users
+            user_ids.update(self.get_member_ids(user_or_group, minimum_role))
+        project_members = self.get_project_members(project, minimum_role)
+        project_members_and_users = [member for member in project_members if member.id in user_ids]
         if project_members_and_users:
             logger.debug(
                 'The users %s are members of the project "%s"',
@@ -172,145 +687,447 @@ class Gitlab:
             return True
         else:
             logger.debug(
-                'None of the users %s is member of the project "%s"',
-                [user.username for user in users],
+                'None of the users and group members of %s is member of the project "%s"',
+                [
+                    user_or_group.username if isinstance(user_or_group, GitlabUser) else user_or_group.full_path
+                    for user_or_group in users_or_groups
+                ],
                 project.path_with_namespace,
             )
             return False
 
+    def get_project_file_commit_id(self, project: GitlabProject, file_path: str, branch: str) -> Optional[str]:
+        """Return the id of the last commit which changed the given file or `None` if the file does not exist."""
+        return self._get_cached(
+            ("project_file_commit_id", project.id, file_path, branch),
+            lambda: self._fetch_project_file_commit_id(project, file_path, branch),
+        )
+
+    def _fetch_project_file_commit_id(self, project: GitlabProject, file_path: str, branch: str) -> Optional[str]:
+        # A `HEAD` request returns the file metadata as response headers without transferring the file content
+        try:
+            response = self._gitlab.http_request(
+                "head",
+                "{}/{}".format(project.files.path, quote(file_path, safe="")),
+                query_data={"ref": branch},
+            )
+        except GitlabHttpError as e:
+            logger.debug(str(e))
+            return None
+        return response.headers.get("X-Gitlab-Last-Commit-Id")
+
     def get_project_file(self, project: GitlabProject, file_path: str, branch: str) -> Optional[bytes]:
-        directory_path = os.path.dirname(file_path)
-        file_name = os.path.basename(file_path)
+        """Return the content of the given file or `None` if the file does not exist.
+
+        If a run state is kept (see `cache_dir`), files are only downloaded if they were changed since the last run.
+        """
+        if self._run_state is None:
+            return self._download_project_file(project, file_path, branch)
+        commit_id = self.get_project_file_commit_id(project, file_path, branch)
+        if commit_id is None:
+            return None
+        state_key = "{}:{}:{}".format(project.id, branch, file_path)
+        file_content = self._run_state.get_config_file(state_key, commit_id)
+        if file_content is not None:
+            logger.debug('The file "%s" is unchanged since commit "%s", using the stored copy', file_path, commit_id)
+            return file_content
+        file_content = self._download_project_file(project, file_path, branch)
+        if file_content is not None:
+            self._run_state.set_config_file(state_key, commit_id, file_content)
+        return file_content
+
+    def _download_project_file(self, project: GitlabProject, file_path: str, branch: str) -> Optional[bytes]:
         try:
-            matching_files = [
-                entry
-                for entry in project.repository_tree(path=directory_path, ref=branch)
-                if entry["name"] == file_name
-            ]
-            if matching_files:
-                file_content = project.repository_raw_blob(matching_files[0]["id"])
-                return cast(bytes, file_content)
+            return cast(bytes, project.files.raw(file_path=file_path, ref=branch))
         except GitlabGetError as e:
             logger.debug(str(e))
         return None
 
+    def get_projects_fingerprint(self) -> str:
+        """Return a short string which changes when projects are created, renamed, transferred or their settings change.
+
+        It consists of the newest project and of the most recently updated project, since every created project becomes
+        the newest one and every changed project becomes the most recently updated one. Deleted projects are not
+        covered, since they need no configuration.
+        """
+        newest_projects = cast(
+            List[Dict[str, Any]],
+            self._gitlab.http_get(
+                "/projects", query_data={"order_by": "id", "sort": "desc", "per_page": 1, "simple": True}
+            ),
+        )
+        updated_projects = cast(
+            List[Dict[str, Any]],
+            self._gitlab.http_get("/projects", query_data={"order_by": "updated_at", "sort": "desc", "per_page": 1}),
+        )
+        newest_project = newest_projects[0] if newest_projects else {}
+        updated_project = updated_projects[0] if updated_projects else {}
+        return "{}:{}:{}:{}:{}".format(
+            newest_project.get("id", ""),
+            updated_project.get("id", ""),
+            updated_project.get("path_with_namespace", ""),
+            updated_project.get("shared_runners_enabled", ""),
+            updated_project.get("updated_at", updated_project.get("last_activity_at", "")),
+        )
+
+    def _list_project_runner_ids(self, project: ProjectRecord) -> FrozenSet[int]:
+        return frozenset(
+            runner_dict["id"]
+            for runner_dict in self._gitlab.http_list(PROJECT_RUNNERS_PATH.format(project.id), all=True)
+        )
+
+    def get_runner_project_ids(self, runner: RunnerRecord) -> Optional[FrozenSet[int]]:
+        """Return the ids of all projects the runner is enabled in, taken from the runner details.
+
+        `None` is returned if the runner was not fetched with its details (e.g. from a runner listing).
+        """
+        return runner.project_ids
+
+    def get_enabled_runner_ids(self, projects: Iterable[ProjectRecord]) -> Dict[int, FrozenSet[int]]:
+        projects = list(projects)
+        return {
+            project.id: runner_ids
+            for project, runner_ids in zip(projects, self.map_concurrently(self._list_project_runner_ids, projects))
+        }
+
+    def plan_runner_activation(self, plan: RunnerActivationPlan) -> None:
+        """Fetch the current state of all projects in `plan` and compute the changes which must be applied."""
+        # Projects are checked for shared runners only once, even across multiple plans
+        plan.discard_shared_runner_checks(self._projects_with_already_disabled_shared_runners)
+        self._projects_with_already_disabled_shared_runners.update(plan.shared_runner_project_ids)
+        # Runner details contain all projects of a runner, so one request per runner is sufficient
+        runner_project_ids_list = [self.get_runner_project_ids(runner) for runner in plan.runners]
+        enabled_runner_ids_by_project_id: Dict[int, Set[int]] = {}
+        if all(runner_project_ids is not None for runner_project_ids in runner_project_ids_list):
+            for runner, runner_project_ids in zip(plan.runners, runner_project_ids_list):
+                for project_id in runner_project_ids or ():
+                    enabled_runner_ids_by_project_id.setdefault(project_id, set()).add(runner.id)
+        else:
+            # Fall back to listing the runners of every project
+            for project_id, runner_ids in self.get_enabled_runner_ids(plan.projects).items():
+                enabled_runner_ids_by_project_id[project_id] = set(runner_ids)
+        # Runners are activated only once, even if a project is part of multiple plans
+        for runner_id, project_id in plan.iter_desired_runner_assignments():
+            if (runner_id, project_id) in self._planned_runner_activations:
+                enabled_runner_ids_by_project_id.setdefault(project_id, set()).add(runner_id)
+        plan.compute_changes(enabled_runner_ids_by_project_id)
+        self._planned_runner_activations.update(plan.runner_activations)
+
+    def _disable_shared_runners(self, project: ProjectRecord) -> None:
+        # Only send the changed setting, a full `project.save()` could overwrite concurrent changes of other settings
+        self._gitlab.projects.update(project.id, {"shared_runners_enabled": False})
+        project.shared_runners_enabled = False
+        self._invalidate_cached_shared_runner_deactivation(project.id)
+
+    def _enable_runner(self, runner: RunnerRecord, project: ProjectRecord) -> None:
+        self._gitlab.http_post(PROJECT_RUNNERS_PATH.format(project.id), post_data={"runner_id": runner.id})
+        self._invalidate_cached_runner_activation(runner.id, project.id)
+
+    def _apply_project_changes(
+        self, plan: RunnerActivationPlan, project_id: int, disable_shared_runners: bool, runner_ids: Iterable[int]
+    ) -> List[str]:
+        """Apply all changes of one project in order and return descriptions of the failed changes."""
+        failures = []
+        project = plan.get_project(project_id)
+        if disable_shared_runners:
+            try:
+                self._disable_shared_runners(project)
+            except WRITE_ERRORS as e:
+                failures.append('Disable shared runners in project "{}": {}'.format(project.path_with_namespace, e))
+        for runner_id in runner_ids:
+            try:
+                self._enable_runner(plan.get_runner(runner_id), project)
+            except WRITE_ERRORS as e:
+                failures.append(
+                    'Enable runner with id `{}` in project "{}": {}'.format(runner_id, project.path_with_namespace, e)
+                )
+        return failures
+
+    def _apply_runner_activation_changes(self, plan: RunnerActivationPlan) -> List[str]:
+        # Projects are independent of each other, so the changes of different projects are applied concurrently
+        failures_by_project = self.map_concurrently(
+            lambda project_changes: self._apply_project_changes(plan, *project_changes),
+            list(plan.iter_changes_by_project()),
+        )
+        return [failure for failures in failures_by_project for failure in failures]
+
+    def apply_runner_activation_plan(self, plan: RunnerActivationPlan, log_unchanged: bool = True) -> bool:
+        """Log the changes of a computed `plan` and apply them (unless in dry run mode).
+
+        A failed change does not stop the other changes. All failures are reported at the end and `False` is returned.
+        If `log_unchanged` is `False`, an empty plan is not reported (e.g. for single pages of a streamed run).
+        """
+        logged_shared_runner_project_ids: Set[int] = set()
+        for runner_id, project_id in plan.iter_desired_runner_assignments():
+            runner = plan.get_runner(runner_id)
+            project = plan.get_project(project_id)
+            if plan.needs_shared_runner_check(project_id) and project_id not in logged_shared_runner_project_ids:
+                if plan.needs_shared_runner_deactivation(project_id):
+                    if self._dry_run:
+                        logger.info('Would disable shared runners in project "%s"', project.path_with_namespace)
+                    else:
+                        logger.info('Disable shared runners in project "%s"', project.path_with_namespace)
+                else:
+                    logger.info('Shared runners are already disabled in project "%s"', project.path_with_namespace)
+                logged_shared_runner_project_ids.add(project_id)
+            runner_args = (runner.description, runner.id, '", "'.join(runner.tag_list), project.path_with_namespace)
+            if plan.needs_runner_activation(runner_id, project_id):
+                if self._dry_run:
+                    logger.info('Would enable runner "%s", (id: `%d`, tags: ["%s"]) in project "%s"', *runner_args)
+                else:
+                    logger.info('Enable runner "%s", (id: `%d`, tags: ["%s"]) in project "%s"', *runner_args)
+            else:
+                logger.info('Runner "%s", (id: `%d`, tags: ["%s"]) is already enabled in project "%s"', *runner_args)
+        if not plan:
+            if log_unchanged:
+                logger.info("All runners are already configured, nothing to change")
+        elif not self._dry_run:
+            failures = self._apply_runner_activation_changes(plan)
+            self.profile_count("failed_changes", len(failures))
+            if failures:
+                logger.error(
+                    "%d of %d changes failed:\n%s", len(failures), len(plan), "\n".join("- " + f for f in failures)
+                )
+                return False
+        return True
+
     def activate_runner_in_projects(
         self,
-        runner_or_id: Union[int, GitlabRunner],
-        projects: Iterable[GitlabProject],
+        runner_or_id: Union[int, RunnerRecord],
+        projects: Iterable[ProjectRecord],
         disable_shared_runners: bool = False,
-    ) -> None:
+    ) -> bool:
         if isinstance(runner_or_id, int):
             runner = self.get_runner(runner_or_id)
         else:
             runner = runner_or_id
-        for project in projects:
-            if disable_shared_runners:
-                if project.id not in self._projects_with_already_disabled_shared_runners:
-                    if project.shared_runners_enabled:
-                        if self._dry_run:
-                            logger.info('Would disable shared runners in project "%s"', project.path_with_namespace)
-                        else:
-                            logger.info('Disable shared runners in project "%s"', project.path_with_namespace)
-                            project.shared_runners_enabled = False
-                            project.save()
-                    else:
-                        logger.info('Shared runners are already disabled in project "%s"', project.path_with_namespace)
-                    self._projects_with_already_disabled_shared_runners.add(project.id)
-            project_runners = project.runners.list(all=True)
-            if runner.id not in (r.id for r in project_runners):
-                if self._dry_run:
-                    logger.info(
-                        'Would enable runner "%s", (id: `%d`, tags: ["%s"]) in project "%s"',
-                        runner.description,
-                        runner.id,
-                        '", "'.join(runner.tag_list),
-                        project.path_with_namespace,
-                    )
-                else:
-                    logger.info(
-                        'Enable runner "%s", (id: `%d`, tags: ["%s"]) in project "%s"',
-                        runner.description,
-                        runner.id,
-                        '", "'.join(runner.tag_list),
-                        project.path_with_namespace,
-                    )
-                    project.runners.create({"runner_id": runner.id})
-            else:
-                logger.info(
-                    'Runner "%s", (id: `%d`, tags: ["%s"]) is already enabled in project "%s"',
-                    runner.description,
-                    runner.id,
-                    '", "'.join(runner.tag_list),
-                    project.path_with_namespace,
-                )
+        plan = RunnerActivationPlan()
+        plan.add(runner, projects, disable_shared_runners)
+        self.plan_runner_activation(plan)
+        return self.apply_runner_activation_plan(plan)
+
+
+def _split_into_pages(projects: Iterable[ProjectRecord]) -> Iterator[List[ProjectRecord]]:
+    page: List[ProjectRecord] = []
+    for project in projects:
+        page.append(project)
+        if len(page) == STREAM_PAGE_SIZE:
+            yield page
+            page = []
+    if page:
+        yield page
+
 
+class NamespaceResolver:
+    """Classifies the names of the configuration files as GitLab users, groups or projects.
 
-class MultiGroupRunnerConfig:
-    def __init__(self, config_content: str):
-        def parse_config(config_content: str) -> Dict[str, Any]:
-            validator = Validator(MULTI_GROUP_RUNNER_CONFIG_SCHEMA)
-            if not validator.validate(yaml.safe_load(config_content)):
-                raise ConfigValidationFailedError(None, validator.errors)
-            normalized_config_dict = validator.document
-            return cast(Dict[str, Any], normalized_config_dict)
+    Names without a slash can only be users or groups and are classified with one namespace request, which returns the
+    group as well. Names with a slash are tried as project first, since subgroups are less common. The classification
+    is stored in `state_filepath` (if given), so following runs look up every name with exactly one request.
+    """
 
-        self._config_dict = parse_config(config_content)
+    def __init__(self, gitlab: Gitlab, state_filepath: Optional[str] = None):
+        self._gitlab = gitlab
+        self._state_filepath = state_filepath
+        self._kinds_by_name = self._load_kinds_by_name()
 
-    def __iter__(self) -> Iterator[int]:
-        return (runner_id for runner_config in self._config_dict["runners"] for runner_id in runner_config["ids"])
+    def _load_kinds_by_name(self) -> Dict[str, str]:
+        kinds_by_name = load_json_file(self._state_filepath) if self._state_filepath is not None else None
+        return cast(Dict[str, str], kinds_by_name) if isinstance(kinds_by_name, dict) else {}
+
+    def save(self) -> None:
+        if self._state_filepath is not None:
+            write_json_file(self._state_filepath, self._kinds_by_name)
+
+    def _lookup(self, name: str, kind: str) -> Union[GitlabUser, GitlabGroup, GitlabProject]:
+        if kind == "user":
+            return self._gitlab.get_user(name)
+        elif kind == "group":
+            return self._gitlab.get_group(name)
+        else:
+            return self._gitlab.get_project(name)
+
+    def _get_candidate_kinds(self, name: str) -> List[str]:
+        if "/" in name:
+            return ["project", "group"]
+        try:
+            namespace = self._gitlab.get_namespace(name)
+        except NoMatchingNamespaceError:
+            # The namespace API can be restricted, so try all possible kinds in this case
+            return ["group", "user"]
+        if namespace.kind == "group":
+            self._gitlab.get_group_from_namespace(namespace)
+        return [namespace.kind]
+
+    def resolve(self, name: str, kinds: Collection[str]) -> Optional[Union[GitlabUser, GitlabGroup, GitlabProject]]:
+        """Return the user, group or project `name` if it is one of the given `kinds`, otherwise `None`."""
+        known_kind = self._kinds_by_name.get(name)
+        if known_kind in kinds:
+            try:
+                return self._lookup(name, cast(str, known_kind))
+            except LOOKUP_ERRORS:
+                logger.debug('"%s" is not a GitLab %s anymore', name, known_kind)
+        for kind in self._get_candidate_kinds(name):
+            if kind not in kinds:
+                continue
+            try:
+                resolved = self._lookup(name, kind)
+            except LOOKUP_ERRORS:
+                continue
+            logger.debug('Identified "%s" as GitLab %s', name, kind)
+            self._kinds_by_name[name] = kind
+            return resolved
+        return None
 
-    def iter_runners_with_groups_and_projects(self) -> Iterator[Tuple[int, Iterable[str]]]:
-        return (
-            (runner_id, runner_config["groups_and_projects"])
-            for runner_config in self._config_dict["runners"]
-            for runner_id in runner_config["ids"]
+    def resolve_all(
+        self, names: Iterable[str], kinds: Collection[str]
+    ) -> Dict[str, Optional[Union[GitlabUser, GitlabGroup, GitlabProject]]]:
+        unique_names = list(dict.fromkeys(names))
+        return dict(
+            zip(unique_names, self._gitlab.map_concurrently(lambda name: self.resolve(name, kinds), unique_names))
         )
 
 
-def assign_multi_group_runner(
+def create_gitlab(
     gitlab_url: str,
     private_token: str,
+    dry_run: bool = False,
+    max_workers: int = 1,
+    backend: str = "sync",
+    membership_cache_ttl: Optional[float] = None,
+    cache_dir: Optional[str] = None,
+    max_requests_per_second: Optional[float] = None,
+) -> Gitlab:
+    gitlab_class = Gitlab
+    if backend == "async":
+        from .async_gitlab import AsyncGitlab
+
+        gitlab_class = AsyncGitlab
+    elif backend == "graphql":
+        from .graphql_gitlab import GraphQLGitlab
+
+        gitlab_class = GraphQLGitlab
+    return gitlab_class(
+        gitlab_url, private_token, dry_run, max_workers, membership_cache_ttl, cache_dir, max_requests_per_second
+    )
+
+
+def plan_multi_group_runner(
+    gitlab: Gitlab,
+    plan: RunnerActivationPlan,
     allowed_runner_ids: Iterable[int],
     runner_config_repo_path: str,
     runner_config_repo_branch: str,
     allowed_projects_rules: Dict[str, Any],
     disable_shared_runners: bool,
-    dry_run: bool = False,
+    precompute_allowed_projects: bool = False,
+    project_ids: Optional[Collection[int]] = None,
+    namespace_resolver: Optional[NamespaceResolver] = None,
+    shard: Optional[Shard] = None,
+    apply_plan: Optional[Callable[[RunnerActivationPlan], bool]] = None,
+    group_ids: Optional[Collection[int]] = None,
 ) -> bool:
+    """Add the runner assignments of the given config repository to `plan`.
+
+    If `project_ids` is given, only these projects are configured (if they are part of the configured groups and
+    projects). Group projects are not listed in this case, so this is cheap for a small number of projects. If
+    `group_ids` is given, the projects of these groups (including subgroups) are configured in the same way. They are
+    taken from one listing per group, so no project needs to be fetched on its own.
+
+    If `shard` is given, only the projects of this shard are checked and configured.
+
+    Entries of `groups_and_projects` which are patterns (see `PathPattern`) are matched against the paths of all
+    projects, which are indexed once per run instead of resolving each entry.
+
+    If `apply_plan` is given, group projects are listed page by page (see `Gitlab.iter_group_project_pages`) and every
+    page is planned in a separate plan which is passed to `apply_plan` right away. Changes start with the first page
+    and only one page of group projects is kept in memory. `apply_plan` returns `False` if a change failed.
+    """
+    resolver = namespace_resolver if namespace_resolver is not None else NamespaceResolver(gitlab)
+
     def preprocess_allowed_project_rules() -> Dict[str, Any]:
         processed_project_rules: Dict[str, Any] = {}
         if "one_member_of" in allowed_projects_rules:
             one_member_of: List[Union[GitlabGroup, GitlabUser]] = []
-            for group_or_user_str in allowed_projects_rules["one_member_of"]:
-                try:
-                    user = gitlab.get_user(group_or_user_str)
-                    logger.debug('Identifiied "%s" as GitLab user', group_or_user_str)
-                    one_member_of.append(user)
-                except NoMatchingUserError:
-                    try:
-                        group = gitlab.get_group(group_or_user_str)
-                        logger.debug('Identifiied "%s" as GitLab group', group_or_user_str)
-                        one_member_of.append(group)
-                    except NoMatchingGroupError:
-                        logger.warning('"%s" is neither a valid GitLab group nor user, skipping.', group_or_user_str)
+            resolved_groups_and_users = resolver.resolve_all(allowed_projects_rules["one_member_of"], ("user", "group"))
+            for group_or_user_str, group_or_user in resolved_groups_and_users.items():
+                if group_or_user is None:
+                    logger.warning('"%s" is neither a valid GitLab group nor user, skipping.', group_or_user_str)
+                else:
+                    one_member_of.append(cast(Union[GitlabGroup, GitlabUser], group_or_user))
             processed_project_rules["one_member_of"] = one_member_of
         return processed_project_rules
 
-    def is_project_allowed(project: GitlabProject) -> bool:
+    def is_project_allowed(project: ProjectRecord) -> bool:
         if "one_member_of" in allowed_projects_rules:
+            if precomputed_allowed_project_ids is not None:
+                if project.id in precomputed_allowed_project_ids:
+                    return True
+                # Not finding a project in the precomputed set is only conclusive if neither the project nor a group of
+                # the project is shared with other groups, otherwise check the project members
+                if project.shared_with_groups is False and not gitlab.is_group_shared_with_groups(
+                    project.namespace_full_path
+                ):
+                    logger.debug(
+                        'The project "%s" is not accessible by any of the allowed users and groups',
+                        project.path_with_namespace,
+                    )
+                    return False
             if not gitlab.is_any_user_in_project(
                 users_or_groups=allowed_projects_rules["one_member_of"], project=project, minimum_role=MAINTAINER_ACCESS
             ):
                 return False
         return True
 
+    def iter_group_project_pages(group_path: str, include_subgroups: bool) -> Iterator[List[ProjectRecord]]:
+        # Only the time which is spent waiting for the next page is measured as listing time
+        project_pages = gitlab.iter_group_project_pages(group_path, include_subgroups)
+        while True:
+            with gitlab.profile_phase("List group projects"):
+                projects = next(project_pages, None)
+            if projects is None:
+                return
+            yield projects
+
+    def add_projects_to_plan(
+        target_plan: RunnerActivationPlan, runner: RunnerRecord, group_or_project: str, projects: List[ProjectRecord]
+    ) -> bool:
+        """Add the allowed `projects` of `group_or_project` to `target_plan`, `False` is returned on warnings."""
+        no_warnings = True
+        if shard is not None:
+            # Projects of other shards are skipped before the membership checks, which dominate the run time
+            shard_projects = [project for project in projects if shard.contains(project.id)]
+            logger.debug(
+                '%d of %d projects of "%s" belong to shard %s',
+                len(shard_projects),
+                len(projects),
+                group_or_project,
+                shard,
+            )
+            projects = shard_projects
+        allowed_projects: List[ProjectRecord] = []
+        with gitlab.profile_phase("Check allowed projects"):
+            project_is_allowed_flags = gitlab.map_concurrently(is_project_allowed, projects)
+        target_plan.add_scanned_projects(projects)
+        for project, project_is_allowed in zip(projects, project_is_allowed_flags):
+            if not project_is_allowed:
+                logger.warning(
+                    'It is not allowed to assign the runner with id `%d` to the project "%s", skipping.',
+                    runner.id,
+                    project.path_with_namespace,
+                )
+                no_warnings = False
+                continue
+            allowed_projects.append(project)
+        target_plan.add(runner, allowed_projects, disable_shared_runners)
+        return no_warnings
+
     run_without_warnings = True
-    gitlab = Gitlab(gitlab_url, private_token, dry_run)
-    runner_config_project = gitlab.get_project(runner_config_repo_path)
-    runner_config_content = gitlab.get_project_file(
-        runner_config_project, MULTI_GROUP_RUNNER_CONFIG_FILENAME, runner_config_repo_branch
-    )
+    with gitlab.profile_phase("Read config files"):
+        runner_config_project = gitlab.get_project(runner_config_repo_path)
+        runner_config_content = gitlab.get_project_file(
+            runner_config_project, MULTI_GROUP_RUNNER_CONFIG_FILENAME, runner_config_repo_branch
+        )
     if runner_config_content is None:
         raise NoConfigFileFoundError(
             'Could not find a config file "{}" in the repository "{}", branch "{}".'.format(
@@ -318,8 +1135,47 @@ def assign_multi_group_runner(
             )
         )
     multi_group_runner_config = MultiGroupRunnerConfig(runner_config_content.decode("utf-8"))
-    allowed_projects_rules = preprocess_allowed_project_rules()
-    for runner_id, group_or_projects in multi_group_runner_config.iter_runners_with_groups_and_projects():
+    with gitlab.profile_phase("Resolve names"):
+        allowed_projects_rules = preprocess_allowed_project_rules()
+        target_projects: Optional[List[ProjectRecord]] = None
+        if project_ids is not None or group_ids is not None:
+            target_projects_by_id: Dict[int, ProjectRecord] = {}
+            for group_id in sorted(group_ids or ()):
+                try:
+                    for project in gitlab.get_group_projects(group_id, include_subgroups=True):
+                        target_projects_by_id.setdefault(project.id, project)
+                except NoMatchingGroupError:
+                    logger.debug("The group with id `%d` is not accessible (anymore), skipping.", group_id)
+            for project_id in sorted(project_ids or ()):
+                if project_id in target_projects_by_id:
+                    continue
+                try:
+                    target_projects_by_id[project_id] = ProjectRecord.from_attributes(
+                        gitlab.get_project(project_id).attributes
+                    )
+                except NoMatchingProjectError:
+                    logger.debug("The project with id `%d` is not accessible (anymore), skipping.", project_id)
+            target_projects = list(target_projects_by_id.values())
+        resolved_groups_and_projects: Dict[str, Optional[Union[GitlabUser, GitlabGroup, GitlabProject]]] = {}
+        if target_projects is None:
+            resolved_groups_and_projects = resolver.resolve_all(
+                (
+                    group_or_project
+                    for _, group_or_projects in multi_group_runner_config.iter_runners_with_groups_and_projects()
+                    for group_or_project in group_or_projects
+                    if not is_path_pattern(group_or_project)
+                ),
+                ("group", "project"),
+            )
+    precomputed_allowed_project_ids: Optional[FrozenSet[int]] = None
+    if precompute_allowed_projects and target_projects is None and "one_member_of" in allowed_projects_rules:
+        with gitlab.profile_phase("Precompute allowed projects"):
+            precomputed_allowed_project_ids = gitlab.get_accessible_project_ids(
+                allowed_projects_rules["one_member_of"], MAINTAINER_ACCESS
+            )
+    # Groups are streamed after all runners were checked, so groups of multiple runners are listed only once
+    streamed_group_runners: Dict[Tuple[str, bool], List[RunnerRecord]] = {}
+    for runner_id, group_and_project_entries in multi_group_runner_config.iter_runners_with_group_and_project_entries():
         if runner_id not in allowed_runner_ids:
             logger.warning(
                 "The runner with id `%d` is not allowed to be assigned to other projects, skipping.", runner_id
@@ -336,35 +1192,260 @@ def assign_multi_group_runner(
             logger.warning("The runner with id `%d` is not a specific runner, skipping.", runner_id)
             run_without_warnings = False
             continue
-        for group_or_project in group_or_projects:
-            try:
-                projects = gitlab.get_group_projects(group_or_project)
-            except NoMatchingGroupError:
-                try:
-                    projects = [gitlab.get_project(group_or_project)]
-                except NoMatchingProjectError:
+        for group_or_project, include_subgroups in group_and_project_entries:
+            if is_path_pattern(group_or_project):
+                # Patterns match project paths, so `include_subgroups` does not apply to them
+                path_pattern = PathPattern(group_or_project)
+                if target_projects is not None:
+                    projects = [
+                        project for project in target_projects if path_pattern.matches(project.path_with_namespace)
+                    ]
+                else:
+                    with gitlab.profile_phase("Match project patterns"):
+                        projects = gitlab.get_project_index().match(path_pattern)
+                    if not projects:
+                        logger.warning('The pattern "%s" does not match any accessible project.', group_or_project)
+            elif target_projects is not None:
+                projects = [
+                    project
+                    for project in target_projects
+                    if group_or_project in (project.path_with_namespace, project.namespace_full_path)
+                    or (include_subgroups and project.namespace_full_path.startswith(group_or_project + "/"))
+                ]
+            else:
+                group_or_project_object = resolved_groups_and_projects[group_or_project]
+                if isinstance(group_or_project_object, GitlabGroup):
+                    if apply_plan is not None:
+                        streamed_group_runners.setdefault((group_or_project, include_subgroups), []).append(runner)
+                        continue
+                    with gitlab.profile_phase("List group projects"):
+                        projects = gitlab.get_group_projects(group_or_project, include_subgroups)
+                elif isinstance(group_or_project_object, GitlabProject):
+                    projects = [ProjectRecord.from_attributes(group_or_project_object.attributes)]
+                else:
                     logger.warning('"%s" is neither an accessible group nor project, skipping.', group_or_project)
                     run_without_warnings = False
                     continue
-            allowed_projects: List[GitlabProject] = []
-            for project in projects:
-                if not is_project_allowed(project):
-                    logger.warning(
-                        'It is not allowed to assign the runner with id `%d` to the project "%s", skipping.',
-                        runner_id,
-                        project.path_with_namespace,
-                    )
-                    run_without_warnings = False
-                    continue
-                allowed_projects.append(project)
-            gitlab.activate_runner_in_projects(runner, allowed_projects, disable_shared_runners)
+            if not add_projects_to_plan(plan, runner, group_or_project, projects):
+                run_without_warnings = False
+    if apply_plan is not None:
+        for (group_path, include_subgroups), runners in streamed_group_runners.items():
+            for projects in iter_group_project_pages(group_path, include_subgroups):
+                page_plan = RunnerActivationPlan()
+                for runner in runners:
+                    if not add_projects_to_plan(page_plan, runner, group_path, projects):
+                        run_without_warnings = False
+                # Empty pages (e.g. of other shards) do not need to be applied
+                if any(True for _ in page_plan.iter_desired_runner_assignments()):
+                    if not apply_plan(page_plan):
+                        run_without_warnings = False
+                gitlab.forget_project_members(projects)
     return run_without_warnings
 
 
-def write_example_multi_group_runner_config(config_filepath_or_file: Union[str, TextIO]) -> None:
-    if isinstance(config_filepath_or_file, str):
-        with open(config_filepath_or_file, "w", encoding="utf-8") as config_file:
-            dump_config_as_yaml(MULTI_GROUP_RUNNER_EXAMPLE_CONFIG, config_file)
-    else:
-        config_file = config_filepath_or_file
-        dump_config_as_yaml(MULTI_GROUP_RUNNER_EXAMPLE_CONFIG, config_file)
+def get_run_fingerprint(gitlab: Gitlab, runner_configs: Iterable[Dict[str, Any]], *options: Any) -> str:
+    """Return a hash of everything a run depends on, which can be computed with few and cheap requests.
+
+    It covers the runner configs, the given `options`, the commits of all config files, the created and changed
+    projects (see `Gitlab.get_projects_fingerprint`) and the projects of all configured runners, so runners which were
+    enabled or disabled by hand are noticed as well. Changes of group or project memberships are not covered, since
+    they cannot be detected without listing all members.
+    """
+    config_file_commit_ids = []
+    for runner_config in runner_configs:
+        runner_config_project = gitlab.get_project(runner_config["config_repo"]["path"])
+        config_file_commit_ids.append(
+            gitlab.get_project_file_commit_id(
+                runner_config_project, MULTI_GROUP_RUNNER_CONFIG_FILENAME, runner_config["config_repo"]["branch"]
+            )
+        )
+    runner_project_ids = {
+        runner_id: sorted(gitlab.fetch_runner_project_ids(runner_id))
+        for runner_config in runner_configs
+        for runner_id in runner_config["ids"]
+    }
+    run_dependencies = [
+        list(runner_configs),
+        options,
+        config_file_commit_ids,
+        gitlab.get_projects_fingerprint(),
+        runner_project_ids,
+    ]
+    return hashlib.sha256(json.dumps(run_dependencies, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def assign_multi_group_runners(
+    gitlab: Gitlab,
+    runner_configs: Iterable[Dict[str, Any]],
+    disable_shared_runners: bool,
+    precompute_allowed_projects: bool = False,
+    project_ids: Optional[Collection[int]] = None,
+    skip_unchanged_runs: bool = False,
+    shard: Optional[Shard] = None,
+    stream_changes: bool = False,
+    group_ids: Optional[Collection[int]] = None,
+) -> bool:
+    """Assign the runners of multiple config repositories (entries of the `runners` config section) in one session.
+
+    All config repositories share the connection pool and lookup caches of `gitlab` and are combined into one plan, so
+    groups and projects which are referenced by multiple config repositories are only fetched and configured once.
+
+    If `shard` is given, only the projects of this shard are configured (see `Shard`). Runs of all shards together
+    configure every project exactly once.
+
+    A config repository which cannot be read (see `CONFIG_REPOSITORY_ERRORS`) is skipped and the other ones are still
+    configured. The error of the first skipped config repository is raised after all changes were applied.
+
+    If `skip_unchanged_runs` is set and `gitlab` keeps a run state, the run is skipped if its fingerprint (see
+    `get_run_fingerprint`) equals the fingerprint of the last successful run of the same config repositories and shard.
+
+    If `stream_changes` is set, the changes of group projects are applied page by page while the groups are listed,
+    instead of after all config repositories were read (see `plan_multi_group_runner`).
+    """
+    runner_configs = list(runner_configs)
+    run_state = gitlab.run_state
+    run_fingerprint = None
+    last_run_key = get_last_run_key(
+        (
+            (runner_config["config_repo"]["path"], runner_config["config_repo"]["branch"])
+            for runner_config in runner_configs
+        ),
+        shard,
+    )
+    if skip_unchanged_runs and run_state is not None and project_ids is None and group_ids is None:
+        with gitlab.profile_phase("Check for changes"):
+            try:
+                run_fingerprint = get_run_fingerprint(
+                    gitlab, runner_configs, disable_shared_runners, precompute_allowed_projects, str(shard)
+                )
+            except CONFIG_REPOSITORY_ERRORS as e:
+                # The broken config repository is reported when it is planned
+                logger.debug("Could not compute the run fingerprint (%s), not skipping the run", e)
+        last_run = run_state.get_last_run(last_run_key)
+        if run_fingerprint is not None and last_run is not None and last_run["fingerprint"] == run_fingerprint:
+            logger.info(
+                "Neither the configuration, the GitLab projects nor the runners changed since the last run, skipping"
+            )
+            return bool(last_run["run_without_warnings"])
+    if shard is not None:
+        logger.info("Configuring the projects of shard %s", shard)
+    run_without_warnings = True
+    changes_applied = True
+    changes_planned = False
+
+    def apply_plan(plan: RunnerActivationPlan, is_page: bool = True) -> bool:
+        nonlocal changes_applied, changes_planned
+        with gitlab.profile_phase("List enabled runners"):
+            gitlab.plan_runner_activation(plan)
+        # Streamed runs apply a plan per page, so only the last plan reports a run without any changes
+        log_unchanged = not is_page and not changes_planned
+        changes_planned = changes_planned or bool(plan)
+        with gitlab.profile_phase("Apply changes"):
+            plan_applied = gitlab.apply_runner_activation_plan(plan, log_unchanged)
+        gitlab.profile_count("scanned_projects", plan.scanned_project_count)
+        gitlab.profile_count("runner_assignments", sum(1 for _ in plan.iter_desired_runner_assignments()))
+        if not gitlab.dry_run:
+            gitlab.profile_count("runner_activations", len(plan.runner_activations))
+            gitlab.profile_count("shared_runner_deactivations", len(plan.shared_runner_deactivations))
+        changes_applied = changes_applied and plan_applied
+        return plan_applied
+
+    plan = RunnerActivationPlan()
+    namespace_resolver = NamespaceResolver(
+        gitlab, os.path.join(gitlab.cache_dir, NAMESPACE_KINDS_FILENAME) if gitlab.cache_dir is not None else None
+    )
+    first_config_repository_error: Optional[Exception] = None
+    for runner_config in runner_configs:
+        try:
+            no_warnings = plan_multi_group_runner(
+                gitlab,
+                plan,
+                runner_config["ids"],
+                runner_config["config_repo"]["path"],
+                runner_config["config_repo"]["branch"],
+                runner_config["allowed_projects_rules"],
+                disable_shared_runners,
+                precompute_allowed_projects,
+                project_ids,
+                namespace_resolver,
+                shard,
+                apply_plan if stream_changes else None,
+                group_ids,
+            )
+        except CONFIG_REPOSITORY_ERRORS as e:
+            # The other config repositories are still configured, the first error is raised at the end of the run
+            logger.warning('Skipping the config repository "%s": %s', runner_config["config_repo"]["path"], e)
+            if first_config_repository_error is None:
+                first_config_repository_error = e
+            continue
+        run_without_warnings = run_without_warnings and no_warnings
+    namespace_resolver.save()
+    # Without streaming, all reads are done before any change is applied, so a run without changes only costs the read
+    # requests. Streamed runs still collect single projects and pattern matches in `plan`, it is applied even if it is
+    # empty to report a run without changes.
+    apply_plan(plan, is_page=False)
+    run_without_warnings = run_without_warnings and changes_applied
+    gitlab.log_request_statistics()
+    if run_state is not None:
+        if (
+            run_fingerprint is not None
+            and changes_applied
+            and first_config_repository_error is None
+            and not gitlab.dry_run
+        ):
+            # The fingerprint from before the run is kept even if changes were applied. It does not match the changed
+            # runners, so the next run does the full work once and records a fingerprint without concurrent changes.
+            run_state.set_last_run(
+                last_run_key, {"fingerprint": run_fingerprint, "run_without_warnings": run_without_warnings}
+            )
+        run_state.save()
+    if first_config_repository_error is not None:
+        raise first_config_repository_error
+    return run_without_warnings
+
+
+def assign_multi_group_runner(
+    gitlab_url: str,
+    private_token: str,
+    allowed_runner_ids: Iterable[int],
+    runner_config_repo_path: str,
+    runner_config_repo_branch: str,
+    allowed_projects_rules: Dict[str, Any],
+    disable_shared_runners: bool,
+    dry_run: bool = False,
+    max_workers: int = 1,
+    backend: str = "sync",
+    membership_cache_ttl: Optional[float] = None,
+    precompute_allowed_projects: bool = False,
+    cache_dir: Optional[str] = None,
+    project_ids: Optional[Collection[int]] = None,
+    skip_unchanged_runs: bool = False,
+    max_requests_per_second: Optional[float] = None,
+    shard: Optional[Shard] = None,
+    stream_changes: bool = False,
+) -> bool:
+    gitlab = create_gitlab(
+        gitlab_url,
+        private_token,
+        dry_run,
+        max_workers,
+        backend,
+        membership_cache_ttl,
+        cache_dir,
+        max_requests_per_second,
+    )
+    runner_config = {
+        "ids": allowed_runner_ids,
+        "config_repo": {"path": runner_config_repo_path, "branch": runner_config_repo_branch},
+        "allowed_projects_rules": allowed_projects_rules,
+    }
+    return assign_multi_group_runners(
+        gitlab,
+        [runner_config],
+        disable_shared_runners,
+        precompute_allowed_projects,
+        project_ids,
+        skip_unchanged_runs,
+        shard,
+        stream_changes,
+    )
@@ -0,0 +1,282 @@
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union, cast
+
+from gitlab import MAINTAINER_ACCESS
+from gitlab.exceptions import GitlabHttpError
+from gitlab.v4.objects import Group as GitlabGroup
+
+from .cache import GRAPHQL_PATH
+from .gitlab import Gitlab, NoMatchingGroupError, _split_into_pages
+from .log_buffer import get_logger
+from .records import MemberRecord, ProjectRecord
+
+logger = get_logger(__name__)
+
+# Nested connections multiply the cost of a query, so projects are requested in smaller pages than REST listings
+PROJECTS_PER_PAGE = 50
+MEMBERS_PER_PROJECT = 100
+# Projects shared with a group are part of the REST group listing (`with_shared`), but not of the GraphQL group projects
+SHARED_PROJECTS_PATH = "/groups/{}/projects/shared"
+# Number of failed queries in a row (e.g. because of missing permissions or server errors) after which GraphQL is not
+# used for the rest of a run, otherwise every listing would be requested twice
+MAX_FAILED_QUERIES_IN_A_ROW = 3
+# Codes and messages of query validation errors, which mean that the schema of this GitLab version lacks needed fields
+SCHEMA_ERROR_CODES = frozenset(
+    (
+        "undefinedField",
+        "undefinedType",
+        "argumentNotAccepted",
+        "argumentLiteralsIncompatible",
+        "missingRequiredArguments",
+    )
+)
+SCHEMA_ERROR_MESSAGES = ("doesn't exist on type", "doesn't accept argument", "has an invalid value")
+
+GROUP_PROJECTS_QUERY = """
+query groupProjects(
+  $fullPath: ID!, $includeSubgroups: Boolean!, $projectsPerPage: Int!, $membersPerProject: Int!, $after: String
+) {
+  group(fullPath: $fullPath) {
+    projects(includeSubgroups: $includeSubgroups, first: $projectsPerPage, after: $after) {
+      pageInfo {
+        hasNextPage
+        endCursor
+      }
+      nodes {
+        id
+        fullPath
+        sharedRunnersEnabled
+        namespace {
+          fullPath
+        }
+        projectMembers(
+          relations: [DIRECT, INHERITED, INVITED_GROUPS, SHARED_INTO_ANCESTORS], first: $membersPerProject
+        ) {
+          pageInfo {
+            hasNextPage
+          }
+          nodes {
+            accessLevel {
+              integerValue
+            }
+            user {
+              id
+              username
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+class GraphQLError(Exception):
+    def __init__(self, message: str, schema_error: bool = False):
+        super().__init__(message)
+        # `True` if the query does not fit the schema, so it would fail on every call
+        self.schema_error = schema_error
+
+
+def is_schema_error(error: Dict[str, Any]) -> bool:
+    """Return `True` if an entry of the `errors` of a GraphQL response is a validation error of the query."""
+    if error.get("extensions", {}).get("code") in SCHEMA_ERROR_CODES:
+        return True
+    message = error.get("message", "")
+    return any(schema_error_message in message for schema_error_message in SCHEMA_ERROR_MESSAGES)
+
+
+def parse_global_id(global_id: str) -> int:
+    """Return the numeric id of a GraphQL global id, e.g. `42` for `gid://gitlab/Project/42`."""
+    return int(global_id.rsplit("/", 1)[-1])
+
+
+class GraphQLGitlab(Gitlab):
+    """GitLab wrapper which lists group projects together with their maintainers with the GraphQL API.
+
+    One query returns a page of projects including the shared runners setting and all project members, so the
+    membership checks of the listed projects need no further requests. The member relations of the query match the
+    REST listing `members/all`, and the projects shared with a group are added with the REST API, so both APIs return
+    the same projects and members. The members of shared projects and of projects with more members than fit into one
+    query are listed with the REST API on demand. All changes are still sent to the REST API. If the
+    GraphQL API is not available (e.g. on old GitLab versions), all listings fall back to the REST API. Other failed
+    queries (e.g. a temporary server error) only fall back to the REST API for the failed listing, unless
+    `MAX_FAILED_QUERIES_IN_A_ROW` queries failed in a row. In this case, GraphQL is not used until the next run.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._graphql_url = self._gitlab.url + GRAPHQL_PATH
+        self._graphql_available = True
+        self._graphql_suspended = False
+        self._failed_queries_in_a_row = 0
+        self._failed_queries_lock = threading.Lock()
+
+    def start_run(self) -> None:
+        super().start_run()
+        # Failed queries can be temporary, but a GitLab version without GraphQL support stays the same
+        with self._failed_queries_lock:
+            self._graphql_suspended = False
+            self._failed_queries_in_a_row = 0
+
+    @property
+    def _use_graphql(self) -> bool:
+        return self._graphql_available and not self._graphql_suspended
+
+    def _query(self, query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        result = cast(
+            Dict[str, Any],
+            self._gitlab.http_post(self._graphql_url, post_data={"query": query, "variables": variables}),
+        )
+        if result.get("errors"):
+            raise GraphQLError(
+                "; ".join(error.get("message", str(error)) for error in result["errors"]),
+                schema_error=any(is_schema_error(error) for error in result["errors"]),
+            )
+        return cast(Dict[str, Any], result["data"])
+
+    def _list_group_projects(self, group: GitlabGroup, include_subgroups: bool = False) -> List[ProjectRecord]:
+        if self._use_graphql:
+            try:
+                projects = self._query_group_projects(group, include_subgroups)
+                self._handle_query_success()
+                return projects
+            except (GraphQLError, GitlabHttpError) as e:
+                self._handle_query_error(e)
+        return super()._list_group_projects(group, include_subgroups)
+
+    def _iter_group_project_pages(self, group: GitlabGroup, include_subgroups: bool) -> Iterator[List[ProjectRecord]]:
+        if self._use_graphql:
+            page_yielded = False
+            try:
+                shared_projects = self._list_shared_projects(group)
+                shared_project_ids = {project.id for project in shared_projects}
+                for projects, project_members_by_id in self._iter_query_group_project_pages(group, include_subgroups):
+                    self._store_project_members(project_members_by_id)
+                    if not page_yielded:
+                        self._handle_query_success()
+                    page_yielded = True
+                    yield [project for project in projects if project.id not in shared_project_ids]
+                yield from _split_into_pages(shared_projects)
+                return
+            except (GraphQLError, GitlabHttpError) as e:
+                # The REST API lists the projects of already yielded pages again, but their runners are planned only
+                # once per run (see `plan_runner_activation`), so applying them again changes nothing
+                self._handle_query_error(e)
+        yield from super()._iter_group_project_pages(group, include_subgroups)
+
+    def _handle_query_success(self) -> None:
+        with self._failed_queries_lock:
+            self._failed_queries_in_a_row = 0
+
+    def _handle_query_error(self, error: Union[GraphQLError, GitlabHttpError]) -> None:
+        # Unknown fields and a missing endpoint both mean that the GitLab version is too old, other errors can be
+        # temporary, so GraphQL is still used for the next listing unless too many queries failed in a row
+        if (isinstance(error, GraphQLError) and error.schema_error) or (
+            isinstance(error, GitlabHttpError) and error.response_code == 404
+        ):
+            logger.warning("The GraphQL API cannot be used (%s), falling back to the REST API", error)
+            self._graphql_available = False
+            return
+        with self._failed_queries_lock:
+            self._failed_queries_in_a_row += 1
+            suspend = self._failed_queries_in_a_row >= MAX_FAILED_QUERIES_IN_A_ROW and not self._graphql_suspended
+            if suspend:
+                self._graphql_suspended = True
+        if suspend:
+            logger.warning(
+                "%d GraphQL queries failed in a row (last error: %s), using the REST API for the rest of the run",
+                MAX_FAILED_QUERIES_IN_A_ROW,
+                error,
+            )
+        else:
+            logger.warning("The GraphQL query failed (%s), listing the group projects with the REST API", error)
+
+    def _query_group_projects(self, group: GitlabGroup, include_subgroups: bool) -> List[ProjectRecord]:
+        projects = []
+        project_members_by_id: Dict[int, List[MemberRecord]] = {}
+        for page_projects, page_project_members_by_id in self._iter_query_group_project_pages(group, include_subgroups):
+            projects.extend(page_projects)
+            project_members_by_id.update(page_project_members_by_id)
+        project_ids = {project.id for project in projects}
+        projects.extend(project for project in self._list_shared_projects(group) if project.id not in project_ids)
+        # Only store the members after all pages were read, so a failed query does not leave partial results behind
+        self._store_project_members(project_members_by_id)
+        return projects
+
+    def _list_shared_projects(self, group: GitlabGroup) -> List[ProjectRecord]:
+        """List the projects which are shared with `group` (but not the ones shared with its subgroups, like REST)."""
+        project_dicts = self._gitlab.http_list(SHARED_PROJECTS_PATH.format(group.id), all=True)
+        return [self._project_from_listing(project_dict) for project_dict in project_dicts]
+
+    def _store_project_members(self, project_members_by_id: Dict[int, List[MemberRecord]]) -> None:
+        for project_id, project_members in project_members_by_id.items():
+            self._lookup_cache[("project_members", project_id, MAINTAINER_ACCESS)] = project_members
+
+    def _iter_query_group_project_pages(
+        self, group: GitlabGroup, include_subgroups: bool
+    ) -> Iterator[Tuple[List[ProjectRecord], Dict[int, List[MemberRecord]]]]:
+        """Yield the projects of every page of the group projects query with the maintainers of these projects."""
+        cursor: Optional[str] = None
+        while True:
+            data = self._query(
+                GROUP_PROJECTS_QUERY,
+                {
+                    "fullPath": group.full_path,
+                    "includeSubgroups": include_subgroups,
+                    "projectsPerPage": PROJECTS_PER_PAGE,
+                    "membersPerProject": MEMBERS_PER_PROJECT,
+                    "after": cursor,
+                },
+            )
+            if data["group"] is None:
+                # Like the REST API, GraphQL does not distinguish between missing groups and groups without access
+                raise NoMatchingGroupError('The group "{}" is not accessible.'.format(group.full_path))
+            project_connection = data["group"]["projects"]
+            projects = []
+            project_members_by_id: Dict[int, List[MemberRecord]] = {}
+            for project_node in project_connection["nodes"]:
+                project = self._project_from_node(project_node)
+                projects.append(project)
+                member_connection = project_node["projectMembers"]
+                if member_connection["pageInfo"]["hasNextPage"]:
+                    logger.debug(
+                        'The project "%s" has too many members for one query, they are listed on demand',
+                        project.path_with_namespace,
+                    )
+                    continue
+                project_members_by_id[project.id] = _members_from_nodes(member_connection["nodes"])
+            yield projects, project_members_by_id
+            if not project_connection["pageInfo"]["hasNextPage"]:
+                break
+            cursor = project_connection["pageInfo"]["endCursor"]
+
+    def _project_from_node(self, project_node: Dict[str, Any]) -> ProjectRecord:
+        return ProjectRecord(
+            parse_global_id(project_node["id"]),
+            project_node["fullPath"],
+            project_node["namespace"]["fullPath"],
+            project_node["sharedRunnersEnabled"],
+        )
+
+
+def _members_from_nodes(member_nodes: List[Dict[str, Any]]) -> List[MemberRecord]:
+    """Return the maintainers of a project from its member nodes, with the highest access level of every user.
+
+    Users who are members through several relations are listed once per membership, while `members/all` lists every
+    user once with the highest access level.
+    """
+    members_by_id: Dict[int, MemberRecord] = {}
+    for member_node in member_nodes:
+        # Members of invited groups can be listed without their user if it is not visible
+        if member_node["user"] is None or member_node["accessLevel"]["integerValue"] < MAINTAINER_ACCESS:
+            continue
+        member = MemberRecord(
+            parse_global_id(member_node["user"]["id"]),
+            member_node["user"]["username"],
+            member_node["accessLevel"]["integerValue"],
+        )
+        if member.id not in members_by_id or members_by_id[member.id].access_level < member.access_level:
+            members_by_id[member.id] = member
+    return list(members_by_id.values())
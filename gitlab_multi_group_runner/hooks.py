@@ -0,0 +1,124 @@
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from .gitlab import Gitlab, NoMatchingUserError
+from .log_buffer import get_logger
+
+logger = get_logger(__name__)
+
+PROJECT_EVENTS = ("project_create", "project_rename", "project_transfer", "user_add_to_team", "user_update_for_team")
+GROUP_MEMBER_EVENTS = ("user_add_to_group", "user_update_for_group")
+
+
+def get_affected_project_and_group_ids(gitlab: Gitlab, payload: Dict[str, Any]) -> Tuple[Set[int], Set[int]]:
+    """Return the ids of all projects and groups whose runner configuration may be changed by the given event.
+
+    The projects of the returned groups (including subgroups) are affected as well. They are listed per group instead
+    of being fetched one by one.
+    """
+    event_name = payload.get("event_name")
+    if event_name in PROJECT_EVENTS:
+        return {int(payload["project_id"])}, set()
+    if event_name in GROUP_MEMBER_EVENTS:
+        # The new group member may be a member of an allowed group, so all projects and groups of the user can be
+        # affected (including the group of the event)
+        try:
+            user = gitlab.get_user(int(payload["user_id"]))
+        except NoMatchingUserError:
+            return set(), set()
+        project_ids, group_ids = gitlab.get_membership_source_ids(user.id)
+        return set(project_ids), set(group_ids) | {int(payload["group_id"])}
+    return set(), set()
+
+
+class SystemHookListener:
+    """HTTP server which receives GitLab system hook events and reconfigures the affected projects.
+
+    Events are acknowledged immediately (GitLab expects a fast response) and processed one after another in a worker
+    thread. Affected projects of events which arrive during a reconfiguration are merged into one following run. One
+    `Gitlab` object is created on the first event and reused for all following runs.
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        create_gitlab: Callable[[], Gitlab],
+        reconfigure_projects: Callable[[Gitlab, Set[int], Set[int]], None],
+        secret_token: Optional[str] = None,
+    ):
+        self._create_gitlab = create_gitlab
+        self._gitlab: Optional[Gitlab] = None
+        self._reconfigure_projects = reconfigure_projects
+        self._secret_token = secret_token
+        self._events: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._http_server = HTTPServer(address, self._create_request_handler_class())
+
+    @property
+    def server_address(self) -> Tuple[str, int]:
+        host, port = self._http_server.server_address[:2]
+        return str(host), int(port)
+
+    def _create_request_handler_class(self) -> type:
+        listener = self
+
+        class SystemHookRequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                if listener._secret_token is not None and self.headers.get("X-Gitlab-Token") != listener._secret_token:
+                    self.send_error(403, "Invalid token")
+                    return
+                try:
+                    content_length = int(self.headers.get("Content-Length", 0))
+                    payload = json.loads(self.rfile.read(content_length))
+                    if not isinstance(payload, dict):
+                        raise ValueError("The payload is not a JSON object")
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+                listener._events.put(payload)
+                self.send_response(202)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug("%s - %s", self.address_string(), format % args)
+
+        return SystemHookRequestHandler
+
+    def _process_events(self) -> None:
+        while True:
+            events = [self._events.get()]
+            while not self._events.empty():
+                events.append(self._events.get())
+            try:
+                if self._gitlab is None:
+                    self._gitlab = self._create_gitlab()
+                else:
+                    self._gitlab.start_run()
+                affected_project_ids: Set[int] = set()
+                affected_group_ids: Set[int] = set()
+                for event in events:
+                    event_project_ids, event_group_ids = get_affected_project_and_group_ids(self._gitlab, event)
+                    logger.debug(
+                        'Event "%s" affects the projects %s and the groups %s',
+                        event.get("event_name"),
+                        sorted(event_project_ids),
+                        sorted(event_group_ids),
+                    )
+                    affected_project_ids.update(event_project_ids)
+                    affected_group_ids.update(event_group_ids)
+                if affected_project_ids or affected_group_ids:
+                    self._reconfigure_projects(self._gitlab, affected_project_ids, affected_group_ids)
+            except Exception:
+                # Keep listening, the next scheduled or triggered run can fix missed projects
+                logger.exception("Could not process %d system hook event(s)", len(events))
+
+    def serve_forever(self) -> None:
+        threading.Thread(target=self._process_events, name="system-hook-events", daemon=True).start()
+        logger.info("Listening for GitLab system hook events on `%s:%d`", *self.server_address)
+        try:
+            self._http_server.serve_forever()
+        finally:
+            self._http_server.server_close()
@@ -0,0 +1,55 @@
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List
+
+PACKAGE_LOGGER_NAME = __name__.rsplit(".", 1)[0]
+
+
+class LogRecordBuffer(logging.Filter):
+    """Filter which holds back the log records of threads which set a buffer, so they can be logged in order later."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._thread_state = threading.local()
+
+    @contextmanager
+    def buffering(self) -> Iterator[List[logging.LogRecord]]:
+        """Collect all log records of the current thread in the yielded list instead of logging them."""
+        previous_records = getattr(self._thread_state, "records", None)
+        records: List[logging.LogRecord] = []
+        self._thread_state.records = records
+        try:
+            yield records
+        finally:
+            self._thread_state.records = previous_records
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        records = getattr(self._thread_state, "records", None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
+log_record_buffer = LogRecordBuffer()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Return the logger `name` with `log_record_buffer` installed.
+
+    Logger filters only see the records which are logged to the logger itself and not the ones which are propagated
+    from child loggers, so every logger of this package installs the buffer instead of only the package logger.
+    """
+    logger = logging.getLogger(name)
+    logger.addFilter(log_record_buffer)
+    return logger
+
+
+get_logger(PACKAGE_LOGGER_NAME)
+
+
+def handle_buffered_records(records: List[logging.LogRecord]) -> None:
+    """Log `records` which were collected by `LogRecordBuffer.buffering` with the loggers which created them."""
+    for record in records:
+        logging.getLogger(record.name).handle(record)
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .profiling import Profiler
+from .shard import Shard
+
+METRIC_PREFIX = "gitlab_multi_group_runner_"
+
+# Counts of the profiler which are exported, with their metric name and help text
+COUNT_METRICS = (
+    ("scanned_projects", "projects_scanned", "Number of projects which were checked in the last run."),
+    ("runner_assignments", "runner_assignments", "Number of configured runner and project combinations."),
+    ("runner_activations", "runners_assigned", "Number of runners which were enabled in projects in the last run."),
+    (
+        "shared_runner_deactivations",
+        "shared_runner_deactivations",
+        "Number of projects in which shared runners were disabled in the last run.",
+    ),
+    ("failed_changes", "errors", "Number of runner changes which failed in the last run."),
+)
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_openmetrics(profiler: Profiler, exit_code: Optional[int], shard: Optional[Shard] = None) -> str:
+    """Format the statistics of a run as OpenMetrics text which can be read by the node exporter textfile collector.
+
+    The statistics of a sharded run only cover the projects of its shard, which is exported as `shard` metric. All
+    samples of a sharded run are labeled with the shard (e.g. `shard="1/3"`), so the textfiles of several shards on one
+    host do not create duplicate series.
+    """
+    profile = profiler.to_dict()
+    metrics: List[Tuple[str, str, List[Tuple[Dict[str, str], Any]]]] = []
+    for count_name, metric_name, help_text in COUNT_METRICS:
+        metrics.append((metric_name, help_text, [({}, profile["counts"].get(count_name, 0))]))
+    metrics.append(
+        (
+            "api_requests",
+            "Number of GitLab API requests in the last run by endpoint.",
+            [({"endpoint": endpoint}, e["requests"]) for endpoint, e in profile["endpoints"].items()],
+        )
+    )
+    metrics.append(
+        (
+            "api_request_duration_seconds",
+            "Total duration of GitLab API requests in the last run by endpoint.",
+            [({"endpoint": endpoint}, e["total_seconds"]) for endpoint, e in profile["endpoints"].items()],
+        )
+    )
+    metrics.append(
+        (
+            "phase_duration_seconds",
+            "Wall time of the phases of the last run.",
+            [({"phase": phase}, phase_time) for phase, phase_time in profile["phases"].items()],
+        )
+    )
+    metrics.append(("run_duration_seconds", "Wall time of the last run.", [({}, profile["total_seconds"])]))
+    if exit_code is not None:
+        metrics.append(("exit_code", "Exit code of the last run.", [({}, exit_code)]))
+    if shard is not None:
+        metrics.append(
+            (
+                "shard",
+                "Shard of the projects which were configured in the last run.",
+                [({"index": str(shard.index), "count": str(shard.count)}, 1)],
+            )
+        )
+    metrics.append(("last_run_timestamp_seconds", "Time of the end of the last run.", [({}, time.time())]))
+    shard_labels = {"shard": str(shard)} if shard is not None else {}
+    lines = []
+    for metric_name, help_text, samples in metrics:
+        lines.append("# HELP {}{} {}".format(METRIC_PREFIX, metric_name, help_text))
+        lines.append("# TYPE {}{} gauge".format(METRIC_PREFIX, metric_name))
+        for labels, value in samples:
+            labels = dict(shard_labels, **labels)
+            label_text = ",".join('{}="{}"'.format(key, _escape_label_value(value)) for key, value in labels.items())
+            lines.append(
+                "{}{}{} {}".format(METRIC_PREFIX, metric_name, "{" + label_text + "}" if label_text else "", value)
+            )
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_openmetrics_textfile(
+    filepath: str, profiler: Profiler, exit_code: Optional[int], shard: Optional[Shard] = None
+) -> None:
+    # The textfile collector may read the file at any time, so it must be replaced atomically
+    dirpath = os.path.dirname(os.path.abspath(filepath))
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=dirpath, delete=False) as metrics_file:
+        metrics_file.write(format_openmetrics(profiler, exit_code, shard))
+    os.chmod(metrics_file.name, 0o644)
+    os.replace(metrics_file.name, filepath)
@@ -0,0 +1,161 @@
+import re
+from fnmatch import fnmatchcase
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern
+
+from .records import ProjectRecord
+
+REGEX_PATTERN_PREFIX = "re:"
+GLOB_CHARACTERS = frozenset("*?[")
+# Characters which stand for themselves in a regular expression and in GitLab paths
+_LITERAL_REGEX_CHARACTERS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_/")
+_QUANTIFIER_CHARACTERS = frozenset("?*{")
+
+
+def is_path_pattern(group_or_project: str) -> bool:
+    """Return `True` if an entry of `groups_and_projects` is a pattern instead of a literal group or project path."""
+    return group_or_project.startswith(REGEX_PATTERN_PREFIX) or any(c in GLOB_CHARACTERS for c in group_or_project)
+
+
+def _get_regex_prefix(regex: str) -> str:
+    """Return a literal string which every match of the regular expression `regex` starts with (e.g. `lab-` for
+    `^lab-\\d+/`). The prefix is empty if the expression is not anchored or too complex to find one."""
+    if not regex.startswith("^") or "|" in regex:
+        return ""
+    prefix = []
+    i = 1
+    while i < len(regex):
+        c = regex[i]
+        if c == "\\" and i + 1 < len(regex) and not regex[i + 1].isalnum():
+            # Escaped special characters like `\.` are literals, escape sequences like `\d` are not
+            c = regex[i + 1]
+            i += 1
+        elif c not in _LITERAL_REGEX_CHARACTERS:
+            break
+        if i + 1 < len(regex) and regex[i + 1] in _QUANTIFIER_CHARACTERS:
+            # The character is optional or repeated, so it cannot be part of the prefix
+            break
+        prefix.append(c)
+        i += 1
+    return "".join(prefix)
+
+
+class PathPattern:
+    """A pattern for project paths in `groups_and_projects`.
+
+    Patterns with the prefix `re:` are regular expressions which are searched in the full project path (e.g.
+    `re:^lab-\\d+/`). Other patterns are globs in which `*`, `?` and `[...]` match within one path segment and `**`
+    matches any number of segments (e.g. `physics/*-sim` or `physics/**`).
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self._regex: Optional[Pattern[str]] = None
+        self._prefix = ""
+        self._segments: List[str] = []
+        if pattern.startswith(REGEX_PATTERN_PREFIX):
+            # Raises `re.error` for invalid expressions
+            self._regex = re.compile(pattern[len(REGEX_PATTERN_PREFIX) :])
+            self._prefix = _get_regex_prefix(self._regex.pattern)
+        else:
+            self._segments = pattern.strip("/").split("/")
+
+    def matches(self, path: str) -> bool:
+        if self._regex is not None:
+            return self._regex.search(path) is not None
+        return self._match_segments(path.split("/"), 0, 0)
+
+    def _match_segments(self, path_segments: List[str], i: int, j: int) -> bool:
+        if i == len(self._segments):
+            return j == len(path_segments)
+        if self._segments[i] == "**":
+            return any(self._match_segments(path_segments, i + 1, k) for k in range(j, len(path_segments) + 1))
+        return (
+            j < len(path_segments)
+            and fnmatchcase(path_segments[j], self._segments[i])
+            and self._match_segments(path_segments, i + 1, j + 1)
+        )
+
+    def __str__(self) -> str:
+        return self.pattern
+
+
+class _ProjectTrieNode:
+    __slots__ = ("children", "project")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_ProjectTrieNode"] = {}
+        self.project: Optional[ProjectRecord] = None
+
+    def iter_projects(self) -> Iterator[ProjectRecord]:
+        if self.project is not None:
+            yield self.project
+        for child in self.children.values():
+            yield from child.iter_projects()
+
+
+class ProjectPathIndex:
+    """Trie of all project paths by path segment, which matches `PathPattern`s without API requests.
+
+    Globs only descend into the children which match the current segment, so literal segments are dictionary lookups.
+    Regular expressions descend to their literal prefix and only test the paths below it.
+    """
+
+    def __init__(self, projects: Iterable[ProjectRecord]):
+        self._root = _ProjectTrieNode()
+        self._project_count = 0
+        for project in projects:
+            node = self._root
+            for segment in project.path_with_namespace.split("/"):
+                node = node.children.setdefault(segment, _ProjectTrieNode())
+            node.project = project
+            self._project_count += 1
+
+    def __len__(self) -> int:
+        return self._project_count
+
+    def match(self, pattern: PathPattern) -> List[ProjectRecord]:
+        """Return all projects whose path matches `pattern`, ordered by path."""
+        if pattern._regex is not None:
+            projects = [
+                project
+                for project in self._iter_prefix_projects(pattern._prefix)
+                if pattern.matches(project.path_with_namespace)
+            ]
+        else:
+            projects_by_id: Dict[int, ProjectRecord] = {}
+            for project in self._iter_glob_projects(self._root, pattern._segments, 0):
+                projects_by_id[project.id] = project
+            projects = list(projects_by_id.values())
+        return sorted(projects, key=lambda project: project.path_with_namespace)
+
+    def _iter_prefix_projects(self, prefix: str) -> Iterator[ProjectRecord]:
+        *complete_segments, partial_segment = prefix.split("/")
+        node = self._root
+        for segment in complete_segments:
+            child = node.children.get(segment)
+            if child is None:
+                return
+            node = child
+        for name, child in node.children.items():
+            if name.startswith(partial_segment):
+                yield from child.iter_projects()
+
+    def _iter_glob_projects(self, node: _ProjectTrieNode, segments: List[str], i: int) -> Iterator[ProjectRecord]:
+        if i == len(segments):
+            if node.project is not None:
+                yield node.project
+            return
+        segment = segments[i]
+        if segment == "**":
+            # Match zero segments or consume one segment and try again
+            yield from self._iter_glob_projects(node, segments, i + 1)
+            for child in node.children.values():
+                yield from self._iter_glob_projects(child, segments, i)
+        elif any(c in GLOB_CHARACTERS for c in segment):
+            for name, child in node.children.items():
+                if fnmatchcase(name, segment):
+                    yield from self._iter_glob_projects(child, segments, i + 1)
+        else:
+            literal_child = node.children.get(segment)
+            if literal_child is not None:
+                yield from self._iter_glob_projects(literal_child, segments, i + 1)
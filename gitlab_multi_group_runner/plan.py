@@ -0,0 +1,116 @@
+from typing import AbstractSet, Dict, Iterable, Iterator, List, Mapping, Tuple
+
+from .records import ProjectRecord, RunnerRecord
+
+
+class RunnerActivationPlan:
+    """Desired runner assignments of a run and the changes which are needed to reach them.
+
+    Runners and projects are collected with `add`. `compute_changes` compares the desired state with the runners which
+    are currently enabled in the projects and stores the minimal set of changes.
+    """
+
+    def __init__(self) -> None:
+        self._runners: Dict[int, RunnerRecord] = {}
+        self._projects: Dict[int, ProjectRecord] = {}
+        # Dicts are used as ordered sets to keep the log output in configuration order
+        self._project_ids_by_runner_id: Dict[int, Dict[int, None]] = {}
+        self._shared_runner_project_ids: Dict[int, None] = {}
+        self._runner_activations: Dict[Tuple[int, int], None] = {}
+        self._shared_runner_deactivations: Dict[int, None] = {}
+        self._scanned_project_ids: Dict[int, None] = {}
+
+    def add(self, runner: RunnerRecord, projects: Iterable[ProjectRecord], disable_shared_runners: bool) -> None:
+        self._runners[runner.id] = runner
+        project_ids = self._project_ids_by_runner_id.setdefault(runner.id, {})
+        for project in projects:
+            self._projects.setdefault(project.id, project)
+            project_ids[project.id] = None
+            if disable_shared_runners:
+                self._shared_runner_project_ids[project.id] = None
+
+    def add_scanned_projects(self, projects: Iterable[ProjectRecord]) -> None:
+        """Remember projects which were checked (including not allowed projects) for statistics."""
+        for project in projects:
+            self._scanned_project_ids[project.id] = None
+
+    def discard_shared_runner_checks(self, project_ids: AbstractSet[int]) -> None:
+        # Only the projects of this plan are checked, so the cost does not grow with `project_ids`
+        for project_id in [p for p in self._shared_runner_project_ids if p in project_ids]:
+            del self._shared_runner_project_ids[project_id]
+
+    def compute_changes(self, enabled_runner_ids_by_project_id: Mapping[int, AbstractSet[int]]) -> None:
+        self._runner_activations = {
+            (runner_id, project_id): None
+            for runner_id, project_id in self.iter_desired_runner_assignments()
+            if runner_id not in enabled_runner_ids_by_project_id.get(project_id, ())
+        }
+        self._shared_runner_deactivations = {
+            project_id: None
+            for project_id in self._shared_runner_project_ids
+            if self._projects[project_id].shared_runners_enabled
+        }
+
+    def iter_desired_runner_assignments(self) -> Iterator[Tuple[int, int]]:
+        return (
+            (runner_id, project_id)
+            for runner_id, project_ids in self._project_ids_by_runner_id.items()
+            for project_id in project_ids
+        )
+
+    def iter_changes_by_project(self) -> Iterator[Tuple[int, bool, List[int]]]:
+        """Iterate over all changed projects with the flag to disable shared runners and the runner ids to enable."""
+        runner_ids_by_project_id: Dict[int, List[int]] = {}
+        for project_id in self._shared_runner_deactivations:
+            runner_ids_by_project_id[project_id] = []
+        for runner_id, project_id in self._runner_activations:
+            runner_ids_by_project_id.setdefault(project_id, []).append(runner_id)
+        return (
+            (project_id, project_id in self._shared_runner_deactivations, runner_ids)
+            for project_id, runner_ids in runner_ids_by_project_id.items()
+        )
+
+    def get_runner(self, runner_id: int) -> RunnerRecord:
+        return self._runners[runner_id]
+
+    def get_project(self, project_id: int) -> ProjectRecord:
+        return self._projects[project_id]
+
+    @property
+    def runners(self) -> List[RunnerRecord]:
+        return list(self._runners.values())
+
+    @property
+    def projects(self) -> List[ProjectRecord]:
+        return list(self._projects.values())
+
+    @property
+    def scanned_project_count(self) -> int:
+        return len(self._scanned_project_ids)
+
+    @property
+    def shared_runner_project_ids(self) -> List[int]:
+        return list(self._shared_runner_project_ids)
+
+    @property
+    def runner_activations(self) -> List[Tuple[int, int]]:
+        return list(self._runner_activations)
+
+    @property
+    def shared_runner_deactivations(self) -> List[int]:
+        return list(self._shared_runner_deactivations)
+
+    def needs_runner_activation(self, runner_id: int, project_id: int) -> bool:
+        return (runner_id, project_id) in self._runner_activations
+
+    def needs_shared_runner_check(self, project_id: int) -> bool:
+        return project_id in self._shared_runner_project_ids
+
+    def needs_shared_runner_deactivation(self, project_id: int) -> bool:
+        return project_id in self._shared_runner_deactivations
+
+    def __len__(self) -> int:
+        return len(self._runner_activations) + len(self._shared_runner_deactivations)
+
+    def __bool__(self) -> bool:
+        return bool(self._runner_activations or self._shared_runner_deactivations)
@@ -0,0 +1,145 @@
+import json
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, TextIO, Tuple
+from urllib.parse import urlsplit
+
+from requests import Response
+
+from .cache import is_cached_response
+
+# Path segments which are followed by an id or a path (e.g. `/projects/42` or `/projects/mygroup%2Fmyproject`)
+_ID_PARENT_SEGMENTS = ("blobs", "files", "groups", "namespaces", "projects", "runners", "users")
+_ID_SEGMENT_REGEX = re.compile(r"^(\d+|.*%.*)$")
+
+
+def get_endpoint(method: str, url: str, api_path: str = "") -> str:
+    """Return the endpoint type of a request, e.g. `GET /projects/:id/runners` for `GET /api/v4/projects/42/runners`."""
+    path = urlsplit(url).path
+    if api_path and path.startswith(api_path):
+        path = path[len(api_path) :]
+    segments = path.strip("/").split("/")
+    normalized_segments = []
+    for i, segment in enumerate(segments):
+        if _ID_SEGMENT_REGEX.match(segment) or (i > 0 and segments[i - 1] in _ID_PARENT_SEGMENTS):
+            normalized_segments.append(":id")
+        else:
+            normalized_segments.append(segment)
+    return "{} /{}".format(method, "/".join(normalized_segments))
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Return the `fraction` percentile of `sorted_values` (nearest rank method)."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(math.ceil(fraction * len(sorted_values)) - 1, 0)]
+
+
+class Profiler:
+    """Collects the latency and size of all API requests by endpoint type and the wall time of the phases of a run.
+
+    Responses which were answered with `304 Not Modified` and replayed from the response cache (see `cache_dir`) are
+    counted separately and add no bytes, since their body was not transferred. Additionally, named counts (e.g. the
+    number of scanned projects) can be added up.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self._latencies_by_endpoint: Dict[str, List[float]] = {}
+        self._bytes_by_endpoint: Dict[str, int] = {}
+        self._not_modified_by_endpoint: Dict[str, int] = {}
+        self._phase_times: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+
+    def record_response(self, response: Response, api_path: str = "") -> None:
+        endpoint = get_endpoint(str(response.request.method), str(response.url), api_path)
+        not_modified = is_cached_response(response)
+        response_bytes = len(response.content) if response.content is not None and not not_modified else 0
+        with self._lock:
+            self._latencies_by_endpoint.setdefault(endpoint, []).append(response.elapsed.total_seconds())
+            self._bytes_by_endpoint[endpoint] = self._bytes_by_endpoint.get(endpoint, 0) + response_bytes
+            if not_modified:
+                self._not_modified_by_endpoint[endpoint] = self._not_modified_by_endpoint.get(endpoint, 0) + 1
+
+    def add_count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + value
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Measure the wall time of a phase. Phases with the same name (e.g. of multiple config repositories) add up."""
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._phase_times[name] = self._phase_times.get(name, 0.0) + time.monotonic() - start_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            endpoints = {}
+            for endpoint, latencies in sorted(self._latencies_by_endpoint.items()):
+                sorted_latencies = sorted(latencies)
+                endpoints[endpoint] = {
+                    "requests": len(latencies),
+                    "total_seconds": sum(latencies),
+                    "p50_seconds": percentile(sorted_latencies, 0.5),
+                    "p95_seconds": percentile(sorted_latencies, 0.95),
+                    "bytes": self._bytes_by_endpoint[endpoint],
+                    "not_modified": self._not_modified_by_endpoint.get(endpoint, 0),
+                }
+            return {
+                "endpoints": endpoints,
+                "phases": {name: phase_time for name, phase_time in self._phase_times.items()},
+                "counts": dict(self._counts),
+                "total_seconds": time.monotonic() - self._start_time,
+            }
+
+    def write_report(self, report_file: TextIO) -> None:
+        profile = self.to_dict()
+        endpoint_rows: List[Tuple[str, ...]] = [("Endpoint", "Requests", "Total", "p50", "p95", "Bytes", "304")]
+        for endpoint, endpoint_profile in profile["endpoints"].items():
+            endpoint_rows.append(
+                (
+                    endpoint,
+                    str(endpoint_profile["requests"]),
+                    "{:.3f} s".format(endpoint_profile["total_seconds"]),
+                    "{:.1f} ms".format(endpoint_profile["p50_seconds"] * 1000),
+                    "{:.1f} ms".format(endpoint_profile["p95_seconds"] * 1000),
+                    str(endpoint_profile["bytes"]),
+                    str(endpoint_profile["not_modified"]),
+                )
+            )
+        endpoint_rows.append(
+            (
+                "All endpoints",
+                str(sum(e["requests"] for e in profile["endpoints"].values())),
+                "{:.3f} s".format(sum(e["total_seconds"] for e in profile["endpoints"].values())),
+                "",
+                "",
+                str(sum(e["bytes"] for e in profile["endpoints"].values())),
+                str(sum(e["not_modified"] for e in profile["endpoints"].values())),
+            )
+        )
+        phase_rows: List[Tuple[str, ...]] = [("Phase", "Wall time")]
+        for name, phase_time in profile["phases"].items():
+            phase_rows.append((name, "{:.3f} s".format(phase_time)))
+        phase_rows.append(("Total", "{:.3f} s".format(profile["total_seconds"])))
+        for rows in (endpoint_rows, phase_rows):
+            column_widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+            for i, row in enumerate(rows):
+                cells = [row[0].ljust(column_widths[0])]
+                cells.extend(cell.rjust(width) for cell, width in zip(row[1:], column_widths[1:]))
+                report_file.write("  ".join(cells).rstrip() + "\n")
+                if i == 0:
+                    report_file.write("  ".join("-" * width for width in column_widths) + "\n")
+            report_file.write("\n")
+        report_file.flush()
+
+    def write_json(self, json_filepath: str) -> None:
+        with open(json_filepath, "w", encoding="utf-8") as json_file:
+            json.dump(self.to_dict(), json_file, indent=2)
@@ -0,0 +1,174 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Optional
+
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter
+
+from .log_buffer import get_logger
+
+logger = get_logger(__name__)
+
+# Methods which can be sent again if the server failed to answer them (POST could enable a runner twice)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+DEFAULT_RETRY_LIMIT = 5
+# Upper bound of the exponential backoff between two retries in seconds
+MAX_BACKOFF = 60.0
+# Number of requests which are kept in reserve, so requests which are already sent do not exceed the rate limit
+RATE_LIMIT_RESERVE = 2
+# Waits below this many seconds are skipped: after a computed sleep, rounding errors of large clock values can leave
+# the token count just below one
+MIN_WAIT_TIME = 1e-6
+
+
+def parse_retry_after(retry_after: Optional[str]) -> Optional[float]:
+    """Return the number of seconds of a `Retry-After` header (given as seconds or as HTTP date)."""
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Token bucket which spaces API requests to stay just below the rate limit of the GitLab instance.
+
+    Without a configured maximum rate, requests are not limited until GitLab reports its rate limit. The `RateLimit-*`
+    response headers adapt the refill rate, so the remaining requests of the current window are spread over the time
+    until the window resets. The derived rate is kept until the next response with rate limit headers, so requests
+    are not sent in a burst when a new window starts. A `Retry-After` response pauses all requests.
+    """
+
+    def __init__(self, max_requests_per_second: Optional[float] = None, burst: int = 1):
+        self._max_rate = max_requests_per_second
+        self._rate = max_requests_per_second
+        self._capacity = float(max(burst, 1))
+        self._tokens = self._capacity
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._request_count = 0
+        self._retry_count = 0
+        self._throttle_time = 0.0
+
+    @property
+    def request_count(self) -> int:
+        return self._request_count
+
+    @property
+    def retry_count(self) -> int:
+        return self._retry_count
+
+    @property
+    def throttle_time(self) -> float:
+        return self._throttle_time
+
+    def _refill(self, now: float) -> None:
+        if self._rate is not None:
+            self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def acquire(self) -> None:
+        """Block until the next request may be sent."""
+        waited_time = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait_time = self._paused_until - now
+                if wait_time < MIN_WAIT_TIME:
+                    if self._rate is not None:
+                        wait_time = (1 - self._tokens) / self._rate
+                    if wait_time < MIN_WAIT_TIME:
+                        if self._rate is not None:
+                            self._tokens = max(self._tokens - 1, 0.0)
+                        self._request_count += 1
+                        self._throttle_time += waited_time
+                        return
+            time.sleep(wait_time)
+            waited_time += wait_time
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def count_retry(self, wait_time: float = 0.0) -> None:
+        with self._lock:
+            self._retry_count += 1
+            self._throttle_time += wait_time
+
+    def update(self, response: Response) -> None:
+        """Adapt the request rate to the rate limit headers of `response`."""
+        remaining = response.headers.get("RateLimit-Remaining")
+        reset = response.headers.get("RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining_requests = int(remaining) - RATE_LIMIT_RESERVE
+            window = max(float(reset) - time.time(), 1.0)
+        except ValueError:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if remaining_requests <= 0:
+                self._paused_until = max(self._paused_until, now + window)
+                return
+            rate = remaining_requests / window
+            self._rate = min(rate, self._max_rate) if self._max_rate is not None else rate
+
+
+class RateLimitingHTTPAdapter(HTTPAdapter):
+    """Transport adapter which sends all requests through a `RateLimiter` and retries throttled or failed requests.
+
+    Rejected requests (`429 Too Many Requests`) are retried for all methods since GitLab did not process them. Gateway
+    errors are only retried for idempotent methods. Retries wait for `Retry-After` if given, otherwise for an
+    exponential backoff with random jitter.
+    """
+
+    def __init__(self, rate_limiter: RateLimiter, *args: Any, retry_limit: int = DEFAULT_RETRY_LIMIT, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._rate_limiter = rate_limiter
+        self._retry_limit = retry_limit
+
+    def _should_retry(self, request: PreparedRequest, response: Response) -> bool:
+        if response.status_code not in RETRY_STATUS_CODES:
+            return False
+        return response.status_code == 429 or request.method in IDEMPOTENT_METHODS
+
+    def send(self, request: PreparedRequest, *args: Any, **kwargs: Any) -> Response:
+        attempt = 0
+        while True:
+            self._rate_limiter.acquire()
+            response = super().send(request, *args, **kwargs)
+            self._rate_limiter.update(response)
+            if attempt >= self._retry_limit or not self._should_retry(request, response):
+                return response
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            backoff = random.uniform(0, min(MAX_BACKOFF, 2.0 ** attempt))
+            logger.debug(
+                "%s %s failed with status %d, retrying (attempt %d of %d)",
+                request.method,
+                request.url,
+                response.status_code,
+                attempt + 1,
+                self._retry_limit,
+            )
+            response.close()
+            attempt += 1
+            if response.status_code == 429:
+                # The rate limit applies to all concurrent requests, so pause all of them
+                self._rate_limiter.pause(retry_after if retry_after is not None else backoff)
+                self._rate_limiter.count_retry()
+            else:
+                wait_time = retry_after if retry_after is not None else backoff
+                time.sleep(wait_time)
+                self._rate_limiter.count_retry(wait_time)
@@ -0,0 +1,101 @@
+import sys
+from typing import Any, FrozenSet, Mapping, Optional, Tuple
+
+
+class ProjectRecord:
+    """The attributes of a project which are needed to plan and apply runner assignments.
+
+    python-gitlab objects keep the full API representation and create all sub managers of a project, which costs
+    several kilobytes per project. Records only keep a few slots and intern the paths, so the namespace paths of all
+    projects in a group are stored once.
+
+    `shared_with_groups` is `True` if the project itself is shared with other groups, or `None` if this is not known
+    (e.g. for projects listed with the GraphQL API).
+    """
+
+    __slots__ = ("id", "path_with_namespace", "namespace_full_path", "shared_runners_enabled", "shared_with_groups")
+
+    def __init__(
+        self,
+        id: int,
+        path_with_namespace: str,
+        namespace_full_path: str,
+        shared_runners_enabled: bool,
+        shared_with_groups: Optional[bool] = None,
+    ):
+        self.id = id
+        self.path_with_namespace = sys.intern(path_with_namespace)
+        self.namespace_full_path = sys.intern(namespace_full_path)
+        self.shared_runners_enabled = shared_runners_enabled
+        self.shared_with_groups = shared_with_groups
+
+    @classmethod
+    def from_attributes(cls, attributes: Mapping[str, Any]) -> "ProjectRecord":
+        """Create a record from the API representation of a project (e.g. an item of a project listing)."""
+        return cls(
+            attributes["id"],
+            attributes["path_with_namespace"],
+            attributes["namespace"]["full_path"],
+            attributes["shared_runners_enabled"],
+            bool(attributes["shared_with_groups"]) if "shared_with_groups" in attributes else None,
+        )
+
+    def __repr__(self) -> str:
+        return "<ProjectRecord id:{} path_with_namespace:{}>".format(self.id, self.path_with_namespace)
+
+
+class MemberRecord:
+    """A user with its access level in a project."""
+
+    __slots__ = ("id", "username", "access_level")
+
+    def __init__(self, id: int, username: str, access_level: int):
+        self.id = id
+        self.username = sys.intern(username)
+        self.access_level = access_level
+
+    @classmethod
+    def from_attributes(cls, attributes: Mapping[str, Any]) -> "MemberRecord":
+        return cls(attributes["id"], attributes["username"], attributes["access_level"])
+
+    def __repr__(self) -> str:
+        return "<MemberRecord id:{} username:{}>".format(self.id, self.username)
+
+
+class RunnerRecord:
+    """The attributes of a runner which are needed to plan and apply runner assignments.
+
+    `project_ids` contains the ids of all projects the runner is enabled in, or `None` if the runner was not fetched
+    with its details (e.g. from a runner listing).
+    """
+
+    __slots__ = ("id", "description", "runner_type", "tag_list", "project_ids")
+
+    def __init__(
+        self,
+        id: int,
+        description: str,
+        runner_type: str,
+        tag_list: Tuple[str, ...],
+        project_ids: Optional[FrozenSet[int]] = None,
+    ):
+        self.id = id
+        self.description = description
+        self.runner_type = runner_type
+        self.tag_list = tag_list
+        self.project_ids = project_ids
+
+    @classmethod
+    def from_attributes(cls, attributes: Mapping[str, Any]) -> "RunnerRecord":
+        # The runner details list all projects of the runner, only their ids are kept
+        runner_projects = attributes.get("projects")
+        return cls(
+            attributes["id"],
+            attributes.get("description") or "",
+            attributes["runner_type"],
+            tuple(attributes.get("tag_list") or ()),
+            frozenset(project["id"] for project in runner_projects) if runner_projects is not None else None,
+        )
+
+    def __repr__(self) -> str:
+        return "<RunnerRecord id:{} description:{}>".format(self.id, self.description)
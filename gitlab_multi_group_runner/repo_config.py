@@ -0,0 +1,114 @@
+import re
+from typing import Any, Dict, Iterable, Iterator, List, TextIO, Tuple, Union, cast
+
+from .config import ConfigValidationFailedError
+from .utils import dump_config_as_yaml
+
+MULTI_GROUP_RUNNER_CONFIG_FILENAME = "multi-group-runner-config.yml"
+
+MULTI_GROUP_RUNNER_CONFIG_SCHEMA = {
+    "include_subgroups": {"type": "boolean", "default": False},
+    "runners": {
+        "required": True,
+        "type": "list",
+        "schema": {
+            "type": "dict",
+            "schema": {
+                "ids": {"required": True, "type": "list", "schema": {"type": "integer"}},
+                "groups_and_projects": {
+                    "required": True,
+                    "type": "list",
+                    "schema": {
+                        "anyof": [
+                            {"type": "string"},
+                            {
+                                "type": "dict",
+                                "schema": {
+                                    "path": {"required": True, "type": "string"},
+                                    "include_subgroups": {"type": "boolean"},
+                                },
+                            },
+                        ],
+                    },
+                },
+            },
+        },
+    },
+}
+
+MULTI_GROUP_RUNNER_EXAMPLE_CONFIG = {
+    "runners": [
+        {
+            "ids": [5, 9],
+            "groups_and_projects": [
+                "mygroup",
+                "myusername/myproject",
+                {"path": "myothergroup", "include_subgroups": True},
+            ],
+        }
+    ]
+}
+
+
+class MultiGroupRunnerConfig:
+    def __init__(self, config_content: str):
+        def parse_config(config_content: str) -> Dict[str, Any]:
+            import yaml
+            from cerberus import Validator
+
+            validator = Validator(MULTI_GROUP_RUNNER_CONFIG_SCHEMA)
+            if not validator.validate(yaml.safe_load(config_content)):
+                raise ConfigValidationFailedError(None, validator.errors)
+            normalized_config_dict = validator.document
+            validate_path_patterns(normalized_config_dict)
+            return cast(Dict[str, Any], normalized_config_dict)
+
+        def validate_path_patterns(config_dict: Dict[str, Any]) -> None:
+            from .patterns import PathPattern, is_path_pattern
+
+            errors = []
+            for runner_config in config_dict["runners"]:
+                for entry in runner_config["groups_and_projects"]:
+                    path = entry if isinstance(entry, str) else entry["path"]
+                    if is_path_pattern(path):
+                        try:
+                            PathPattern(path)
+                        except re.error as e:
+                            errors.append('"{}" is not a valid regular expression: {}'.format(path, e))
+            if errors:
+                raise ConfigValidationFailedError(None, {"groups_and_projects": errors})
+
+        self._config_dict = parse_config(config_content)
+
+    def __iter__(self) -> Iterator[int]:
+        return (runner_id for runner_config in self._config_dict["runners"] for runner_id in runner_config["ids"])
+
+    def iter_runners_with_groups_and_projects(self) -> Iterator[Tuple[int, Iterable[str]]]:
+        return (
+            (runner_id, [group_or_project for group_or_project, _ in group_and_project_entries])
+            for runner_id, group_and_project_entries in self.iter_runners_with_group_and_project_entries()
+        )
+
+    def iter_runners_with_group_and_project_entries(self) -> Iterator[Tuple[int, List[Tuple[str, bool]]]]:
+        """Iterate over all runner ids with their groups and projects and the `include_subgroups` flag of each entry."""
+        include_subgroups_default = self._config_dict["include_subgroups"]
+        for runner_config in self._config_dict["runners"]:
+            group_and_project_entries = []
+            for entry in runner_config["groups_and_projects"]:
+                if isinstance(entry, str):
+                    group_and_project_entries.append((entry, include_subgroups_default))
+                else:
+                    group_and_project_entries.append(
+                        (entry["path"], entry.get("include_subgroups", include_subgroups_default))
+                    )
+            for runner_id in runner_config["ids"]:
+                yield runner_id, group_and_project_entries
+
+
+def write_example_multi_group_runner_config(config_filepath_or_file: Union[str, TextIO]) -> None:
+    if isinstance(config_filepath_or_file, str):
+        with open(config_filepath_or_file, "w", encoding="utf-8") as config_file:
+            dump_config_as_yaml(MULTI_GROUP_RUNNER_EXAMPLE_CONFIG, config_file)
+    else:
+        config_file = config_filepath_or_file
+        dump_config_as_yaml(MULTI_GROUP_RUNNER_EXAMPLE_CONFIG, config_file)
@@ -0,0 +1,32 @@
+import zlib
+
+
+class Shard:
+    """One of `count` disjoint slices of all projects, numbered from 1 to `count` like GitLab CI parallel jobs.
+
+    Projects are assigned to shards by a hash of their id, which does not depend on the Python process (unlike
+    `hash()` of strings), so independent processes on different hosts agree on the partition.
+    """
+
+    def __init__(self, index: int, count: int):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError("The shard index must be between 1 and the shard count.")
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, shard_str: str) -> "Shard":
+        """Parse a shard of the form `INDEX/COUNT`, for example `2/4`."""
+        index_str, separator, count_str = shard_str.partition("/")
+        if not separator or not index_str.isdigit() or not count_str.isdigit():
+            raise ValueError('"{}" is not of the form INDEX/COUNT.'.format(shard_str))
+        return cls(int(index_str), int(count_str))
+
+    def contains(self, project_id: int) -> bool:
+        return zlib.crc32(str(project_id).encode("ascii")) % self.count == self.index - 1
+
+    def __str__(self) -> str:
+        return "{}/{}".format(self.index, self.count)
+
+    def __repr__(self) -> str:
+        return "<Shard {}>".format(self)
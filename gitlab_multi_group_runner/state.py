@@ -0,0 +1,72 @@
+import base64
+import json
+import os
+import tempfile
+from typing import Any, Dict, Iterable, Optional, Tuple, cast
+
+from .shard import Shard
+
+
+def load_json_file(filepath: str) -> Optional[Any]:
+    """Return the content of the JSON file `filepath` or `None` if it does not exist or is not readable."""
+    try:
+        with open(filepath, "r", encoding="utf-8") as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json_file(filepath: str, content: Any) -> None:
+    dirpath = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(dirpath, mode=0o700, exist_ok=True)
+    # Write to a temporary file first, so an interrupted run never leaves a partially written file
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=dirpath, delete=False) as json_file:
+        json.dump(content, json_file, indent=2, sort_keys=True)
+    os.replace(json_file.name, filepath)
+
+
+def get_last_run_key(config_repos: Iterable[Tuple[str, str]], shard: Optional[Shard]) -> str:
+    """Return the run state key of runs of the given config repositories (paths and branches) and `shard`."""
+    return "{}|shard:{}".format(
+        ",".join(sorted("{}:{}".format(path, branch) for path, branch in set(config_repos))),
+        shard if shard is not None else "all",
+    )
+
+
+class RunState:
+    """State which is kept between runs: downloaded config files with their commit ids and the last runs.
+
+    The last run is kept per key (see `get_last_run_key`), so runs of different shards or config repositories which
+    share a cache directory do not replace each other's last run.
+    """
+
+    def __init__(self, filepath: str):
+        self._filepath = filepath
+        state = load_json_file(filepath)
+        self._state: Dict[str, Any] = state if isinstance(state, dict) else {}
+        self._state.setdefault("config_files", {})
+        self._state.setdefault("last_runs", {})
+        # Older versions kept a single last run of any shard and config repositories, it cannot be assigned to a key
+        self._state.pop("last_run", None)
+
+    def get_config_file(self, key: str, commit_id: str) -> Optional[bytes]:
+        """Return the stored content of the config file `key` if it was stored for the commit `commit_id`."""
+        config_file = self._state["config_files"].get(key)
+        if config_file is None or config_file["commit_id"] != commit_id:
+            return None
+        return base64.b64decode(config_file["content"])
+
+    def set_config_file(self, key: str, commit_id: str, content: bytes) -> None:
+        self._state["config_files"][key] = {
+            "commit_id": commit_id,
+            "content": base64.b64encode(content).decode("ascii"),
+        }
+
+    def get_last_run(self, key: str) -> Optional[Dict[str, Any]]:
+        return cast(Optional[Dict[str, Any]], self._state["last_runs"].get(key))
+
+    def set_last_run(self, key: str, last_run: Dict[str, Any]) -> None:
+        self._state["last_runs"][key] = last_run
+
+    def save(self) -> None:
+        write_json_file(self._filepath, self._state)
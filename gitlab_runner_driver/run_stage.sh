@@ -6,6 +6,63 @@ if [[ -z "${BUILD_FAILURE_EXIT_CODE}" ]]; then
 fi
 
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
+# Seconds to wait for a connection to the daemon and for its complete answer (the reconciliation of a config repository
+# can take a while), `GITLAB_MULTI_GROUP_RUNNER_DAEMON_TIMEOUT` overrides the latter
+DAEMON_CONNECT_TIMEOUT=10
+DEFAULT_DAEMON_TIMEOUT=3600
+CURL_TIMEOUT_EXIT_CODE=28
+
+
+get_shard () {
+    # Print the shard of a parallel CI job (`parallel: N` in `.gitlab-ci.yml`) as `INDEX/COUNT` or nothing if the job
+    # is not run in parallel
+    if [[ -n "${CUSTOM_ENV_CI_NODE_TOTAL}" && "${CUSTOM_ENV_CI_NODE_TOTAL}" -gt 1 ]]; then
+        echo "${CUSTOM_ENV_CI_NODE_INDEX}/${CUSTOM_ENV_CI_NODE_TOTAL}"
+    fi
+}
+
+
+reconcile_with_daemon () {
+    # Ask a running `gitlab-multi-group-runner --serve` process to configure the given config repository (optionally
+    # only one shard of its projects and optionally as dry run), print its log messages and return its exit code (or
+    # `255` if the daemon could not be reached or did not answer in time)
+    local config_repository_path
+    local shard
+    local dry_run
+    local headers_file
+    local curl_exit_code
+    local exit_code
+    declare -a request_args
+
+    config_repository_path="$1"
+    shard="$2"
+    dry_run="$3"
+    if [[ -n "${shard}" ]]; then
+        request_args+=( --data-urlencode "shard=${shard}" )
+    fi
+    if [[ "${dry_run}" == "true" ]]; then
+        request_args+=( --data-urlencode "dry_run=true" )
+    fi
+    headers_file="$(mktemp)" || return 255
+    curl --silent --show-error --fail \
+         --connect-timeout "${DAEMON_CONNECT_TIMEOUT}" \
+         --max-time "${GITLAB_MULTI_GROUP_RUNNER_DAEMON_TIMEOUT:-${DEFAULT_DAEMON_TIMEOUT}}" \
+         --dump-header "${headers_file}" \
+         --data-urlencode "config_repo=${config_repository_path}" \
+         "${request_args[@]}" \
+         "http://${GITLAB_MULTI_GROUP_RUNNER_DAEMON}/reconcile"
+    curl_exit_code="$?"
+    if (( curl_exit_code != 0 )); then
+        if (( curl_exit_code == CURL_TIMEOUT_EXIT_CODE )); then
+            >&2 echo "The daemon at \"${GITLAB_MULTI_GROUP_RUNNER_DAEMON}\" did not answer in time."
+        fi
+        rm -f "${headers_file}"
+        return 255
+    fi
+    exit_code="$(sed -n 's/^X-Exit-Code: *\([0-9]*\).*$/\1/Ip' "${headers_file}")"
+    rm -f "${headers_file}"
+    return "${exit_code:-255}"
+}
 
 
 main () {
@@ -13,6 +70,11 @@ main () {
     declare -a gitlab_multi_group_runner_args
     local runner_script
     local runner_stage
+    local shard
+    local daemon_shard
+    local dry_run
+    local use_daemon
+    local i
 
     args=( "$@" )
     gitlab_multi_group_runner_args=( "${args[@]:0:$(( ${#args[@]} - 2 ))}" )
@@ -25,6 +87,53 @@ main () {
             bash "${runner_script}" || return "${BUILD_FAILURE_EXIT_CODE}"
             ;;
         build_script|step_script)
+            shard="$(get_shard)"
+            daemon_shard="${shard}"
+            dry_run="false"
+            use_daemon="false"
+            if [[ -n "${GITLAB_MULTI_GROUP_RUNNER_DAEMON}" ]]; then
+                use_daemon="true"
+            fi
+            # Only `--dry-run` and `--shard` can be passed on to the daemon, other `run_args` need a direct run
+            for (( i = 0; i < ${#gitlab_multi_group_runner_args[@]}; ++i )); do
+                case "${gitlab_multi_group_runner_args[i]}" in
+                    -n|--dry-run)
+                        dry_run="true"
+                        ;;
+                    --shard)
+                        (( ++i ))
+                        daemon_shard="${shard:-${gitlab_multi_group_runner_args[i]}}"
+                        ;;
+                    --shard=*)
+                        daemon_shard="${shard:-${gitlab_multi_group_runner_args[i]#--shard=}}"
+                        ;;
+                    *)
+                        if [[ "${use_daemon}" == "true" ]]; then
+                            >&2 echo "The daemon does not support \"${gitlab_multi_group_runner_args[i]}\"," \
+                                     "running directly."
+                        fi
+                        use_daemon="false"
+                        ;;
+                esac
+            done
+            if [[ "${use_daemon}" == "true" ]]; then
+                reconcile_with_daemon "${CUSTOM_ENV_CI_PROJECT_PATH}" "${daemon_shard}" "${dry_run}"
+                case "$?" in
+                    0)
+                        return 0
+                        ;;
+                    255)
+                        >&2 echo "Could not use the daemon at \"${GITLAB_MULTI_GROUP_RUNNER_DAEMON}\"," \
+                                 "running directly."
+                        ;;
+                    *)
+                        return "${BUILD_FAILURE_EXIT_CODE}"
+                        ;;
+                esac
+            fi
+            if [[ -n "${shard}" ]]; then
+                gitlab_multi_group_runner_args+=( --shard "${shard}" )
+            fi
             CLICOLOR_FORCE=1 \
             TERM=ansi \
             "${SCRIPT_DIR}/gitlab-multi-group-runner" \
@@ -66,7 +66,7 @@ long_description = get_long_description_from_readme()
 setup(
     name="gitlab-multi-group-runner",
     version=version,
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks"]),
     python_requires="~=3.6",
     install_requires=["cerberus", "python-gitlab", "pyyaml", "yacl[colored_exceptions]"],
     entry_points={
@@ -0,0 +1,19 @@
+import threading
+
+import pytest
+
+from gitlab_multi_group_runner.async_gitlab import AsyncGitlab
+
+
+def test_close_stops_event_loop_and_http_threads() -> None:
+    gitlab = AsyncGitlab("http://127.0.0.1:1", "token", max_workers=2)
+
+    async def get_thread_name() -> str:
+        return await gitlab._http(lambda: threading.current_thread().name)
+
+    assert gitlab._run(get_thread_name()).startswith("gitlab-http")
+    gitlab.close()
+    assert not any(thread.name == "gitlab-event-loop" for thread in threading.enumerate())
+    assert not any(thread.name.startswith("gitlab-http") for thread in threading.enumerate())
+    with pytest.raises(RuntimeError):
+        gitlab._http_executor.submit(lambda: None)
@@ -0,0 +1,108 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+from requests import Session
+
+from gitlab_multi_group_runner.cache import CachingHTTPAdapter, ResponseCache
+from gitlab_multi_group_runner.profiling import Profiler
+from gitlab_multi_group_runner.ratelimit import RateLimiter
+
+ETAG = '"projects-1"'
+
+
+class ETagHandler(BaseHTTPRequestHandler):
+    def _send_empty_response(self, status_code: int) -> None:
+        self.send_response(status_code)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        if self.headers.get("If-None-Match") == ETAG:
+            self._send_empty_response(304)
+            return
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self) -> None:
+        self._send_empty_response(200)
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._send_empty_response(201)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def base_url() -> Iterator[str]:
+    server = HTTPServer(("127.0.0.1", 0), ETagHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path: Path) -> ResponseCache:
+    return ResponseCache(str(tmp_path))
+
+
+@pytest.fixture
+def session(cache: ResponseCache) -> Session:
+    session = Session()
+    session.mount("http://", CachingHTTPAdapter(cache, RateLimiter()))
+    return session
+
+
+def test_not_modified_response_is_replaced_by_cached_response(
+    base_url: str, cache: ResponseCache, session: Session
+) -> None:
+    assert session.get(base_url + "/api/v4/projects").json() == []
+    response = session.get(base_url + "/api/v4/projects")
+    assert response.status_code == 200
+    assert response.json() == []
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.parametrize(
+    "method, path",
+    [
+        ("HEAD", "/api/v4/projects"),
+        ("POST", "/api/graphql"),
+        ("POST", "/api/v4/projects/1/runners"),
+    ],
+)
+def test_read_only_and_unrelated_requests_keep_cache(
+    base_url: str, cache: ResponseCache, session: Session, method: str, path: str
+) -> None:
+    session.get(base_url + "/api/v4/projects")
+    session.request(method, base_url + path, json={"query": "{ currentUser { id } }"})
+    session.get(base_url + "/api/v4/projects")
+    assert cache.hits == 1
+
+
+def test_modifying_request_invalidates_cache(base_url: str, cache: ResponseCache, session: Session) -> None:
+    session.get(base_url + "/api/v4/projects")
+    session.post(base_url + "/api/v4/projects", json={"name": "new-project"})
+    session.get(base_url + "/api/v4/projects")
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_not_modified_responses_are_profiled_without_bytes(base_url: str, session: Session) -> None:
+    profiler = Profiler()
+    session.hooks["response"].append(lambda response, *args, **kwargs: profiler.record_response(response, "/api/v4"))
+    for _ in range(3):
+        session.get(base_url + "/api/v4/projects")
+    endpoint_profile = profiler.to_dict()["endpoints"]["GET /projects"]
+    assert (endpoint_profile["requests"], endpoint_profile["not_modified"], endpoint_profile["bytes"]) == (3, 2, 2)
@@ -0,0 +1,54 @@
+import threading
+from typing import Iterator, List, Optional, Tuple
+from urllib.request import urlopen
+
+import pytest
+
+from gitlab_multi_group_runner.daemon import EXIT_CODE_HEADER, RECONCILE_PATH, ReconciliationDaemon
+from gitlab_multi_group_runner.shard import Shard
+
+ReconcileCall = Tuple[Optional[str], Optional[str], bool]
+
+
+@pytest.fixture
+def daemon_calls() -> Iterator[Tuple[str, List[ReconcileCall]]]:
+    calls: List[ReconcileCall] = []
+
+    def reconcile(config_repository_path: Optional[str], shard: Optional[Shard], dry_run: bool) -> int:
+        calls.append((config_repository_path, str(shard) if shard is not None else None, dry_run))
+        return 0
+
+    daemon = ReconciliationDaemon(("127.0.0.1", 0), reconcile)
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    yield "http://{}:{}{}".format(*daemon.server_address, RECONCILE_PATH), calls
+    daemon._http_server.shutdown()
+
+
+@pytest.mark.parametrize(
+    "body, call",
+    [
+        (b"", (None, None, False)),
+        (b"config_repo=admin%2Frunners", ("admin/runners", None, False)),
+        (b"config_repo=admin%2Frunners&shard=2%2F3&dry_run=true", ("admin/runners", "2/3", True)),
+        (b"dry_run=false", (None, None, False)),
+    ],
+)
+def test_reconcile_request_passes_parameters(
+    daemon_calls: Tuple[str, List[ReconcileCall]], body: bytes, call: ReconcileCall
+) -> None:
+    url, calls = daemon_calls
+    with urlopen(url, data=body) as response:
+        assert response.headers[EXIT_CODE_HEADER] == "0"
+    assert calls == [call]
+
+
+def test_close_is_called_when_the_daemon_stops() -> None:
+    closed = threading.Event()
+    daemon = ReconciliationDaemon(("127.0.0.1", 0), lambda *args: 0, close=closed.set)
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    assert not closed.is_set()
+    daemon._http_server.shutdown()
+    thread.join(timeout=5)
+    assert closed.is_set()
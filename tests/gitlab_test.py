@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Iterator, List, Optional, cast
+
+import pytest
+from gitlab.v4.objects import Group as GitlabGroup
+
+from benchmarks.fake_gitlab import (
+    CONFIG_REPO_BRANCH,
+    CONFIG_REPO_PATH,
+    MAINTAINERS_GROUP_PATH,
+    FakeGitlabData,
+    FakeGitlabServer,
+)
+from gitlab_multi_group_runner.gitlab import Gitlab, NoMatchingProjectError, assign_multi_group_runner
+from gitlab_multi_group_runner.gitlab import logger as gitlab_module_logger
+from gitlab_multi_group_runner.log_buffer import PACKAGE_LOGGER_NAME
+from gitlab_multi_group_runner.ratelimit import logger as ratelimit_module_logger
+
+MAINTAINER = 40
+
+
+class FakeMemberManager:
+    """Replacement of `group.members_all` which counts requests and waits until `barrier` is passed."""
+
+    def __init__(self, barrier: threading.Barrier) -> None:
+        self.request_count = 0
+        self._barrier = barrier
+
+    def list(self, **kwargs: Any) -> List[SimpleNamespace]:
+        self.request_count += 1
+        self._barrier.wait()
+        return [SimpleNamespace(id=1, access_level=MAINTAINER), SimpleNamespace(id=2, access_level=30)]
+
+
+@pytest.fixture
+def gitlab() -> Gitlab:
+    return Gitlab("http://127.0.0.1:1", "token", max_workers=4)
+
+
+def test_get_member_ids_fetches_different_groups_concurrently(gitlab: Gitlab) -> None:
+    # Both fetches must be in progress at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    groups = [
+        cast(GitlabGroup, SimpleNamespace(id=group_id, members_all=FakeMemberManager(barrier))) for group_id in (1, 2)
+    ]
+    assert gitlab.map_concurrently(lambda group: gitlab.get_member_ids(group), groups) == [frozenset((1,))] * 2
+
+
+def test_get_member_ids_fetches_each_group_once(gitlab: Gitlab) -> None:
+    barrier = threading.Barrier(1)
+    member_manager = FakeMemberManager(barrier)
+    group = cast(GitlabGroup, SimpleNamespace(id=1, members_all=member_manager))
+    assert gitlab.map_concurrently(lambda _: gitlab.get_member_ids(group), range(8)) == [frozenset((1,))] * 8
+    assert member_manager.request_count == 1
+
+
+@pytest.fixture
+def fake_gitlab_server() -> Iterator[FakeGitlabServer]:
+    data = FakeGitlabData(runners=1, projects=8, groups=4)
+    # The maintainers are no members of the last two groups, so their projects are not allowed unless the group is
+    # shared with the maintainers group
+    for group_path in ("group-003", "group-004"):
+        data.members_by_group_id[data.group_ids_by_path[group_path]] = []
+    data.groups[data.group_ids_by_path["group-004"]]["shared_with_groups"] = [
+        {"group_id": data.group_ids_by_path[MAINTAINERS_GROUP_PATH], "group_full_path": MAINTAINERS_GROUP_PATH}
+    ]
+    server = FakeGitlabServer(("127.0.0.1", 0), data)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_precomputed_allowed_projects_only_list_members_of_shared_groups(fake_gitlab_server: FakeGitlabServer) -> None:
+    run_without_warnings = assign_multi_group_runner(
+        "http://127.0.0.1:{}".format(fake_gitlab_server.server_address[1]),
+        "token",
+        [1],
+        CONFIG_REPO_PATH,
+        CONFIG_REPO_BRANCH,
+        {"one_member_of": [MAINTAINERS_GROUP_PATH]},
+        disable_shared_runners=False,
+        dry_run=True,
+        precompute_allowed_projects=True,
+    )
+    assert not run_without_warnings
+    request_counts = fake_gitlab_server.get_request_counts()
+    # Only the groups of projects which are not accessible by the maintainers are checked for sharing, and only the
+    # two projects of the shared group `group-004` are checked by listing their members
+    assert request_counts["GET /groups/:id"] == 2
+    assert request_counts["GET /projects/:id/members/all"] == 2
+
+
+@pytest.mark.parametrize("group_access, is_allowed", [(MAINTAINER, True), (30, False)])
+def test_precomputed_allowed_projects_check_members_of_shared_projects(
+    fake_gitlab_server: FakeGitlabServer, group_access: int, is_allowed: bool
+) -> None:
+    data = fake_gitlab_server.data
+    # The maintainers are no members of `group-003`, but one of its projects is shared with the maintainers group
+    shared_project_id, other_project_id = data.project_ids_by_group_id[data.group_ids_by_path["group-003"]]
+    data.share_project(shared_project_id, data.group_ids_by_path[MAINTAINERS_GROUP_PATH], group_access)
+    assign_multi_group_runner(
+        "http://127.0.0.1:{}".format(fake_gitlab_server.server_address[1]),
+        "token",
+        [1],
+        CONFIG_REPO_PATH,
+        CONFIG_REPO_BRANCH,
+        {"one_member_of": [MAINTAINERS_GROUP_PATH]},
+        disable_shared_runners=False,
+        precompute_allowed_projects=True,
+    )
+    assert data.runner_ids_by_project_id[shared_project_id] == ({1} if is_allowed else set())
+    assert data.runner_ids_by_project_id[other_project_id] == set()
+
+
+def test_streamed_run_without_changes_is_reported_once(
+    fake_gitlab_server: FakeGitlabServer, caplog: pytest.LogCaptureFixture
+) -> None:
+    for _ in range(2):
+        caplog.clear()
+        with caplog.at_level(logging.INFO, logger=gitlab_module_logger.name):
+            assign_multi_group_runner(
+                "http://127.0.0.1:{}".format(fake_gitlab_server.server_address[1]),
+                "token",
+                [1],
+                CONFIG_REPO_PATH,
+                CONFIG_REPO_BRANCH,
+                {"one_member_of": [MAINTAINERS_GROUP_PATH]},
+                disable_shared_runners=False,
+                stream_changes=True,
+            )
+    # Every group is streamed as a separate page, but only the run is reported
+    assert caplog.messages.count("All runners are already configured, nothing to change") == 1
+
+
+@pytest.mark.parametrize("membership_cache_ttl, fetch_count", [(None, 2), (3600, 1), (0, 2)])
+def test_start_run_keeps_user_lookups_for_membership_cache_ttl(
+    membership_cache_ttl: Optional[float], fetch_count: int
+) -> None:
+    gitlab = Gitlab("http://127.0.0.1:1", "token", membership_cache_ttl=membership_cache_ttl)
+    fetched_users: List[str] = []
+
+    def fetch_user() -> str:
+        fetched_users.append("maintainer")
+        return "maintainer"
+
+    for _ in range(2):
+        gitlab.start_run()
+        assert gitlab._get_cached(("user", "maintainer"), fetch_user) == "maintainer"
+    assert len(fetched_users) == fetch_count
+
+
+@pytest.mark.parametrize("module_logger", [gitlab_module_logger, ratelimit_module_logger])
+def test_map_concurrently_logs_in_order_of_items(
+    gitlab: Gitlab, caplog: pytest.LogCaptureFixture, module_logger: logging.Logger
+) -> None:
+    def check_project(project_number: int) -> int:
+        # Later items finish first
+        time.sleep(0.01 * (4 - project_number))
+        module_logger.debug("Checked project %d", project_number)
+        return project_number
+
+    with caplog.at_level(logging.DEBUG, logger=PACKAGE_LOGGER_NAME):
+        assert gitlab.map_concurrently(check_project, range(4)) == [0, 1, 2, 3]
+    assert caplog.messages == ["Checked project {}".format(i) for i in range(4)]
+
+
+def test_map_concurrently_raises_errors_of_workers(gitlab: Gitlab) -> None:
+    def check_project(project_number: int) -> int:
+        if project_number == 2:
+            raise NoMatchingProjectError("project {}".format(project_number))
+        return project_number
+
+    with pytest.raises(NoMatchingProjectError):
+        gitlab.map_concurrently(check_project, range(4))
@@ -0,0 +1,133 @@
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, List, Set, cast
+
+import pytest
+from gitlab.exceptions import GitlabHttpError
+from gitlab.v4.objects import Group as GitlabGroup
+
+from benchmarks.fake_gitlab import (
+    CONFIG_REPO_BRANCH,
+    CONFIG_REPO_PATH,
+    MAINTAINER_ACCESS,
+    MAINTAINERS_GROUP_PATH,
+    FakeGitlabData,
+    FakeGitlabServer,
+)
+from gitlab_multi_group_runner.gitlab import Gitlab, assign_multi_group_runner
+from gitlab_multi_group_runner.graphql_gitlab import MAX_FAILED_QUERIES_IN_A_ROW, GraphQLError, GraphQLGitlab
+from gitlab_multi_group_runner.records import ProjectRecord
+
+
+class FailingGraphQLGitlab(GraphQLGitlab):
+    """GraphQL backend whose queries always fail with `error`."""
+
+    def __init__(self, error: Exception) -> None:
+        super().__init__("http://127.0.0.1:1", "token")
+        self.error = error
+        self.query_count = 0
+
+    def _query(self, query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        self.query_count += 1
+        raise self.error
+
+
+@pytest.fixture
+def rest_listing(monkeypatch: pytest.MonkeyPatch) -> None:
+    def list_group_projects(self: Gitlab, group: GitlabGroup, include_subgroups: bool = False) -> List[ProjectRecord]:
+        return []
+
+    monkeypatch.setattr(Gitlab, "_list_group_projects", list_group_projects)
+
+
+def list_groups(gitlab: GraphQLGitlab, count: int) -> None:
+    for group_id in range(count):
+        group = cast(GitlabGroup, SimpleNamespace(id=group_id, full_path="group-{}".format(group_id)))
+        assert gitlab._list_group_projects(group) == []
+
+
+@pytest.mark.usefixtures("rest_listing")
+@pytest.mark.parametrize(
+    "error",
+    [GitlabHttpError("403 Forbidden", response_code=403), GitlabHttpError("502 Bad Gateway", response_code=502)],
+)
+def test_repeated_query_failures_suspend_graphql_until_next_run(error: Exception) -> None:
+    gitlab = FailingGraphQLGitlab(error)
+    list_groups(gitlab, 10)
+    assert gitlab.query_count == MAX_FAILED_QUERIES_IN_A_ROW
+    gitlab.start_run()
+    list_groups(gitlab, 1)
+    assert gitlab.query_count == MAX_FAILED_QUERIES_IN_A_ROW + 1
+
+
+@pytest.mark.usefixtures("rest_listing")
+def test_schema_errors_disable_graphql_for_good() -> None:
+    gitlab = FailingGraphQLGitlab(GraphQLError("Field 'projectMembers' doesn't exist on type", schema_error=True))
+    list_groups(gitlab, 3)
+    gitlab.start_run()
+    list_groups(gitlab, 3)
+    assert gitlab.query_count == 1
+
+
+@pytest.mark.usefixtures("rest_listing")
+def test_successful_query_resets_failure_count() -> None:
+    gitlab = FailingGraphQLGitlab(GitlabHttpError("502 Bad Gateway", response_code=502))
+    list_groups(gitlab, MAX_FAILED_QUERIES_IN_A_ROW - 1)
+    gitlab._handle_query_success()
+    list_groups(gitlab, MAX_FAILED_QUERIES_IN_A_ROW - 1)
+    # No listing was suspended, since the failures were not in a row
+    assert gitlab.query_count == 2 * (MAX_FAILED_QUERIES_IN_A_ROW - 1)
+
+
+def assign_runners_with_shared_project(backend: str, stream_changes: bool) -> Dict[int, Set[int]]:
+    data = FakeGitlabData(runners=2, projects=120, groups=2)
+    # The project of an unconfigured group is shared with a configured group, the maintainers are only members of the
+    # project through the shared group
+    external_group_id = data._add_group("external", [])
+    shared_project_id = data._add_project("shared-project", data.get_group_namespace(external_group_id))
+    data.share_project(shared_project_id, data.group_ids_by_path["group-001"], MAINTAINER_ACCESS)
+    server = FakeGitlabServer(("127.0.0.1", 0), data)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        assert assign_multi_group_runner(
+            "http://127.0.0.1:{}".format(server.server_address[1]),
+            "token",
+            list(data.runners),
+            CONFIG_REPO_PATH,
+            CONFIG_REPO_BRANCH,
+            {"one_member_of": [MAINTAINERS_GROUP_PATH]},
+            disable_shared_runners=False,
+            backend=backend,
+            stream_changes=stream_changes,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert data.runner_ids_by_project_id[shared_project_id] == set(data.runners)
+    return data.runner_ids_by_project_id
+
+
+@pytest.mark.parametrize("stream_changes", [False, True])
+def test_graphql_and_rest_backends_assign_the_same_runners(stream_changes: bool) -> None:
+    assert assign_runners_with_shared_project("graphql", stream_changes) == assign_runners_with_shared_project(
+        "sync", stream_changes
+    )
+
+
+def test_failed_stream_page_is_continued_with_rest_api(monkeypatch: pytest.MonkeyPatch) -> None:
+    query = GraphQLGitlab._query
+    failed_cursors: List[str] = []
+
+    def fail_first_next_page(self: GraphQLGitlab, query_string: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        if variables["after"] is not None and not failed_cursors:
+            failed_cursors.append(variables["after"])
+            raise GitlabHttpError("502 Bad Gateway", response_code=502)
+        return query(self, query_string, variables)
+
+    monkeypatch.setattr(GraphQLGitlab, "_query", fail_first_next_page)
+    # The first page of the group is configured from GraphQL, the whole group is listed again with the REST API
+    assert assign_runners_with_shared_project("graphql", stream_changes=True) == assign_runners_with_shared_project(
+        "sync", stream_changes=True
+    )
+    assert len(failed_cursors) == 1
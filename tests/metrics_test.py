@@ -0,0 +1,16 @@
+from gitlab_multi_group_runner.metrics import format_openmetrics
+from gitlab_multi_group_runner.profiling import Profiler
+from gitlab_multi_group_runner.shard import Shard
+
+
+def test_all_samples_of_sharded_runs_have_shard_label() -> None:
+    profiler = Profiler()
+    profiler.add_count("scanned_projects", 3)
+    samples = [line for line in format_openmetrics(profiler, 0, Shard(1, 3)).splitlines() if not line.startswith("#")]
+    assert samples
+    assert all('shard="1/3"' in sample for sample in samples)
+    assert 'gitlab_multi_group_runner_projects_scanned{shard="1/3"} 3' in samples
+
+
+def test_samples_of_unsharded_runs_have_no_shard_label() -> None:
+    assert "shard" not in format_openmetrics(Profiler(), 0)
@@ -0,0 +1,109 @@
+from typing import List
+
+import pytest
+
+from gitlab_multi_group_runner.patterns import PathPattern, ProjectPathIndex, _get_regex_prefix, is_path_pattern
+from gitlab_multi_group_runner.records import ProjectRecord
+
+PROJECT_PATHS = [
+    "physics/sim",
+    "physics/lab-sim",
+    "physics/lab-data",
+    "physics/theory/qft",
+    "physics/theory/strings/m-theory",
+    "physics-archive/sim",
+    "lab-1/tools",
+    "lab-1/data/raw",
+    "lab-12/tools",
+    "lab-x/tools",
+    "alice/solo",
+    "alice/sim",
+    "a.b/c",
+    "axb/c",
+]
+
+
+@pytest.fixture(scope="module")
+def projects() -> List[ProjectRecord]:
+    return [
+        ProjectRecord(project_id, path, path.rsplit("/", 1)[0], True)
+        for project_id, path in enumerate(PROJECT_PATHS, start=1)
+    ]
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        # Plain paths
+        "physics/sim",
+        "physics/theory/qft",
+        "physics/missing",
+        # `*`, `?` and `[...]` globs
+        "physics/*",
+        "physics/lab-*",
+        "*/sim",
+        "*/*/qft",
+        "lab-?/tools",
+        "lab-??/tools",
+        "lab-[0-9]/*",
+        "/physics/*/",
+        # `**` globs
+        "physics/**",
+        "**/sim",
+        "**/tools",
+        "physics/**/qft",
+        "**",
+        "**/theory/**",
+        # Anchored regular expressions
+        "re:^physics/",
+        "re:^lab-\\d+/",
+        "re:^lab-1",
+        "re:^physics/theory/",
+        "re:^a\\.b/",
+        "re:^physics/lab-(sim|data)$",
+        "re:^phy?sics/sim$",
+        # Unanchored regular expressions
+        "re:sim$",
+        "re:/tools$",
+        "re:theory",
+        "re:a.b/c",
+        "re:^alice/|^lab-x/",
+    ],
+)
+def test_index_matches_like_path_pattern(projects: List[ProjectRecord], pattern: str) -> None:
+    path_pattern = PathPattern(pattern)
+    expected_paths = sorted(
+        project.path_with_namespace for project in projects if path_pattern.matches(project.path_with_namespace)
+    )
+    matched_paths = [project.path_with_namespace for project in ProjectPathIndex(projects).match(path_pattern)]
+    assert matched_paths == expected_paths
+
+
+def test_index_counts_projects(projects: List[ProjectRecord]) -> None:
+    assert len(ProjectPathIndex(projects)) == len(PROJECT_PATHS)
+
+
+@pytest.mark.parametrize(
+    "regex, prefix",
+    [
+        ("^lab-\\d+/", "lab-"),
+        ("^physics/theory/", "physics/theory/"),
+        ("^a\\.b/", "a.b/"),
+        ("^phy?sics", "ph"),
+        ("^physics*", "physic"),
+        ("^lab-x{2}", "lab-"),
+        ("^alice/|^bob/", ""),
+        ("physics/", ""),
+        ("^(physics)/", ""),
+    ],
+)
+def test_get_regex_prefix(regex: str, prefix: str) -> None:
+    assert _get_regex_prefix(regex) == prefix
+
+
+@pytest.mark.parametrize(
+    "group_or_project, expected",
+    [("physics", False), ("physics/sim", False), ("physics/*", True), ("lab-?", True), ("re:^lab-", True)],
+)
+def test_is_path_pattern(group_or_project: str, expected: bool) -> None:
+    assert is_path_pattern(group_or_project) is expected
@@ -0,0 +1,175 @@
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+
+import pytest
+from gitlab.exceptions import GitlabHttpError
+from requests import Response
+
+from gitlab_multi_group_runner import ratelimit
+from gitlab_multi_group_runner.gitlab import Gitlab
+from gitlab_multi_group_runner.ratelimit import DEFAULT_RETRY_LIMIT, RateLimiter, parse_retry_after
+
+START_TIME = datetime(2021, 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+class FakeTime:
+    """Replacement of the `time` module whose clock only advances when sleeping.
+
+    The monotonic clock starts at `monotonic_start`, the wall clock at `START_TIME`.
+    """
+
+    def __init__(self, monotonic_start: float = 0.0) -> None:
+        self.now = monotonic_start
+        self._wall_clock_offset = START_TIME - monotonic_start
+        self.sleeps: List[float] = []
+
+    def time(self) -> float:
+        return self.now + self._wall_clock_offset
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_time(monkeypatch: pytest.MonkeyPatch) -> FakeTime:
+    fake_time = FakeTime()
+    monkeypatch.setattr(ratelimit, "time", fake_time)
+    return fake_time
+
+
+def create_response(headers: Dict[str, str]) -> Response:
+    response = Response()
+    response.status_code = 200
+    response.headers.update(headers)
+    return response
+
+
+@pytest.mark.parametrize(
+    "retry_after, seconds",
+    [
+        (None, None),
+        ("", None),
+        ("5", 5.0),
+        ("1.5", 1.5),
+        ("-3", 0.0),
+        ("Fri, 01 Jan 2021 00:00:30 GMT", 30.0),
+        ("Thu, 31 Dec 2020 23:59:00 GMT", 0.0),
+        ("soon", None),
+    ],
+)
+def test_parse_retry_after(fake_time: FakeTime, retry_after: Optional[str], seconds: Optional[float]) -> None:
+    assert parse_retry_after(retry_after) == seconds
+
+
+def test_acquire_without_rate_does_not_wait(fake_time: FakeTime) -> None:
+    rate_limiter = RateLimiter()
+    for _ in range(100):
+        rate_limiter.acquire()
+    assert fake_time.sleeps == []
+    assert rate_limiter.request_count == 100
+    assert rate_limiter.throttle_time == 0.0
+
+
+def test_acquire_spaces_requests_by_max_rate(fake_time: FakeTime) -> None:
+    rate_limiter = RateLimiter(max_requests_per_second=10)
+    for _ in range(3):
+        rate_limiter.acquire()
+    assert fake_time.sleeps == pytest.approx([0.1, 0.1])
+    assert rate_limiter.throttle_time == pytest.approx(0.2)
+
+
+def test_acquire_tolerates_rounding_of_large_clocks(monkeypatch: pytest.MonkeyPatch) -> None:
+    fake_time = FakeTime(monotonic_start=START_TIME)
+    monkeypatch.setattr(ratelimit, "time", fake_time)
+    rate_limiter = RateLimiter(max_requests_per_second=10)
+    for _ in range(100):
+        rate_limiter.acquire()
+    assert len(fake_time.sleeps) == 99
+    assert sum(fake_time.sleeps) == pytest.approx(9.9)
+
+
+def test_acquire_waits_for_pause(fake_time: FakeTime) -> None:
+    rate_limiter = RateLimiter()
+    rate_limiter.pause(5)
+    rate_limiter.acquire()
+    assert fake_time.sleeps == pytest.approx([5.0])
+
+
+def test_update_spreads_remaining_requests_over_window(fake_time: FakeTime) -> None:
+    rate_limiter = RateLimiter()
+    rate_limiter.update(
+        create_response({"RateLimit-Remaining": "12", "RateLimit-Reset": str(int(fake_time.time()) + 10)})
+    )
+    for _ in range(3):
+        rate_limiter.acquire()
+    # 10 of the 12 remaining requests (2 are kept in reserve) in 10 seconds
+    assert fake_time.sleeps == pytest.approx([1.0, 1.0])
+
+
+def test_update_keeps_max_rate(fake_time: FakeTime) -> None:
+    rate_limiter = RateLimiter(max_requests_per_second=0.5)
+    rate_limiter.update(
+        create_response({"RateLimit-Remaining": "1000", "RateLimit-Reset": str(int(fake_time.time()) + 10)})
+    )
+    for _ in range(2):
+        rate_limiter.acquire()
+    assert fake_time.sleeps == pytest.approx([2.0])
+
+
+def test_update_pauses_until_reset_when_exhausted(fake_time: FakeTime) -> None:
+    rate_limiter = RateLimiter()
+    rate_limiter.update(
+        create_response({"RateLimit-Remaining": "2", "RateLimit-Reset": str(int(fake_time.time()) + 30)})
+    )
+    rate_limiter.acquire()
+    assert fake_time.sleeps == pytest.approx([30.0])
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [{}, {"RateLimit-Remaining": "5"}, {"RateLimit-Remaining": "many", "RateLimit-Reset": "1609459210"}],
+)
+def test_update_ignores_incomplete_headers(fake_time: FakeTime, headers: Dict[str, str]) -> None:
+    rate_limiter = RateLimiter()
+    rate_limiter.update(create_response(headers))
+    for _ in range(10):
+        rate_limiter.acquire()
+    assert fake_time.sleeps == []
+
+
+class TooManyRequestsHandler(BaseHTTPRequestHandler):
+    request_count = 0
+
+    def do_GET(self) -> None:
+        type(self).request_count += 1
+        self.send_response(429)
+        self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def too_many_requests_server() -> Iterator[HTTPServer]:
+    TooManyRequestsHandler.request_count = 0
+    server = HTTPServer(("127.0.0.1", 0), TooManyRequestsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_rejected_requests_are_only_retried_by_the_adapter(too_many_requests_server: HTTPServer) -> None:
+    gitlab = Gitlab("http://127.0.0.1:{}".format(too_many_requests_server.server_address[1]), "token")
+    with pytest.raises(GitlabHttpError):
+        gitlab._gitlab.http_get("/projects")
+    assert TooManyRequestsHandler.request_count == DEFAULT_RETRY_LIMIT + 1
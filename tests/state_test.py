@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from gitlab_multi_group_runner.shard import Shard
+from gitlab_multi_group_runner.state import RunState, get_last_run_key, write_json_file
+
+
+def test_last_runs_of_shards_and_config_repos_are_kept_apart(tmp_path: Path) -> None:
+    filepath = str(tmp_path / "state.json")
+    keys = [
+        get_last_run_key([("admin/runners", "master")], None),
+        get_last_run_key([("admin/runners", "master")], Shard(1, 2)),
+        get_last_run_key([("admin/runners", "master")], Shard(2, 2)),
+        get_last_run_key([("admin/runners", "master"), ("team/runners", "main")], None),
+    ]
+    assert len(set(keys)) == len(keys)
+    run_state = RunState(filepath)
+    for i, key in enumerate(keys):
+        run_state.set_last_run(key, {"fingerprint": str(i), "run_without_warnings": True})
+    run_state.save()
+    run_state = RunState(filepath)
+    last_runs = [run_state.get_last_run(key) for key in keys]
+    assert [last_run["fingerprint"] if last_run is not None else None for last_run in last_runs] == ["0", "1", "2", "3"]
+
+
+def test_last_run_key_does_not_depend_on_config_repo_order() -> None:
+    config_repos = [("admin/runners", "master"), ("team/runners", "main")]
+    assert get_last_run_key(config_repos, Shard(1, 2)) == get_last_run_key(reversed(config_repos), Shard(1, 2))
+
+
+def test_last_run_of_old_state_files_is_dropped(tmp_path: Path) -> None:
+    filepath = str(tmp_path / "state.json")
+    write_json_file(filepath, {"config_files": {}, "last_run": {"fingerprint": "0", "run_without_warnings": True}})
+    assert RunState(filepath).get_last_run(get_last_run_key([("admin/runners", "master")], None)) is None